@@ -57,7 +57,8 @@
       const t = await postJSON(testUrl, { url });
       try { localStorage.setItem('diceThemeMeta:'+b64url(url), JSON.stringify({ themeColor: t.themeColor || null, materialType: t.materialType || null })); } catch(_){}
       window.dispatchEvent(new CustomEvent('dice:theme-preview', { detail: { url } }));
-      addAlert('success', 'Previewing theme with a d20 roll…');
+      const checked = t.cached ? ` (config checked ${Math.round(t.cacheAge)}s ago)` : '';
+      addAlert('success', `Previewing theme with a d20 roll…${checked}`);
     } catch (e) {
       addAlert('error', e.message);
     } finally {
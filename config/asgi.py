@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Serve the dice theme proxy with its non-blocking views (DICE_THEME_ASYNC_VIEWS).
+os.environ.setdefault('DICE_THEME_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
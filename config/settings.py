@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -91,6 +92,50 @@ LOGOUT_REDIRECT_URL = "login"   # go to login after logout
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# In-process trigram index for /api/search typeahead (falls back to FTS when off or over budget).
+SEARCH_TYPEAHEAD_INDEX = False
+SEARCH_TYPEAHEAD_MAX_ENTRIES = 20_000
+SEARCH_TYPEAHEAD_RECHECK_SECONDS = 2.0
+SEARCH_TYPEAHEAD_MIN_COVERAGE = 0.5
+# Seconds a cached /api/search response may live; writes invalidate it sooner via catalog versions.
+SEARCH_CACHE_TIMEOUT = 300
+
+# Dice theme loading: concurrent upstream fetches per theme load job.
+DICE_THEME_FETCH_WORKERS = 6
+DICE_THEME_FETCH_TIMEOUT = 15
+# Quota for MEDIA_ROOT/dice_theme_cache; least recently used files are evicted past either limit (None: unlimited).
+DICE_THEME_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DICE_THEME_CACHE_MAX_FILES = 20_000
+# Cached assets are revalidated upstream (ETag/Last-Modified) once older than this; also the browser max-age.
+DICE_THEME_CACHE_FRESH_SECONDS = 3600
+# Seconds a 404 or failed upstream fetch is remembered before upstream is asked again.
+DICE_THEME_NEGATIVE_TTL = 60
+# Shared keep-alive pool for outbound theme requests: connections per host, idle seconds kept, connect timeout.
+DICE_THEME_HTTP_POOL_SIZE = 8
+DICE_THEME_HTTP_KEEPALIVE = 60
+DICE_THEME_HTTP_CONNECT_TIMEOUT = 5
+# At most POOL_SIZE fetches per upstream host run at once; others wait this long for a slot, then fail fast.
+DICE_THEME_HTTP_QUEUE_TIMEOUT = 1.0
+# Circuit breaker per upstream host: opens after this many consecutive failures (errors, timeouts, 5xx) and
+# sheds requests (stale cache or a quick 503) until a trial request is allowed after RESET_SECONDS.
+DICE_THEME_BREAKER_FAILURES = 5
+DICE_THEME_BREAKER_RESET_SECONDS = 30
+# Widths (px) PNG/JPEG textures are downscaled to, and the WebP quality of texture variants (needs Pillow).
+DICE_THEME_TEXTURE_WIDTHS = (512, 1024)
+DICE_THEME_WEBP_QUALITY = 90
+# Background theme loads: "thread" runs jobs in each web process; anything else leaves them to
+# `manage.py run_theme_jobs`. Failed loads retry up to MAX_ATTEMPTS times, RETRY_DELAY seconds doubling per
+# attempt (capped at MAX_RETRY_DELAY); running jobs silent for STALE_SECONDS are taken over by another runner.
+DICE_THEME_JOB_RUNNER = "thread"
+DICE_THEME_JOB_MAX_ATTEMPTS = 4
+DICE_THEME_JOB_RETRY_DELAY = 5
+DICE_THEME_JOB_MAX_RETRY_DELAY = 300
+DICE_THEME_JOB_STALE_SECONDS = 300
+# Validated theme.config.json results are reused for this many seconds, then revalidated upstream (ETag/Last-Modified).
+DICE_THEME_CONFIG_TTL = 300
+# Route the dice theme proxy/test/load URLs to their async views; config/asgi.py turns this on for ASGI servers.
+DICE_THEME_ASYNC_VIEWS = os.environ.get("DICE_THEME_ASYNC_VIEWS", "") == "1"
+
 WSGI_APPLICATION = 'config.wsgi.application'
 
 AUTH_USER_MODEL = "accounts.User"
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from django.db import models
+
+from .models import CatalogVersion, Feat, Item, Language, Skill, Spell
+
+# Searchable catalog models, in the order creation_search has always listed them.
+CATALOG_MODELS: dict[str, type[models.Model]] = {
+    "feat": Feat,
+    "spell": Spell,
+    "item": Item,
+    "language": Language,
+    "skill": Skill,
+}
+
+
+def catalog_name(model: type[models.Model]) -> str | None:
+    for name, candidate in CATALOG_MODELS.items():
+        if candidate is model:
+            return name
+    return None
+
+
+def bump_catalog_version(model_name: str) -> int:
+    """Record a write to ``model_name`` and return its new version."""
+    rows = CatalogVersion.objects.filter(model=model_name)
+    if not rows.update(version=models.F("version") + 1):
+        CatalogVersion.objects.get_or_create(model=model_name, defaults={"version": 0})
+        rows.update(version=models.F("version") + 1)
+    return rows.values_list("version", flat=True).get()
+
+
+def catalog_versions() -> dict[str, int]:
+    """Current write counter of every catalog model (missing rows count as 0)."""
+    versions = dict.fromkeys(CATALOG_MODELS, 0)
+    versions.update(CatalogVersion.objects.filter(model__in=CATALOG_MODELS).values_list("model", "version"))
+    return versions
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Any, Iterable
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+
+from .models import Character, CharacterClass, Feat, FeatGrant, FeatGrantClosure
+
+GRANT_MODELS: frozenset[str] = frozenset(code for code, _label in FeatGrant.MODEL_CHOICES)
+
+
+class GrantCycleError(ValidationError):
+    pass
+
+
+def eligible_feats(character: Character | int) -> models.QuerySet[Feat]:
+    """Feats the character meets every prerequisite for and does not already have.
+
+    Resolves as a single SQL query against ``FeatPrerequisite`` and the
+    character's stored level, species, class levels and existing feats.
+    """
+    pk = character.pk if isinstance(character, Character) else int(character)
+    me = Character.objects.filter(pk=pk)
+    owned = Feat.objects.filter(characters=pk).values("pk")
+    class_level_met = models.Exists(
+        CharacterClass.objects.filter(
+            character_id=pk,
+            clazz_id=models.OuterRef("prerequisite__clazz_id"),
+            level__gte=models.OuterRef("prerequisite__class_level"),
+        )
+    )
+    return (
+        Feat.objects.exclude(pk__in=owned)
+        .filter(
+            models.Q(prerequisite__isnull=True)
+            | (
+                models.Q(prerequisite__unsatisfiable=False)
+                & (
+                    models.Q(prerequisite__total_level__isnull=True)
+                    | models.Q(prerequisite__total_level__lte=models.Subquery(me.values("total_level")))
+                )
+                & (
+                    models.Q(prerequisite__species__isnull=True)
+                    | models.Q(prerequisite__species_id=models.Subquery(me.values("species_id")))
+                )
+                & (
+                    models.Q(prerequisite__feature__isnull=True)
+                    | models.Q(prerequisite__feature_id__in=owned)
+                )
+                & (models.Q(prerequisite__clazz__isnull=True) | class_level_met)
+            )
+        )
+    )
+
+
+def parse_grants(raw: Any) -> list[tuple[str, int]]:
+    """Normalize ``Feat.data["grants"]`` into unique ``(model, id)`` pairs, dropping junk."""
+    edges: list[tuple[str, int]] = []
+    if not isinstance(raw, list):
+        return edges
+    for item in raw:
+        if not isinstance(item, dict) or item.get("model") not in GRANT_MODELS:
+            continue
+        try:
+            object_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        edge = (item["model"], object_id)
+        if edge not in edges:
+            edges.append(edge)
+    return edges
+
+
+def check_grant_cycles(feat_id: int | None, raw_grants: Any) -> None:
+    """Raise :class:`GrantCycleError` if granting ``raw_grants`` from ``feat_id`` loops back.
+
+    The feat must not already be reachable from any feat it is about to grant,
+    counting grants that named its id before it existed.
+    """
+    if feat_id is None:
+        return
+    targets = {object_id for model, object_id in parse_grants(raw_grants) if model == "feat"}
+    if targets & grant_ancestor_ids(feat_id):
+        raise GrantCycleError("This feature would grant itself through its grants.")
+
+
+def _descendant_depths(roots: Iterable[int]) -> dict[int, dict[int, int]]:
+    """Shortest grant depth from each root to every feat reachable from it."""
+    roots = set(roots)
+    adjacency: dict[int, list[int]] = {}
+    frontier = set(roots)
+    # One query per level of the grant graph, not per feat.
+    while frontier:
+        rows = FeatGrant.objects.filter(feat_id__in=frontier, model="feat").values_list("feat_id", "object_id")
+        for feat_id in frontier:
+            adjacency.setdefault(feat_id, [])
+        for feat_id, target in rows:
+            adjacency[feat_id].append(target)
+        frontier = {t for targets in adjacency.values() for t in targets} - adjacency.keys()
+    existing = set(Feat.objects.filter(pk__in=adjacency.keys()).values_list("pk", flat=True))
+
+    result: dict[int, dict[int, int]] = {}
+    for root in roots & existing:
+        depths = {root: 0}
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for target in adjacency.get(node, ()):
+                if target in existing and target not in depths:
+                    depths[target] = depths[node] + 1
+                    queue.append(target)
+        result[root] = depths
+    return result
+
+
+def refresh_grant_closure(ancestor_ids: Iterable[int]) -> None:
+    """Rebuild closure rows for ``ancestor_ids`` from the current grant edges."""
+    ancestor_ids = set(ancestor_ids)
+    if not ancestor_ids:
+        return
+    depths = _descendant_depths(ancestor_ids)
+    with transaction.atomic():
+        FeatGrantClosure.objects.filter(ancestor_id__in=ancestor_ids).delete()
+        FeatGrantClosure.objects.bulk_create(
+            [
+                FeatGrantClosure(ancestor_id=root, descendant_id=target, depth=depth)
+                for root, reach in depths.items()
+                for target, depth in reach.items()
+            ],
+            batch_size=1000,
+        )
+
+
+def grant_ancestor_ids(feat_id: int) -> set[int]:
+    """Feats that reach ``feat_id`` through grants, including the feat itself.
+
+    Direct grant edges are consulted too, so feats granting an id that did not
+    exist yet (or no longer exists) are picked up.
+    """
+    parents = set(FeatGrant.objects.filter(model="feat", object_id=feat_id).values_list("feat_id", flat=True))
+    ids = set(
+        FeatGrantClosure.objects.filter(descendant_id__in=parents | {feat_id}).values_list("ancestor_id", flat=True)
+    )
+    return ids | parents | {feat_id}
+
+
+def sync_feat_grants(feat: Feat) -> None:
+    """Store ``feat``'s grant edges and update the closure of everything that reaches it."""
+    edges = parse_grants((feat.data or {}).get("grants"))
+    with transaction.atomic():
+        current = set(FeatGrant.objects.filter(feat=feat).values_list("model", "object_id"))
+        wanted = set(edges)
+        if current == wanted and FeatGrantClosure.objects.filter(ancestor=feat, descendant=feat).exists():
+            return
+        # Checked here rather than before the save, so a new feat is checked
+        # once its id is known; raising rolls back the save with the sync.
+        check_grant_cycles(feat.pk, [{"model": m, "id": i} for m, i in edges])
+        FeatGrant.objects.filter(feat=feat).delete()
+        FeatGrant.objects.bulk_create([FeatGrant(feat=feat, model=m, object_id=i) for m, i in edges])
+        refresh_grant_closure(grant_ancestor_ids(feat.pk))
+
+
+def granted_feats(feat_ids: Iterable[int]) -> models.QuerySet[Feat]:
+    """Every feat in the grant closure of ``feat_ids`` (the feats themselves included)."""
+    return Feat.objects.filter(
+        pk__in=FeatGrantClosure.objects.filter(ancestor_id__in=list(feat_ids)).values("descendant_id")
+    )
+
+
+def granted_features(feat_ids: Iterable[int]) -> models.QuerySet[FeatGrant]:
+    """All grant rows (any model) reachable from ``feat_ids``, in one indexed query."""
+    return FeatGrant.objects.filter(
+        feat_id__in=FeatGrantClosure.objects.filter(ancestor_id__in=list(feat_ids)).values("descendant_id")
+    )
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
+import json
+
 from django import forms
 
 from .models import Feat, Class, Species
+from .feats import check_grant_cycles
+from .modifiers import compile_modifiers
 
 
 class FeatForm(forms.ModelForm):
@@ -54,6 +58,28 @@ class FeatForm(forms.ModelForm):
             ),
         }
 
+    def clean_grants(self) -> str:
+        raw = self.cleaned_data.get("grants")
+        if raw:
+            try:
+                grants = json.loads(raw)
+            except ValueError:
+                raise forms.ValidationError("Grants must be valid JSON.")
+            check_grant_cycles(self.instance.pk, grants)
+        return raw
+
+    def clean_modifiers(self) -> list:
+        raw = self.cleaned_data.get("modifiers")
+        if not raw:
+            return []
+        try:
+            mods = json.loads(raw) or []
+        except ValueError:
+            raise forms.ValidationError("Modifiers must be valid JSON.")
+        # Reject unknown targets/operations now rather than when a sheet renders.
+        compile_modifiers(mods)
+        return mods
+
     def save(self, commit: bool = True) -> Feat:
         feat = super().save(commit=False)
         data: dict = {}
@@ -74,21 +100,14 @@ class FeatForm(forms.ModelForm):
             data["charges"] = cd["charges"]
         if cd.get("recharge_type"):
             data["recharge_type"] = cd["recharge_type"]
-        import json
-
         if cd.get("grants"):
             try:
                 data["grants"] = json.loads(cd["grants"])
             except Exception:
                 pass
         if cd.get("modifiers"):
-            try:
-                mods = json.loads(cd["modifiers"]) or []
-                # Expect list of {target, operation, value}
-                if isinstance(mods, list):
-                    data["modifiers"] = mods
-            except Exception:
-                pass
+            # Validated list of {target, operation, value}
+            data["modifiers"] = cd["modifiers"]
         feat.data = data
         if commit:
             feat.save()
@@ -0,0 +1,94 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Character, CharacterClass, CharacterSkill, Class, Skill
+from core.party import party_stats
+from core.sheet import ABILITIES
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare party_stats() against per-instance Character methods. "
+        "Fixture data is created inside a transaction and rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10, 1000, 50000])
+        parser.add_argument(
+            "--instance-limit",
+            type=int,
+            default=500,
+            help="Time per-instance methods on at most this many characters and extrapolate.",
+        )
+
+    def handle(self, *args, **options):
+        for size in options["sizes"]:
+            try:
+                with transaction.atomic():
+                    self.run_size(size, options["instance_limit"])
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+    def seed(self, size: int) -> None:
+        user = get_user_model().objects.create_user(username="bench-party", password=None)
+        classes = [
+            Class.objects.create(name="Bench Rogue", saving_throws=["dex", "int"]),
+            Class.objects.create(name="Bench Cleric", saving_throws=["wis", "cha"]),
+        ]
+        skills = [Skill.objects.create(name=f"Bench Skill {i}", ability=ABILITIES[i % 6]) for i in range(18)]
+        Skill.objects.get_or_create(name="Perception", defaults={"ability": "wis"})
+        characters = Character.objects.bulk_create(
+            [
+                Character(user=user, name=f"Bench {i}", dex_score=8 + i % 10, wis_score=10 + i % 7)
+                for i in range(size)
+            ],
+            batch_size=2000,
+        )
+        CharacterClass.objects.bulk_create(
+            [
+                CharacterClass(character=c, clazz=classes[i % 2], level=1 + i % 20)
+                for i, c in enumerate(characters)
+            ],
+            batch_size=2000,
+        )
+        CharacterSkill.objects.bulk_create(
+            [
+                CharacterSkill(character=c, skill=skills[(i + k) % len(skills)], expertise=k == 0)
+                for i, c in enumerate(characters)
+                for k in range(4)
+            ],
+            batch_size=2000,
+        )
+
+    def run_size(self, size: int, instance_limit: int) -> None:
+        self.seed(size)
+        qs = Character.objects.filter(user__username="bench-party")
+
+        start = time.perf_counter()
+        stats = party_stats(qs)
+        bulk = time.perf_counter() - start
+
+        skills = list(Skill.objects.all())
+        sample = list(qs.order_by("pk")[:instance_limit])
+        start = time.perf_counter()
+        for character in sample:
+            for ab in ABILITIES:
+                character.saving_throw_modifier(ab)
+            for skill in skills:
+                character.skill_modifier(skill)
+        per_instance = (time.perf_counter() - start) * (len(stats) / max(len(sample), 1))
+
+        note = "" if len(sample) >= len(stats) else f" (extrapolated from {len(sample)})"
+        self.stdout.write(
+            f"{size:>7} characters: party_stats {bulk * 1000:9.1f} ms | "
+            f"per-instance {per_instance * 1000:11.1f} ms{note} | "
+            f"speedup x{per_instance / bulk if bulk else float('inf'):.0f}"
+        )
@@ -0,0 +1,72 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.catalog import CATALOG_MODELS
+from core.search import rebuild_index, search_catalog, search_catalog_icontains
+
+COMMON = (
+    "fire ice storm shadow radiant arcane blade shield guard swift keen iron "
+    "silver elven dwarven ancient wild bright hollow thunder frost venom"
+).split()
+QUERIES = ["f", "fir", "fire", "fireb", "storm sh", "elven blade", "xyz", "thunder guard"]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare FTS5 catalog search against the icontains implementation. "
+        "Fixture rows are created inside a transaction and rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000, help="Total catalog rows across all models.")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options["rows"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def seed(self, rows: int) -> None:
+        rng = random.Random(5)
+        # A few common words plus a long tail of rarer ones, like a real homebrew catalog.
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        tail = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(5000)]
+        words = COMMON * 10 + tail
+        per_model = rows // len(CATALOG_MODELS)
+        for model_name, model in CATALOG_MODELS.items():
+            objs = []
+            for i in range(per_model):
+                name = f"{rng.choice(words).title()} {rng.choice(words)} {i}"
+                description = " ".join(rng.choice(words) for _ in range(30))
+                fields = {"name": name, "description": description}
+                if model_name == "skill":
+                    fields["ability"] = "str"
+                objs.append(model(**fields))
+            model.objects.bulk_create(objs, batch_size=2000)  # type: ignore[attr-defined]
+        rebuild_index()
+
+    def time(self, fn, q: str, repeat: int) -> float:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(q)
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def run(self, rows: int, repeat: int) -> None:
+        self.stdout.write(f"Seeding {rows} catalog rows...")
+        self.seed(rows)
+        self.stdout.write(f"{'query':<16}{'icontains ms':>14}{'fts5 ms':>10}{'hits':>6}")
+        for q in QUERIES:
+            legacy = self.time(search_catalog_icontains, q, repeat)
+            fts = self.time(search_catalog, q, repeat)
+            hits = len(search_catalog(q))
+            self.stdout.write(f"{q!r:<16}{legacy:>14.2f}{fts:>10.2f}{hits:>6}")
@@ -0,0 +1,138 @@
+import asyncio
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.urls import reverse
+
+from core import theme_async_http, theme_http
+from core.theme_cache import encode_base
+from core.views import dice_theme_proxy, dice_theme_proxy_async
+
+
+class _SlowUpstream(ThreadingHTTPServer):
+    """Theme host answering any GET with ``size`` bytes after ``latency`` seconds."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency: float, size: int) -> None:
+        body = b"x" * size
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Proxy cache misses against a slow local upstream and compare one ASGI event loop "
+        "running the async dice theme proxy with a threaded WSGI worker running the sync one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Concurrent requests per run.")
+        parser.add_argument("--latency", type=float, default=0.5, help="Upstream response delay in seconds.")
+        parser.add_argument("--threads", type=int, default=16, help="Threads of the WSGI worker.")
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Asset size in bytes.")
+
+    def handle(self, *args, **options):
+        media = tempfile.mkdtemp()
+        upstream = _SlowUpstream(options["latency"], options["size"])
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+        # Connection limits sized to the run so only the worker model is measured.
+        limits = override_settings(
+            MEDIA_ROOT=media,
+            DICE_THEME_HTTP_POOL_SIZE=options["requests"],
+            DICE_THEME_HTTP_QUEUE_TIMEOUT=60,
+            DICE_THEME_BREAKER_FAILURES=10**6,
+        )
+        try:
+            with limits:
+                theme_http.pool.close()
+                self.stdout.write(
+                    f"{options['requests']} concurrent uncached requests, upstream latency {options['latency']:.2f}s"
+                )
+                self.report("ASGI, 1 event loop", self.run_asgi(upstream.url + "/asgi", options["requests"]))
+                self.report(
+                    f"WSGI, {options['threads']} threads",
+                    self.run_wsgi(upstream.url + "/wsgi", options["requests"], options["threads"]),
+                )
+        finally:
+            theme_http.pool.close()
+            upstream.shutdown()
+            upstream.server_close()
+            shutil.rmtree(media, ignore_errors=True)
+
+    def run_asgi(self, base: str, count: int) -> tuple[float, list[float], int]:
+        factory = AsyncRequestFactory()
+        theme = encode_base(base)
+        start = time.perf_counter()
+
+        async def one(i: int) -> float:
+            request = factory.get(reverse("core:dice_theme_proxy", args=[theme, f"t{i}.png"]))
+            response = await dice_theme_proxy_async(request, base_b64=theme, res_path=f"t{i}.png")
+            async for _chunk in response.streaming_content:
+                pass
+            response.close()
+            return time.perf_counter() - start
+
+        async def run() -> tuple[float, list[float], int]:
+            latencies = await asyncio.gather(*(one(i) for i in range(count)))
+            elapsed = time.perf_counter() - start
+            peak = max(h["peak_in_flight"] for h in theme_async_http.pool.stats()["hosts"].values())
+            theme_async_http.pool.close()
+            return elapsed, latencies, peak
+
+        return asyncio.run(run())
+
+    def run_wsgi(self, base: str, count: int, threads: int) -> tuple[float, list[float], int]:
+        factory = RequestFactory()
+        theme = encode_base(base)
+        start = time.perf_counter()
+
+        def one(i: int) -> float:
+            request = factory.get(reverse("core:dice_theme_proxy", args=[theme, f"t{i}.png"]))
+            response = dice_theme_proxy(request, base_b64=theme, res_path=f"t{i}.png")
+            for _chunk in response.streaming_content:
+                pass
+            response.close()
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(one, range(count)))
+        elapsed = time.perf_counter() - start
+        peak = max(h["peak_in_flight"] for h in theme_http.pool.stats()["hosts"].values())
+        return elapsed, latencies, peak
+
+    def report(self, label: str, result: tuple[float, list[float], int]) -> None:
+        """Latencies count from the start of the batch, so time queued for a free thread is included."""
+        elapsed, latencies, peak = result
+        latencies = sorted(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{label:>20}: {elapsed:6.2f}s wall, {len(latencies) / elapsed:7.1f} req/s, "
+            f"median {statistics.median(latencies) * 1000:6.0f} ms, p95 {p95 * 1000:6.0f} ms, "
+            f"peak {peak} upstream requests in flight"
+        )
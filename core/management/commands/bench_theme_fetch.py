@@ -0,0 +1,102 @@
+import shutil
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.theme_http import ConnectionPool
+
+
+class _AssetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this Nagle adds ~40 ms per response.
+    disable_nagle_algorithm = True
+    body = b""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch a theme's assets from a local HTTPS stand-in with a fresh connection per "
+        "asset and through the shared keep-alive pool, and compare latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--assets", type=int, default=10, help="Assets per theme load.")
+        parser.add_argument("--size", type=int, default=32 * 1024, help="Bytes per asset.")
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not shutil.which("openssl"):
+            raise CommandError("openssl is needed to create the stand-in server's certificate.")
+        tmp = Path(tempfile.mkdtemp())
+        try:
+            cert, key = tmp / "cert.pem", tmp / "key.pem"
+            subprocess.run(
+                [
+                    "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-keyout", str(key), "-out", str(cert),
+                    "-subj", "/CN=localhost", "-addext", "subjectAltName=IP:127.0.0.1",
+                ],
+                check=True,
+                capture_output=True,
+            )
+            self.run(cert, key, options)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def run(self, cert: Path, key: Path, options) -> None:
+        handler = type("Handler", (_AssetHandler,), {"body": b"x" * options["size"]})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ctx.load_cert_chain(cert, key)
+        server.socket = server_ctx.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client_ctx = ssl.create_default_context(cafile=str(cert))
+        base = f"https://127.0.0.1:{server.server_address[1]}"
+        urls = [f"{base}/asset-{i}.png" for i in range(options["assets"])]
+        try:
+            # keepalive=0 closes every connection after use: one TCP+TLS handshake per asset.
+            fresh = ConnectionPool(keepalive=0, ssl_context=client_ctx)
+            pooled = ConnectionPool(ssl_context=client_ctx)
+            fresh_ms = self.time_loads(fresh, urls, options["rounds"])
+            pooled_ms = self.time_loads(pooled, urls, options["rounds"])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        for label, pool, ms in (("new connection per asset", fresh, fresh_ms), ("keep-alive pool", pooled, pooled_ms)):
+            stats = pool.stats()
+            host = next(iter(stats["hosts"].values()))
+            self.stdout.write(
+                f"{label:>26}: median {statistics.median(ms):7.2f} ms per {len(urls)}-asset theme, "
+                f"{stats['connections_opened']} handshake(s) for {stats['requests']} request(s), "
+                f"reuse {stats['reuse_rate']:.0%}, avg handshake {host['avg_handshake_ms']} ms"
+            )
+            pool.close()
+        self.stdout.write(f"Speedup: {statistics.median(fresh_ms) / statistics.median(pooled_ms):.2f}x")
+
+    def time_loads(self, pool: ConnectionPool, urls: list[str], rounds: int) -> list[float]:
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for url in urls:
+                with pool.request("GET", url) as resp:
+                    resp.read()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
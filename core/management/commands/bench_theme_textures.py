@@ -0,0 +1,80 @@
+import io
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from core import theme_images, theme_index
+from core.theme_cache import encode_base
+from core.views import dice_theme_proxy
+
+BASE = "https://example.com/bench-theme"
+# (label, query string, request headers)
+SCENARIOS = [
+    ("original", "", {}),
+    ("webp (Accept)", "", {"accept": "image/webp,*/*"}),
+    ("?w=1024", "?w=1024", {}),
+    ("?w=1024 webp", "?w=1024&format=webp", {}),
+    ("?w=512", "?w=512", {}),
+    ("Save-Data + webp", "", {"save_data": "on", "accept": "image/webp,*/*"}),
+]
+
+
+def _texture(Image, size: int, seed: int) -> bytes:
+    """A noisy gradient: compresses roughly like a painted dice texture, unlike flat colour."""
+    gradient = Image.linear_gradient("L").resize((size, size))
+    noise = Image.effect_noise((size, size), 20 + seed)
+    image = Image.merge("RGB", [gradient, noise, gradient.rotate(90 * seed)])
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        "Cache a synthetic theme's PNG textures, generate their downscaled/WebP variants "
+        "and compare the bytes the proxy serves per theme load for each kind of client."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--textures", type=int, default=3, help="Textures per theme.")
+        parser.add_argument("--size", type=int, default=2048, help="Texture edge in pixels.")
+
+    def handle(self, *args, **options):
+        Image = theme_images.Image
+        if Image is None:
+            raise CommandError("Pillow is needed to generate texture variants.")
+        media = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media):
+                self.run(Image, options)
+        finally:
+            shutil.rmtree(media, ignore_errors=True)
+
+    def run(self, Image, options) -> None:
+        theme = encode_base(BASE)
+        names = [f"texture-{i}.png" for i in range(options["textures"])]
+        digests = [theme_index.store(theme, name, _texture(Image, options["size"], i)) for i, name in enumerate(names)]
+        start = time.perf_counter()
+        for digest in digests:
+            theme_images.ensure_variants(digest, "image/png")
+        self.stdout.write(
+            f"Generated variants for {len(names)} {options['size']}px texture(s) in "
+            f"{time.perf_counter() - start:.2f}s (one-off, at cache time)"
+        )
+
+        factory = RequestFactory()
+        baseline = None
+        for label, query, headers in SCENARIOS:
+            total = 0
+            for name in names:
+                request = factory.get(reverse("core:dice_theme_proxy", args=[theme, name]) + query, headers=headers)
+                response = dice_theme_proxy(request, base_b64=theme, res_path=name)
+                total += sum(len(chunk) for chunk in response.streaming_content)
+            baseline = baseline or total
+            self.stdout.write(
+                f"{label:>18}: {total / 1024:9.1f} KiB per theme ({total / baseline:6.1%} of original)"
+            )
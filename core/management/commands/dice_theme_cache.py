@@ -0,0 +1,85 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import theme_index
+from core.theme_cache import decode_base
+
+
+def _size(n: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+class Command(BaseCommand):
+    help = "Report, prune, verify or migrate MEDIA_ROOT/dice_theme_cache and its index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["report", "prune", "verify", "migrate"])
+        parser.add_argument(
+            "--max-age-days",
+            type=float,
+            help="prune: also drop files not read for this many days.",
+        )
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="verify: repair the index and drop corrupt blobs instead of failing.",
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, f"handle_{options['action']}")(options)
+
+    def handle_report(self, options):
+        rows = theme_index.usage()
+        now = time.time()
+        for row in rows:
+            idle = (now - row.last_access) / 86400
+            self.stdout.write(
+                f"  {decode_base(row.theme) or row.theme}: {row.files} file(s), {_size(row.bytes)}, "
+                f"{_size(row.compressed_savings)} saved by compression, last read {idle:.1f} day(s) ago"
+            )
+        dedup = theme_index.dedup_stats()
+        max_bytes = getattr(settings, "DICE_THEME_CACHE_MAX_BYTES", None)
+        max_files = getattr(settings, "DICE_THEME_CACHE_MAX_FILES", None)
+        self.stdout.write(
+            f"{len(rows)} theme(s), {dedup.files} file(s) in {dedup.blobs} blob(s) (max {max_files or 'unlimited'}), "
+            f"{_size(dedup.logical_bytes)} stored as {_size(dedup.stored_bytes)} "
+            f"(max {_size(max_bytes) if max_bytes else 'unlimited'}), dedup ratio {dedup.ratio:.2f}x"
+        )
+
+    def handle_prune(self, options):
+        days = options.get("max_age_days")
+        stats = theme_index.prune(max_age=days * 86400 if days is not None else None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {stats['expired']} idle blob(s), dropped {stats['unreferenced']} unreferenced, "
+            f"evicted {stats['evicted']} over quota and removed {stats['temp_files']} stale temp file(s) "
+            f"and {stats['lock_files']} lock file(s)."
+        ))
+
+    def handle_verify(self, options):
+        report = theme_index.verify(fix=options["fix"])
+        problems = {
+            "untracked": report.untracked,
+            "missing": report.missing,
+            "corrupt": report.corrupt,
+            "dangling": report.dangling,
+        }
+        for label, names in problems.items():
+            for name in names:
+                self.stdout.write(f"  {label}: {name}")
+        if report and not options["fix"]:
+            summary = ", ".join(f"{len(names)} {label}" for label, names in problems.items())
+            raise CommandError(f"Index out of sync: {summary}. Re-run with --fix.")
+        self.stdout.write(self.style.SUCCESS("Cache index matches the blobs on disk."))
+
+    def handle_migrate(self, options):
+        stats = theme_index.migrate_legacy()
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {stats['files']} file(s) into the store: {stats['blobs']} new blob(s), "
+            f"{stats['duplicates']} duplicate(s) removed."
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Character
+
+
+class Command(BaseCommand):
+    help = "Rebuild and verify the denormalized Character.total_level/proficiency_tier columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report characters whose stored values are stale; exit non-zero if any.",
+        )
+
+    def stale_characters(self):
+        return Character.objects.stale_level_totals().values_list(
+            "pk", "name", "total_level", "computed_level"
+        )
+
+    def handle(self, *args, **options):
+        stale = list(self.stale_characters())
+        for pk, name, stored, computed in stale:
+            self.stdout.write(f"  #{pk} {name}: stored level {stored}, actual {computed}")
+        if options["check"]:
+            if stale:
+                raise CommandError(f"{len(stale)} character(s) have stale level totals.")
+            self.stdout.write(self.style.SUCCESS("All character level totals are up to date."))
+            return
+
+        with transaction.atomic():
+            updated = Character.objects.all().refresh_level_totals()
+        remaining = list(self.stale_characters())
+        if remaining:
+            raise CommandError(f"{len(remaining)} character(s) still stale after rebuild.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt level totals for {updated} character(s); fixed {len(stale)} stale row(s)."
+        ))
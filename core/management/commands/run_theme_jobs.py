@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core import theme_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued dice theme load jobs (use with DICE_THEME_JOB_RUNNER set to anything but 'thread')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the jobs that are due now and exit.")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds between checks for due retries.")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            ran = theme_jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} theme job(s)."))
+            return
+        try:
+            theme_jobs.work(poll=options["poll"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,33 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from core.typeahead import index
+
+
+class Command(BaseCommand):
+    help = "Build the in-memory typeahead index in this process and report its size and query latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("queries", nargs="*", default=["fire", "firbal", "shield"])
+
+    def handle(self, *args, **options):
+        index.clear()
+        tracemalloc.start()
+        index.search("warmup")
+        traced, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = index.stats()
+        self.stdout.write(
+            f"entries={stats['entries']} (max {stats['max_entries']}) trigrams={stats['trigrams']} "
+            f"approx_memory={stats['approx_bytes'] / 1024:.0f} KiB traced={traced / 1024:.0f} KiB "
+            f"build={stats['build_ms']} ms overflow={stats['overflow']}"
+        )
+        for q in options["queries"]:
+            start = time.perf_counter()
+            for _ in range(100):
+                results = index.search(q)
+            elapsed = (time.perf_counter() - start) / 100 * 1000
+            hits = "fallback" if results is None else len(results)
+            self.stdout.write(f"  {q!r}: {elapsed:.3f} ms, {hits} hits")
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_level_columns(apps, schema_editor):
+    Character = apps.get_model("core", "Character")
+    CharacterClass = apps.get_model("core", "CharacterClass")
+    totals: dict[int, int] = {}
+    for character_id, level in CharacterClass.objects.values_list("character_id", "level"):
+        totals[character_id] = totals.get(character_id, 0) + level
+    for character_id, total in totals.items():
+        tier = 2 if total <= 4 else 3 if total <= 8 else 4 if total <= 12 else 5 if total <= 16 else 6
+        Character.objects.filter(pk=character_id).update(total_level=total, proficiency_tier=tier)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='proficiency_tier',
+            field=models.PositiveSmallIntegerField(default=2, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='total_level',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='character',
+            index=models.Index(fields=['total_level'], name='core_charac_total_l_35de1a_idx'),
+        ),
+        migrations.RunPython(populate_level_columns, migrations.RunPython.noop),
+    ]
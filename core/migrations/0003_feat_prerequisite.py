@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_prerequisites(apps, schema_editor):
+    Feat = apps.get_model("core", "Feat")
+    Class = apps.get_model("core", "Class")
+    Species = apps.get_model("core", "Species")
+    FeatPrerequisite = apps.get_model("core", "FeatPrerequisite")
+    class_ids = set(Class.objects.values_list("pk", flat=True))
+    species_ids = set(Species.objects.values_list("pk", flat=True))
+    feat_ids = set(Feat.objects.values_list("pk", flat=True))
+    rows = []
+    for feat in Feat.objects.all():
+        raw = (feat.data or {}).get("prerequisites") or {}
+        if not isinstance(raw, dict):
+            continue
+        values = {
+            "clazz_id": raw.get("class") if raw.get("class") in class_ids else None,
+            "class_level": raw.get("class_level") if isinstance(raw.get("class_level"), int) else None,
+            "feature_id": raw.get("feature") if raw.get("feature") in feat_ids else None,
+            "total_level": raw.get("total_level") if isinstance(raw.get("total_level"), int) else None,
+            "species_id": raw.get("species") if raw.get("species") in species_ids else None,
+        }
+        if values["clazz_id"] is not None and values["class_level"] is None:
+            values["class_level"] = 1
+        if any(v is not None for v in values.values()):
+            rows.append(FeatPrerequisite(feat_id=feat.pk, **values))
+    FeatPrerequisite.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_character_level_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatPrerequisite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_level', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('total_level', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('clazz', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.class')),
+                ('feat', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='prerequisite', to='core.feat')),
+                ('feature', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.feat')),
+                ('species', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.species')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['clazz', 'class_level'], name='core_featpr_clazz_i_fd8bca_idx'), models.Index(fields=['total_level'], name='core_featpr_total_l_93416f_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_prerequisites, migrations.RunPython.noop),
+    ]
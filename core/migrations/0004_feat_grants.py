@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from collections import deque
+
+from django.db import migrations, models
+
+GRANT_MODELS = {"feat", "spell", "item", "language", "skill"}
+
+
+def backfill_grants(apps, schema_editor):
+    Feat = apps.get_model("core", "Feat")
+    FeatGrant = apps.get_model("core", "FeatGrant")
+    FeatGrantClosure = apps.get_model("core", "FeatGrantClosure")
+    feat_ids = set(Feat.objects.values_list("pk", flat=True))
+    edges = []
+    adjacency: dict[int, set[int]] = {pk: set() for pk in feat_ids}
+    for pk, data in Feat.objects.values_list("pk", "data"):
+        raw = (data or {}).get("grants")
+        seen = set()
+        for item in raw if isinstance(raw, list) else []:
+            if not isinstance(item, dict) or item.get("model") not in GRANT_MODELS:
+                continue
+            try:
+                edge = (item["model"], int(item.get("id")))
+            except (TypeError, ValueError):
+                continue
+            if edge in seen:
+                continue
+            seen.add(edge)
+            edges.append(FeatGrant(feat_id=pk, model=edge[0], object_id=edge[1]))
+            if edge[0] == "feat" and edge[1] in feat_ids:
+                adjacency[pk].add(edge[1])
+    FeatGrant.objects.bulk_create(edges, batch_size=1000)
+    rows = []
+    for root in feat_ids:
+        depths = {root: 0}
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for target in adjacency[node]:
+                if target not in depths:
+                    depths[target] = depths[node] + 1
+                    queue.append(target)
+        rows.extend(FeatGrantClosure(ancestor_id=root, descendant_id=t, depth=d) for t, d in depths.items())
+    FeatGrantClosure.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_feat_prerequisite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatGrant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('feat', 'Feat'), ('spell', 'Spell'), ('item', 'Item'), ('language', 'Language'), ('skill', 'Skill')], max_length=16)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('feat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grant_links', to='core.feat')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model', 'object_id'], name='core_featgr_model_bc0bfc_idx')],
+                'unique_together': {('feat', 'model', 'object_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FeatGrantClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(default=0)),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grant_descendants', to='core.feat')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grant_ancestors', to='core.feat')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='core_featgr_descend_787b65_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(backfill_grants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+FTS_TABLE = "core_catalog_fts"
+# Must match core.search.MODEL_CODES / ROWID_STRIDE.
+SOURCES = [
+    ("core_feat", 1),
+    ("core_spell", 2),
+    ("core_item", 3),
+    ("core_language", 4),
+    ("core_skill", 5),
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        "USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    for table, code in SOURCES:
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+            f"SELECT id * 8 + {code}, name, description FROM {table}"
+        )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_feat_grants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
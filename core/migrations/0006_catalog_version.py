@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+def create_rows(apps, schema_editor):
+    CatalogVersion = apps.get_model("core", "CatalogVersion")
+    for name in ("feat", "spell", "item", "language", "skill"):
+        CatalogVersion.objects.get_or_create(model=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_catalog_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('model', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:07
+
+import core.models
+from django.db import migrations, models
+
+
+def flag_missing_references(apps, schema_editor):
+    """Mark prerequisites naming a class, species or feat that no longer exists.
+
+    Earlier deletions nulled such references, or dropped the row entirely,
+    leaving the feat unrestricted.
+    """
+    Feat = apps.get_model("core", "Feat")
+    Class = apps.get_model("core", "Class")
+    Species = apps.get_model("core", "Species")
+    FeatPrerequisite = apps.get_model("core", "FeatPrerequisite")
+    known = {
+        "class": set(Class.objects.values_list("pk", flat=True)),
+        "species": set(Species.objects.values_list("pk", flat=True)),
+        "feature": set(Feat.objects.values_list("pk", flat=True)),
+    }
+    for feat in Feat.objects.all():
+        raw = (feat.data or {}).get("prerequisites") or {}
+        if not isinstance(raw, dict):
+            continue
+        if any(raw.get(key) is not None and raw.get(key) not in ids for key, ids in known.items()):
+            FeatPrerequisite.objects.update_or_create(feat_id=feat.pk, defaults={"unsatisfiable": True})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_theme_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='featprerequisite',
+            name='unsatisfiable',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='featprerequisite',
+            name='clazz',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.SET_UNSATISFIABLE, related_name='+', to='core.class'),
+        ),
+        migrations.AlterField(
+            model_name='featprerequisite',
+            name='feature',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.SET_UNSATISFIABLE, related_name='+', to='core.feat'),
+        ),
+        migrations.AlterField(
+            model_name='featprerequisite',
+            name='species',
+            field=models.ForeignKey(blank=True, null=True, on_delete=core.models.SET_UNSATISFIABLE, related_name='+', to='core.species'),
+        ),
+        migrations.RunPython(flag_missing_references, migrations.RunPython.noop),
+    ]
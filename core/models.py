@@ -2,7 +2,9 @@ from __future__ import annotations
 
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 class TimeStampedModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -91,6 +93,129 @@ class Feat(TimeStampedModel):
     def __str__(self) -> str:  # pragma: no cover - trivial
         return self.name
 
+    def save(self, *args, **kwargs) -> None:
+        # The post_save grant sync rejects grant cycles; roll the row back with it.
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+
+
+def SET_UNSATISFIABLE(collector, field, sub_objs, using):
+    """``on_delete`` for prerequisite references: clear the FK and mark the row unsatisfiable.
+
+    A plain SET_NULL would leave a row that no longer restricts anything, making
+    the feat available to everyone once its required class, species or feat is deleted.
+    """
+    collector.add_field_update(field, None, sub_objs)
+    collector.add_field_update(field.model._meta.get_field("unsatisfiable"), True, sub_objs)
+
+
+class FeatPrerequisite(models.Model):
+    """Relational copy of ``Feat.data["prerequisites"]`` used for indexed eligibility queries.
+
+    One row per feat that has prerequisites; every non-null column must be met.
+    Rows are rebuilt from the JSON whenever the feat is saved. A prerequisite
+    naming a class, species or feat that does not exist (or was deleted) sets
+    ``unsatisfiable``, which makes the feat ineligible for everyone.
+    """
+
+    feat = models.OneToOneField(Feat, on_delete=models.CASCADE, related_name="prerequisite")
+    clazz = models.ForeignKey("Class", on_delete=SET_UNSATISFIABLE, null=True, blank=True, related_name="+")
+    class_level = models.PositiveSmallIntegerField(null=True, blank=True)
+    feature = models.ForeignKey(Feat, on_delete=SET_UNSATISFIABLE, null=True, blank=True, related_name="+")
+    total_level = models.PositiveSmallIntegerField(null=True, blank=True)
+    species = models.ForeignKey("Species", on_delete=SET_UNSATISFIABLE, null=True, blank=True, related_name="+")
+    unsatisfiable = models.BooleanField(default=False)
+
+    class Meta: # type: ignore
+        indexes = [
+            models.Index(fields=["clazz", "class_level"]),
+            models.Index(fields=["total_level"]),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - trivial
+        return f"Prerequisites for {self.feat}"
+
+    @classmethod
+    def sync_for(cls, feat: Feat) -> FeatPrerequisite | None:
+        raw = (feat.data or {}).get("prerequisites") or {}
+        if not isinstance(raw, dict):
+            raw = {}
+
+        missing = False
+
+        def existing(model, key: str) -> int | None:
+            nonlocal missing
+            value = raw.get(key)
+            if value is None:
+                return None
+            try:
+                pk = int(value)
+            except (TypeError, ValueError):
+                pk = None
+            if pk is None or not model.objects.filter(pk=pk).exists():
+                missing = True
+                return None
+            return pk
+
+        def positive(key: str) -> int | None:
+            value = raw.get(key)
+            return int(value) if isinstance(value, int) and value > 0 else None
+
+        values = {
+            "clazz_id": existing(Class, "class"),
+            "class_level": positive("class_level"),
+            "feature_id": existing(Feat, "feature"),
+            "total_level": positive("total_level"),
+            "species_id": existing(Species, "species"),
+        }
+        if values["clazz_id"] is not None and values["class_level"] is None:
+            values["class_level"] = 1
+        if all(v is None for v in values.values()) and not missing:
+            cls.objects.filter(feat=feat).delete()
+            return None
+        values["unsatisfiable"] = missing
+        prereq, _created = cls.objects.update_or_create(feat=feat, defaults=values)
+        return prereq
+
+
+class FeatGrant(models.Model):
+    """Direct grant edge parsed from ``Feat.data["grants"]``."""
+
+    MODEL_CHOICES = [
+        ("feat", "Feat"),
+        ("spell", "Spell"),
+        ("item", "Item"),
+        ("language", "Language"),
+        ("skill", "Skill"),
+    ]
+
+    feat = models.ForeignKey(Feat, on_delete=models.CASCADE, related_name="grant_links")
+    model = models.CharField(max_length=16, choices=MODEL_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+
+    class Meta: # type: ignore
+        unique_together = ("feat", "model", "object_id")
+        indexes = [models.Index(fields=["model", "object_id"])]
+
+    def __str__(self) -> str:  # pragma: no cover - trivial
+        return f"{self.feat} grants {self.model} #{self.object_id}"
+
+
+class FeatGrantClosure(models.Model):
+    """Transitive closure of feat-to-feat grants, including each feat itself at depth 0."""
+
+    ancestor = models.ForeignKey(Feat, on_delete=models.CASCADE, related_name="grant_descendants")
+    descendant = models.ForeignKey(Feat, on_delete=models.CASCADE, related_name="grant_ancestors")
+    # Length of the shortest grant chain from ancestor to descendant.
+    depth = models.PositiveSmallIntegerField(default=0)
+
+    class Meta: # type: ignore
+        unique_together = ("ancestor", "descendant")
+        indexes = [models.Index(fields=["descendant", "ancestor"])]
+
+    def __str__(self) -> str:  # pragma: no cover - trivial
+        return f"{self.ancestor} -> {self.descendant} ({self.depth})"
+
 
 class Class(TimeStampedModel):
     name = models.CharField(max_length=64, unique=True)
@@ -154,7 +279,54 @@ class Item(TimeStampedModel):
         return self.name
 
 
+class CharacterQuerySet(models.QuerySet):
+    def refresh_level_totals(self) -> int:
+        """Recompute the stored ``total_level``/``proficiency_tier`` columns.
+
+        Runs two UPDATE statements regardless of how many rows match.
+        """
+        totals = (
+            CharacterClass.objects.filter(character=models.OuterRef("pk"))
+            .order_by()
+            .values("character")
+            .annotate(total=models.Sum("level"))
+            .values("total")
+        )
+        count = self.update(
+            total_level=Coalesce(models.Subquery(totals), models.Value(0)),
+        )
+        self.update(proficiency_tier=proficiency_tier_expression("total_level"))
+        return count
+
+    def with_computed_level(self) -> "CharacterQuerySet":
+        """Annotate the aggregated level/tier so stored values can be verified."""
+        return self.annotate(
+            computed_level=Coalesce(models.Sum("classes__level"), models.Value(0)),
+        ).annotate(computed_tier=proficiency_tier_expression("computed_level"))
+
+    def stale_level_totals(self) -> "CharacterQuerySet":
+        return self.with_computed_level().filter(
+            ~models.Q(total_level=models.F("computed_level"))
+            | ~models.Q(proficiency_tier=models.F("computed_tier"))
+        )
+
+
+def proficiency_tier_expression(level_field: str) -> models.Case:
+    # Mirrors Character.proficiency_for_level in SQL.
+    return models.Case(
+        models.When(**{f"{level_field}__lte": 4}, then=models.Value(2)),
+        models.When(**{f"{level_field}__lte": 8}, then=models.Value(3)),
+        models.When(**{f"{level_field}__lte": 12}, then=models.Value(4)),
+        models.When(**{f"{level_field}__lte": 16}, then=models.Value(5)),
+        default=models.Value(6),
+        output_field=models.PositiveSmallIntegerField(),
+    )
+
+
 class Character(TimeStampedModel):
+    # Columns maintained by CharacterClass signals/queryset hooks; never written by save().
+    DENORMALIZED_FIELDS = ("total_level", "proficiency_tier")
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="characters")
     name = models.CharField(max_length=96)
 
@@ -185,14 +357,36 @@ class Character(TimeStampedModel):
     # Misc extensibility: coins, notes, UI toggles, custom flags, etc.
     data = models.JSONField(blank=True, default=dict)
 
+    # Denormalized from CharacterClass so list views can filter/sort by level.
+    total_level = models.PositiveSmallIntegerField(default=0, editable=False)
+    proficiency_tier = models.PositiveSmallIntegerField(default=2, editable=False)
+
+    objects = CharacterQuerySet.as_manager()
+
     class Meta: # type: ignore
-        indexes = [models.Index(fields=["user", "name"])]
+        indexes = [
+            models.Index(fields=["user", "name"]),
+            models.Index(fields=["total_level"]),
+        ]
         unique_together = ("user", "name")
         ordering = ["name"]
 
     def __str__(self) -> str:  # pragma: no cover - trivial
         return f"{self.name}"
 
+    def save(self, *args, **kwargs) -> None:
+        # A stale or copied instance must not write its own values over the
+        # signal-maintained columns: take them from the row, if there is one.
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or set(update_fields) & set(self.DENORMALIZED_FIELDS):
+            row = None
+            if self.pk is not None and not kwargs.get("force_insert"):
+                row = type(self)._base_manager.filter(pk=self.pk).values(*self.DENORMALIZED_FIELDS).first()
+            for name in self.DENORMALIZED_FIELDS:
+                # No row yet means no class memberships either.
+                setattr(self, name, row[name] if row else self._meta.get_field(name).get_default())
+        super().save(*args, **kwargs)
+
     # ---- Derived values & helpers ----
     @staticmethod
     def ability_modifier(score: int) -> int:
@@ -200,12 +394,10 @@ class Character(TimeStampedModel):
 
     @property
     def level_total(self) -> int:
-        agg = self.classes.aggregate(total=models.Sum("level")) # type: ignore
-        return int(agg["total"] or 0)
+        return int(self.total_level)
 
-    @property
-    def proficiency_bonus(self) -> int:
-        lvl = self.level_total
+    @staticmethod
+    def proficiency_for_level(lvl: int) -> int:
         if lvl <= 0:
             return 2
         if lvl <= 4:
@@ -218,6 +410,10 @@ class Character(TimeStampedModel):
             return 5
         return 6
 
+    @property
+    def proficiency_bonus(self) -> int:
+        return int(self.proficiency_tier)
+
     def ability_score(self, ability: str) -> int:
         ability = ability.lower()
         return {
@@ -257,6 +453,36 @@ class Character(TimeStampedModel):
         return base + (self.proficiency_bonus if ability in self.proficient_saving_throws() else 0)
 
 
+class CharacterClassQuerySet(models.QuerySet):
+    """Keeps Character level columns correct for bulk paths that skip signals."""
+
+    def _refresh(self, character_ids) -> None:
+        ids = {pk for pk in character_ids if pk is not None}
+        if ids:
+            Character.objects.filter(pk__in=ids).refresh_level_totals()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._refresh(obj.character_id for obj in objs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        before = set(self.filter(pk__in=[o.pk for o in objs]).values_list("character_id", flat=True))
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        self._refresh(before | {obj.character_id for obj in objs})
+        return rows
+
+    def update(self, **kwargs):
+        ids = set(self.values_list("character_id", flat=True))
+        rows = super().update(**kwargs)
+        new_character = kwargs.get("character", kwargs.get("character_id"))
+        if new_character is not None:
+            ids.add(getattr(new_character, "pk", new_character))
+        self._refresh(ids)
+        return rows
+
+
 class CharacterClass(TimeStampedModel):
     character = models.ForeignKey(Character, on_delete=models.CASCADE, related_name="classes")
     clazz = models.ForeignKey(Class, on_delete=models.CASCADE, related_name="character_memberships")
@@ -264,6 +490,8 @@ class CharacterClass(TimeStampedModel):
     level = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(20)], default=1)
     is_primary = models.BooleanField(default=False)
 
+    objects = CharacterClassQuerySet.as_manager()
+
     class Meta: # type: ignore
         unique_together = ("character", "clazz")
         indexes = [models.Index(fields=["character", "clazz"])]
@@ -306,3 +534,56 @@ class CharacterSpell(TimeStampedModel):
     class Meta: # type: ignore
         unique_together = ("character", "spell")
         indexes = [models.Index(fields=["character", "spell"])]
+
+
+class CatalogVersion(models.Model):
+    """Per-model write counter for catalog tables, shared by every worker process."""
+
+    model = models.CharField(max_length=16, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:  # pragma: no cover - trivial
+        return f"{self.model} v{self.version}"
+
+
+class ThemeJob(TimeStampedModel):
+    """Background download of a dice theme into the local cache, run by ``core.theme_jobs``."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    PARTIAL = "partial"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (PARTIAL, "Partially cached"),
+        (FAILED, "Failed"),
+    ]
+    ACTIVE = (QUEUED, RUNNING)
+
+    # URL-safe base64 of the (GitHub-rewritten) base URL, as in the proxy routes.
+    theme = models.TextField()
+    base_url = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest time a queued job may run; pushed back between retries.
+    run_after = models.DateTimeField(default=timezone.now)
+    # {path: {"state": "pending" | "ok" | "failed", "bytes": int, "ms": float, "error": str}}
+    assets = models.JSONField(blank=True, default=dict)
+    error = models.TextField(blank=True, default="")
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta: # type: ignore
+        indexes = [models.Index(fields=["status", "run_after"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["theme"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="core_themejob_one_active_per_theme",
+            )
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover - trivial
+        return f"Theme job #{self.pk} ({self.status})"
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import dataclasses
+import threading
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from django.core.exceptions import ValidationError
+
+from .models import Character, Feat
+from .sheet import ABILITIES, CharacterSheet, _freeze
+
+# Operations are always applied in this order, whatever order feats list them in.
+# ``min`` is a floor (result is at least value), ``max`` a ceiling (at most value).
+OPERATION_ORDER: tuple[str, ...] = ("set", "add", "multiply", "min", "max")
+# Accepted aliases, normalized at compile time.
+OPERATION_ALIASES = {"subtract": "add"}
+
+INT_TARGETS: frozenset[str] = frozenset(
+    [f"{ab}_score" for ab in ABILITIES]
+    + [f"{ab}_save" for ab in ABILITIES]
+    + ["xp", "hp_current", "hp_temp", "proficiency_bonus"]
+)
+BOOL_TARGETS: frozenset[str] = frozenset(["inspiration"])
+TARGETS: frozenset[str] = INT_TARGETS | BOOL_TARGETS
+
+
+@dataclass(frozen=True)
+class Modifier:
+    target: str
+    operation: str
+    value: Any
+
+
+@dataclass(frozen=True)
+class ModifierPlan:
+    """Validated modifiers of one feat, sorted by :data:`OPERATION_ORDER`."""
+
+    modifiers: tuple[Modifier, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.modifiers)
+
+
+def _compile_one(raw: Any, index: int) -> Modifier:
+    if not isinstance(raw, dict):
+        raise ValidationError(f"Modifier #{index + 1} must be an object.")
+    target = raw.get("target")
+    operation = raw.get("operation")
+    value = raw.get("value")
+    if target not in TARGETS:
+        raise ValidationError(f"Modifier #{index + 1}: unknown target {target!r}.")
+    if operation == "subtract" and isinstance(value, int) and not isinstance(value, bool):
+        value = -value
+    operation = OPERATION_ALIASES.get(operation, operation)
+    if operation not in OPERATION_ORDER:
+        raise ValidationError(f"Modifier #{index + 1}: unknown operation {raw.get('operation')!r}.")
+    if target in BOOL_TARGETS:
+        if operation != "set" or not isinstance(value, bool):
+            raise ValidationError(f"Modifier #{index + 1}: {target} only supports set with true/false.")
+    elif isinstance(value, bool) or not isinstance(value, int):
+        raise ValidationError(f"Modifier #{index + 1}: {target} needs an integer value.")
+    return Modifier(target=target, operation=operation, value=value)
+
+
+def compile_modifiers(raw: Any) -> ModifierPlan:
+    """Validate a ``Feat.data["modifiers"]`` list and return its ordered plan.
+
+    Raises ``ValidationError`` for unknown targets, operations or value types.
+    """
+    if raw in (None, ""):
+        return ModifierPlan()
+    if not isinstance(raw, list):
+        raise ValidationError("Modifiers must be a list.")
+    compiled = [_compile_one(item, i) for i, item in enumerate(raw)]
+    # Stable sort keeps the author's order within one operation (matters for "set").
+    compiled.sort(key=lambda m: OPERATION_ORDER.index(m.operation))
+    return ModifierPlan(tuple(compiled))
+
+
+_plan_cache: dict[int, tuple[Any, ModifierPlan]] = {}
+_plan_lock = threading.Lock()
+
+
+def plan_for_feat(feat: Feat) -> ModifierPlan:
+    """Return the compiled plan for ``feat``, cached per feat and ``Feat.updated``.
+
+    Feats saved before validation existed may hold bad modifiers; those compile
+    to an empty plan rather than breaking sheet rendering.
+    """
+    cached = _plan_cache.get(feat.pk)
+    if cached is not None and cached[0] == feat.updated:
+        return cached[1]
+    try:
+        plan = compile_modifiers((feat.data or {}).get("modifiers"))
+    except ValidationError:
+        plan = ModifierPlan()
+    with _plan_lock:
+        _plan_cache[feat.pk] = (feat.updated, plan)
+    return plan
+
+
+def forget_feat(feat_id: int) -> None:
+    with _plan_lock:
+        _plan_cache.pop(feat_id, None)
+
+
+def _fold(plans: Iterable[ModifierPlan]) -> dict[str, dict[str, Any]]:
+    """Merge stacked plans into one accumulator per target and operation."""
+    acc: dict[str, dict[str, Any]] = {}
+    for plan in plans:
+        for mod in plan.modifiers:
+            slot = acc.setdefault(mod.target, {})
+            if mod.operation == "set":
+                slot["set"] = mod.value
+            elif mod.operation == "add":
+                slot["add"] = slot.get("add", 0) + mod.value
+            elif mod.operation == "multiply":
+                slot["multiply"] = slot.get("multiply", 1) * mod.value
+            elif mod.operation == "min":
+                slot["min"] = max(slot.get("min", mod.value), mod.value)
+            elif mod.operation == "max":
+                slot["max"] = min(slot.get("max", mod.value), mod.value)
+    return acc
+
+
+def _resolve(value: Any, ops: dict[str, Any] | None) -> Any:
+    if not ops:
+        return value
+    if "set" in ops:
+        value = ops["set"]
+    if "add" in ops:
+        value += ops["add"]
+    if "multiply" in ops:
+        value *= ops["multiply"]
+    if "min" in ops:
+        value = max(value, ops["min"])
+    if "max" in ops:
+        value = min(value, ops["max"])
+    return value
+
+
+def apply_feat_modifiers(sheet: CharacterSheet, feats: Iterable[Feat] | None = None) -> CharacterSheet:
+    """Apply the stacked modifiers of ``feats`` (default: ``sheet.feats``) in one pass.
+
+    Feats stack in primary-key order. Ability score changes flow through to
+    modifiers, saving throws and skills before save targets are applied.
+    """
+    chosen = sorted(sheet.feats if feats is None else feats, key=lambda f: f.pk)
+    acc = _fold(plan_for_feat(f) for f in chosen)
+    if not acc:
+        return sheet
+
+    scores = {ab: _resolve(sheet.ability_scores[ab], acc.get(f"{ab}_score")) for ab in ABILITIES}
+    mods = {ab: Character.ability_modifier(score) for ab, score in scores.items()}
+    prof = _resolve(sheet.proficiency_bonus, acc.get("proficiency_bonus"))
+    saves = {
+        ab: _resolve(
+            mods[ab] + (prof if ab in sheet.saving_throw_proficiencies else 0),
+            acc.get(f"{ab}_save"),
+        )
+        for ab in ABILITIES
+    }
+    skills = tuple(
+        dataclasses.replace(line, modifier=mods[line.ability] + prof * line.proficiency)
+        for line in sheet.skills
+    )
+    return dataclasses.replace(
+        sheet,
+        proficiency_bonus=prof,
+        ability_scores=_freeze(scores),
+        ability_mods=_freeze(mods),
+        saving_throws=_freeze(saves),
+        skills=skills,
+        xp=_resolve(sheet.xp, acc.get("xp")),
+        hp_current=_resolve(sheet.hp_current, acc.get("hp_current")),
+        hp_temp=_resolve(sheet.hp_temp, acc.get("hp_temp")),
+        inspiration=_resolve(sheet.inspiration, acc.get("inspiration")),
+    )
+
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import Iterable, Mapping
+
+from django.db.models import QuerySet
+
+from .models import Character, CharacterClass, CharacterSkill, Skill
+from .sheet import ABILITIES
+
+PERCEPTION = "Perception"
+
+
+@dataclass(frozen=True)
+class PartyStats:
+    """Column-oriented derived stats for many characters.
+
+    Every column is aligned with ``character_ids``: index ``i`` of any column
+    belongs to ``character_ids[i]``.
+    """
+
+    character_ids: tuple[int, ...]
+    level_total: array
+    proficiency_bonus: array
+    ability_mods: Mapping[str, array]
+    saving_throws: Mapping[str, array]
+    skill_modifiers: Mapping[str, array]
+    passive_perception: array
+
+    def __len__(self) -> int:
+        return len(self.character_ids)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "_index", {pk: i for i, pk in enumerate(self.character_ids)})
+
+    def index_of(self, character_id: int) -> int:
+        return self._index[character_id]  # type: ignore[attr-defined]
+
+    def for_character(self, character_id: int) -> dict:
+        i = self.index_of(character_id)
+        return {
+            "id": character_id,
+            "level_total": self.level_total[i],
+            "proficiency_bonus": self.proficiency_bonus[i],
+            "ability_mods": {ab: col[i] for ab, col in self.ability_mods.items()},
+            "saving_throws": {ab: col[i] for ab, col in self.saving_throws.items()},
+            "skills": {name: col[i] for name, col in self.skill_modifiers.items()},
+            "passive_perception": self.passive_perception[i],
+        }
+
+
+def party_stats(characters: QuerySet[Character] | Iterable[int], *, skills: Iterable[Skill] | None = None) -> PartyStats:
+    """Compute derived stats for a whole set of characters in four flat queries.
+
+    Relies on the stored ``total_level``/``proficiency_tier`` columns, so no
+    per-character aggregate is needed. Results are ordered by character id.
+    """
+    if isinstance(characters, QuerySet):
+        qs = characters.order_by("pk")
+    else:
+        qs = Character.objects.filter(pk__in=list(characters)).order_by("pk")
+    score_fields = [f"{ab}_score" for ab in ABILITIES]
+    rows = list(qs.values_list("pk", "total_level", "proficiency_tier", *score_fields))
+    ids = tuple(row[0] for row in rows)
+    pos = {pk: i for i, pk in enumerate(ids)}
+    n = len(ids)
+
+    level = array("h", (row[1] for row in rows))
+    prof = array("h", (row[2] for row in rows))
+    mods = {
+        ab: array("h", ((row[3 + k] - 10) // 2 for row in rows))
+        for k, ab in enumerate(ABILITIES)
+    }
+
+    # Saving throws: 0/1 proficiency flags per ability, OR-ed across classes.
+    save_flags = {ab: bytearray(n) for ab in ABILITIES}
+    id_subquery = qs.order_by().values("pk")
+    for character_id, throws in CharacterClass.objects.filter(character__in=id_subquery).values_list(
+        "character_id", "clazz__saving_throws"
+    ):
+        i = pos[character_id]
+        for ab in throws or []:
+            if ab in save_flags:
+                save_flags[ab][i] = 1
+    saves = {
+        ab: array("h", (mods[ab][i] + prof[i] * save_flags[ab][i] for i in range(n)))
+        for ab in ABILITIES
+    }
+
+    # Skills: one proficiency-level column per skill (0 none, 1 proficient, 2 expertise).
+    catalog = list(skills) if skills is not None else list(Skill.objects.all())
+    levels = {sk.pk: bytearray(n) for sk in catalog}
+    for character_id, skill_id, expertise in CharacterSkill.objects.filter(character__in=id_subquery).values_list(
+        "character_id", "skill_id", "expertise"
+    ):
+        col = levels.get(skill_id)
+        if col is not None:
+            col[pos[character_id]] = 2 if expertise else 1
+    skill_mods = {
+        sk.name: array("h", (mods[sk.ability][i] + prof[i] * levels[sk.pk][i] for i in range(n)))
+        for sk in catalog
+    }
+
+    perception = skill_mods.get(PERCEPTION, mods["wis"])
+    passive = array("h", (10 + value for value in perception))
+
+    return PartyStats(
+        character_ids=ids,
+        level_total=level,
+        proficiency_bonus=prof,
+        ability_mods=mods,
+        saving_throws=saves,
+        skill_modifiers=skill_mods,
+        passive_perception=passive,
+    )
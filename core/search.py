@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models
+
+from .catalog import CATALOG_MODELS, bump_catalog_version
+
+FTS_TABLE = "core_catalog_fts"
+# FTS rows use rowid = object_id * ROWID_STRIDE + model code, so a single
+# integer identifies both the model and the object and deletes hit the rowid index.
+ROWID_STRIDE = 8
+MODEL_CODES: dict[str, int] = {name: i + 1 for i, name in enumerate(CATALOG_MODELS)}
+CODE_MODELS: dict[int, str] = {code: name for name, code in MODEL_CODES.items()}
+# bm25 column weights: a hit in the name counts far more than one in the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_available: dict[str, bool] = {}
+
+
+def fts_available() -> bool:
+    """True when the default database is SQLite and the FTS table exists.
+
+    Only a positive answer is cached: a check made before the FTS migration
+    ran (e.g. by a save during ``migrate``) must not pin search to the fallback.
+    """
+    if connection.vendor != "sqlite":
+        return False
+    key = str(connection.settings_dict.get("NAME"))
+    if not _available.get(key):
+        with connection.cursor() as cursor:
+            _available[key] = FTS_TABLE in connection.introspection.table_names(cursor)
+    return _available[key]
+
+
+def _rowid(model_name: str, object_id: int) -> int:
+    return int(object_id) * ROWID_STRIDE + MODEL_CODES[model_name]
+
+
+def index_object(model_name: str, obj: models.Model) -> None:
+    if not fts_available():
+        return
+    rowid = _rowid(model_name, obj.pk)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+            [rowid, obj.name, getattr(obj, "description", "") or ""],  # type: ignore[attr-defined]
+        )
+
+
+def remove_object(model_name: str, object_id: int) -> None:
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [_rowid(model_name, object_id)])
+
+
+def rebuild_index() -> dict[str, int]:
+    """Repopulate the FTS table from the catalog tables. Returns rows indexed per model."""
+    counts: dict[str, int] = {}
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        for name, model in CATALOG_MODELS.items():
+            table = model._meta.db_table
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+                f"SELECT id * {ROWID_STRIDE} + {MODEL_CODES[name]}, name, description FROM {table}"
+            )
+            counts[name] = cursor.rowcount
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    # Results may have changed without a model write; invalidate cached responses.
+    for name in CATALOG_MODELS:
+        bump_catalog_version(name)
+    return counts
+
+
+def build_match(q: str) -> str | None:
+    """Turn free text into an FTS5 query where every token must match as a prefix."""
+    tokens = _TOKEN_RE.findall(q.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def _ranked(cursor, match: str, per_model: int, taken: dict[int, int], seen: set[int]) -> list[tuple[int, str]]:
+    # Rank on (rowid, score) only and fetch names for the few winners; reading
+    # the name of every hit is what makes broad prefixes expensive.
+    sql = f"""
+        WITH hits AS (
+            SELECT rowid AS rid, bm25({FTS_TABLE}, %s, %s) AS score
+            FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+        ),
+        top AS (
+            SELECT rid, score FROM (
+                SELECT rid, score,
+                       ROW_NUMBER() OVER (PARTITION BY rid %% {ROWID_STRIDE} ORDER BY score, rid) AS n
+                FROM hits
+            )
+            WHERE n <= %s
+        )
+        SELECT top.rid, f.name FROM top JOIN {FTS_TABLE} AS f ON f.rowid = top.rid
+        ORDER BY top.score, f.name
+    """
+    cursor.execute(sql, [NAME_WEIGHT, DESCRIPTION_WEIGHT, match, per_model])
+    rows = []
+    for rid, name in cursor.fetchall():
+        code = rid % ROWID_STRIDE
+        if rid in seen or taken.get(code, 0) >= per_model:
+            continue
+        taken[code] = taken.get(code, 0) + 1
+        seen.add(rid)
+        rows.append((rid, name))
+    return rows
+
+
+def search_catalog(q: str, per_model: int = 5) -> list[dict]:
+    """Ranked prefix search over names and descriptions of every catalog model.
+
+    Name hits always rank first; descriptions are only searched when a model's
+    quota of ``per_model`` results is not already filled by names, so the
+    common typeahead case is a single query. Falls back to the ``icontains``
+    scan when FTS is unavailable.
+    """
+    if not fts_available():
+        return search_catalog_icontains(q, per_model)
+    match = build_match(q)
+    if match is None:
+        return []
+    taken: dict[int, int] = {}
+    seen: set[int] = set()
+    with connection.cursor() as cursor:
+        rows = _ranked(cursor, f"{{name}} : ({match})", per_model, taken, seen)
+        if any(taken.get(code, 0) < per_model for code in CODE_MODELS):
+            rows += _ranked(cursor, f"{{description}} : ({match})", per_model, taken, seen)
+    return [
+        {"model": CODE_MODELS[rid % ROWID_STRIDE], "id": rid // ROWID_STRIDE, "name": name}
+        for rid, name in rows
+    ]
+
+
+def search_catalog_icontains(q: str, per_model: int = 5) -> list[dict]:
+    """Original per-model ``name__icontains`` lookup, kept as a fallback and benchmark baseline."""
+    results = []
+    for model_name, model in CATALOG_MODELS.items():
+        for obj in model.objects.filter(name__icontains=q)[:per_model]:  # type: ignore[attr-defined]
+            results.append({"model": model_name, "id": obj.pk, "name": obj.name})
+    return results
+
+
+# ---- response cache ----
+CACHE_PREFIX = "catalog-search"
+COUNTERS = ("hits", "misses", "not_modified")
+
+
+def normalize_query(q: str) -> str:
+    return " ".join(q.lower().split())
+
+
+def search_etag(q: str, versions: dict[str, int], backend: str) -> str:
+    """Quoted ETag that changes whenever any catalog model is written."""
+    stamp = ",".join(f"{name}:{versions[name]}" for name in sorted(versions))
+    digest = hashlib.sha1(f"{backend}|{stamp}|{q}".encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def cache_get(etag: str) -> list[dict] | None:
+    return cache.get(f"{CACHE_PREFIX}:{etag}")
+
+
+def cache_set(etag: str, results: list[dict]) -> None:
+    cache.set(f"{CACHE_PREFIX}:{etag}", results, getattr(settings, "SEARCH_CACHE_TIMEOUT", 300))
+
+
+def count(counter: str) -> None:
+    key = f"{CACHE_PREFIX}:count:{counter}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add and incr
+        cache.set(key, 1, None)
+
+
+def cache_stats() -> dict[str, int]:
+    return {name: cache.get(f"{CACHE_PREFIX}:count:{name}", 0) for name in COUNTERS}
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Iterable, Mapping
+
+from django.db.models import Prefetch
+
+from .models import Character, CharacterClass, CharacterItem, CharacterSkill, Skill
+
+ABILITIES: tuple[str, ...] = tuple(code for code, _label in Skill.ABILITY_CHOICES)
+
+
+@dataclass(frozen=True)
+class SkillLine:
+    skill_id: int
+    name: str
+    ability: str
+    # 0 = none, 1 = proficient, 2 = expertise (same scale as Character.skill_proficiency_level)
+    proficiency: int
+    modifier: int
+
+
+@dataclass(frozen=True)
+class CharacterSheet:
+    """Immutable snapshot of every derived stat for one character.
+
+    Built by :func:`build_character_sheet` in a fixed number of queries, so
+    templates and APIs can read any value without touching the database again.
+    """
+
+    character_id: int
+    name: str
+    level_total: int
+    proficiency_bonus: int
+    ability_scores: Mapping[str, int]
+    ability_mods: Mapping[str, int]
+    saving_throw_proficiencies: frozenset[str]
+    saving_throws: Mapping[str, int]
+    skills: tuple[SkillLine, ...]
+    xp: int = 0
+    hp_current: int = 0
+    hp_temp: int = 0
+    inspiration: bool = False
+    feat_ids: tuple[int, ...] = ()
+    feats: tuple = field(default=(), compare=False, repr=False)
+    items: tuple = field(default=(), compare=False, repr=False)
+
+    def skill(self, skill: Skill | int | str) -> SkillLine:
+        if isinstance(skill, Skill):
+            key: int | str = skill.pk
+        else:
+            key = skill
+        for line in self.skills:
+            if line.skill_id == key or line.name == key:
+                return line
+        raise KeyError(skill)
+
+    def skill_modifier(self, skill: Skill | int | str) -> int:
+        return self.skill(skill).modifier
+
+
+def _freeze(mapping: dict) -> Mapping:
+    return MappingProxyType(dict(mapping))
+
+
+def build_character_sheet(
+    character: Character | int,
+    *,
+    skills: Iterable[Skill] | None = None,
+) -> CharacterSheet:
+    """Load a character and its relations in a constant number of queries.
+
+    Query count does not depend on how many classes, skills, feats or items the
+    character has. Pass ``skills`` to reuse an already loaded skill catalog when
+    building many sheets in one request.
+    """
+    pk = character.pk if isinstance(character, Character) else int(character)
+    char = (
+        Character.objects.select_related("species", "background")
+        .prefetch_related(
+            Prefetch("classes", queryset=CharacterClass.objects.select_related("clazz", "subclass")),
+            Prefetch("skill_links", queryset=CharacterSkill.objects.only("id", "character_id", "skill_id", "expertise")),
+            "feats",
+            Prefetch("items", queryset=CharacterItem.objects.select_related("item")),
+        )
+        .get(pk=pk)
+    )
+    catalog = list(skills) if skills is not None else list(Skill.objects.all())
+
+    classes = list(char.classes.all())  # type: ignore[attr-defined]
+    level_total = sum(cc.level for cc in classes)
+    prof = Character.proficiency_for_level(level_total)
+
+    scores = {ab: char.ability_score(ab) for ab in ABILITIES}
+    mods = {ab: Character.ability_modifier(score) for ab, score in scores.items()}
+
+    save_profs: set[str] = set()
+    for cc in classes:
+        for ab in (cc.clazz.saving_throws or []):
+            save_profs.add(ab)
+    saves = {ab: mods[ab] + (prof if ab in save_profs else 0) for ab in ABILITIES}
+
+    levels = {
+        link.skill_id: (2 if link.expertise else 1)
+        for link in char.skill_links.all()  # type: ignore[attr-defined]
+    }
+    lines = tuple(
+        SkillLine(
+            skill_id=sk.pk,
+            name=sk.name,
+            ability=sk.ability,
+            proficiency=levels.get(sk.pk, 0),
+            modifier=mods[sk.ability] + prof * levels.get(sk.pk, 0),
+        )
+        for sk in catalog
+    )
+
+    feats = tuple(char.feats.all())
+    return CharacterSheet(
+        character_id=char.pk,
+        name=char.name,
+        level_total=level_total,
+        proficiency_bonus=prof,
+        ability_scores=_freeze(scores),
+        ability_mods=_freeze(mods),
+        saving_throw_proficiencies=frozenset(save_profs),
+        saving_throws=_freeze(saves),
+        skills=lines,
+        xp=char.xp,
+        hp_current=char.hp_current,
+        hp_temp=char.hp_temp,
+        inspiration=char.inspiration,
+        feat_ids=tuple(f.pk for f in feats),
+        feats=feats,
+        items=tuple(char.items.all()),  # type: ignore[attr-defined]
+    )
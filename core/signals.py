@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from .catalog import CATALOG_MODELS, bump_catalog_version
+from .feats import grant_ancestor_ids, refresh_grant_closure, sync_feat_grants
+from .models import Character, CharacterClass, Feat, FeatPrerequisite
+from .modifiers import forget_feat
+from .search import index_object, remove_object
+from .typeahead import index as typeahead_index
+
+
+def _refresh_characters(instance: CharacterClass, *character_ids: int | None) -> None:
+    ids = {pk for pk in character_ids if pk is not None}
+    if not ids:
+        return
+    Character.objects.filter(pk__in=ids).refresh_level_totals()
+    # Keep an already-loaded parent instance in sync (e.g. cc.character.level_total).
+    field = CharacterClass._meta.get_field("character")
+    if field.is_cached(instance):
+        parent = field.get_cached_value(instance)
+        if parent is not None and parent.pk in ids:
+            parent.refresh_from_db(fields=list(Character.DENORMALIZED_FIELDS))
+
+
+@receiver(post_init, sender=CharacterClass)
+def remember_loaded_character(sender, instance: CharacterClass, **kwargs) -> None:
+    # A membership can be moved to another character; both need recomputing.
+    instance._loaded_character_id = instance.__dict__.get("character_id")  # type: ignore[attr-defined]
+
+
+@receiver(post_save, sender=CharacterClass)
+def character_class_saved(sender, instance: CharacterClass, raw: bool = False, **kwargs) -> None:
+    if raw:
+        return
+    previous = getattr(instance, "_loaded_character_id", None)
+    _refresh_characters(instance, instance.character_id, previous)
+    instance._loaded_character_id = instance.character_id  # type: ignore[attr-defined]
+
+
+@receiver(post_delete, sender=CharacterClass)
+def character_class_deleted(sender, instance: CharacterClass, **kwargs) -> None:
+    _refresh_characters(instance, instance.character_id)
+
+
+@receiver(post_save, sender=Feat)
+def feat_saved(sender, instance: Feat, raw: bool = False, **kwargs) -> None:
+    if raw:
+        return
+    FeatPrerequisite.sync_for(instance)
+    sync_feat_grants(instance)
+
+
+@receiver(pre_delete, sender=Feat)
+def feat_about_to_delete(sender, instance: Feat, **kwargs) -> None:
+    instance._grant_ancestor_ids = grant_ancestor_ids(instance.pk) - {instance.pk}  # type: ignore[attr-defined]
+
+
+@receiver(post_delete, sender=Feat)
+def feat_deleted(sender, instance: Feat, **kwargs) -> None:
+    forget_feat(instance.pk)
+    refresh_grant_closure(getattr(instance, "_grant_ancestor_ids", ()))
+
+
+def _connect_catalog(model_name: str, model) -> None:
+    def saved(sender, instance, raw: bool = False, **kwargs) -> None:
+        if raw:
+            return
+        index_object(model_name, instance)
+        version = bump_catalog_version(model_name)
+        pk, name = instance.pk, instance.name
+        # In-memory index only learns about writes that actually commit.
+        transaction.on_commit(lambda: typeahead_index.upsert(model_name, pk, name, version))
+
+    def deleted(sender, instance, **kwargs) -> None:
+        remove_object(model_name, instance.pk)
+        version = bump_catalog_version(model_name)
+        pk = instance.pk
+        transaction.on_commit(lambda: typeahead_index.remove(model_name, pk, version))
+
+    post_save.connect(saved, sender=model, weak=False, dispatch_uid=f"catalog-index-save-{model_name}")
+    post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=f"catalog-index-delete-{model_name}")
+
+
+for _name, _model in CATALOG_MODELS.items():
+    _connect_catalog(_name, _model)
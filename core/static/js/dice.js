@@ -130,6 +130,23 @@
     const origin = window.location.origin;
     return `${origin}/dice-theme/${b64}`;
   }
+  // Resolved settings from the server: a cached theme loads from versioned, immutable URLs.
+  let manifest = null;
+  async function loadManifest() {
+    if (manifest || !userPrefs.manifestUrl) return manifest;
+    try {
+      const resp = await fetch(userPrefs.manifestUrl, { cache: 'no-cache', credentials: 'same-origin' });
+      if (resp.ok) manifest = await resp.json();
+    } catch (_) { }
+    return manifest;
+  }
+  function manifestTheme(url) {
+    return manifest && manifest.theme && manifest.externalThemeUrl === url ? manifest.theme : null;
+  }
+  function themeBase(url) {
+    const theme = manifestTheme(url);
+    return theme ? `${window.location.origin}${theme.base_url}` : proxiedThemeBase(url);
+  }
   function themeMetaFromStorage(url) {
     try { const v = localStorage.getItem('diceThemeMeta:' + b64url(url)); return v ? JSON.parse(v) : null; } catch (_) { return null; }
   }
@@ -138,12 +155,15 @@
     if (url) {
       const meta = themeMetaFromStorage(url);
       if (meta && meta.themeColor) return meta.themeColor;
+      const theme = manifestTheme(url);
+      if (theme && theme.themeColor) return theme.themeColor;
     }
     return (PRESETS[state.preset] || PRESETS.amethyst).color;
   }
 
   async function ensureDice3D() {
     if (dice3d.ready && dice3d.box) return dice3d.box;
+    await loadManifest();
     const mod = await import('https://unpkg.com/@3d-dice/dice-box@1.1.4/dist/dice-box.es.min.js');
     const DiceBox = mod.default;
     const finish = FINISH[state.finish] || FINISH.glossy;
@@ -158,7 +178,7 @@
       scale: 5
     };
     if (hasTheme) {
-      opts.externalThemes = { 'user-external': proxiedThemeBase(state.externalThemeUrl) };
+      opts.externalThemes = { 'user-external': themeBase(state.externalThemeUrl) };
       const color = currentThemeColor(); if (color) opts.themeColor = color;
     } else {
       const preset = PRESETS[state.preset] || PRESETS.amethyst;
@@ -196,7 +216,7 @@
     const hasTheme = !!state.externalThemeUrl;
     const updateOpts = { theme: hasTheme ? 'user-external' : 'default' };
     if (hasTheme) {
-      updateOpts.externalThemes = { 'user-external': proxiedThemeBase(state.externalThemeUrl) };
+      updateOpts.externalThemes = { 'user-external': themeBase(state.externalThemeUrl) };
       const color = currentThemeColor(); if (color) updateOpts.themeColor = color;
     } else {
       const preset = PRESETS[state.preset] || PRESETS.amethyst;
@@ -210,7 +230,7 @@
 
     let resultsArray = [];
     try {
-      const rollOpts = hasTheme ? { theme: 'user-external', externalThemes: { 'user-external': proxiedThemeBase(state.externalThemeUrl) }, themeColor: currentThemeColor() } : { theme: 'default', themeColor: (PRESETS[state.preset] || PRESETS.amethyst).color };
+      const rollOpts = hasTheme ? { theme: 'user-external', externalThemes: { 'user-external': themeBase(state.externalThemeUrl) }, themeColor: currentThemeColor() } : { theme: 'default', themeColor: (PRESETS[state.preset] || PRESETS.amethyst).color };
       if (!hasTheme) { const f = FINISH[state.finish] || FINISH.glossy; rollOpts.enableShadows = f.shadows; rollOpts.lightIntensity = f.lightIntensity; }
       resultsArray = await box.roll(notations, rollOpts);
     } catch (e) {
@@ -279,7 +299,7 @@
       const hasTheme = !!state.externalThemeUrl;
       const opts = { theme: hasTheme ? 'user-external' : 'default' };
       if (hasTheme) {
-        opts.externalThemes = { 'user-external': proxiedThemeBase(state.externalThemeUrl) };
+        opts.externalThemes = { 'user-external': themeBase(state.externalThemeUrl) };
         const color = currentThemeColor(); if (color) opts.themeColor = color;
       } else {
         const preset = PRESETS[state.preset] || PRESETS.amethyst;
@@ -309,7 +329,7 @@
         const hasTheme = !!state.externalThemeUrl;
         const opts = { theme: hasTheme ? 'user-external' : 'default' };
         if (hasTheme) {
-          opts.externalThemes = { 'user-external': proxiedThemeBase(state.externalThemeUrl) };
+          opts.externalThemes = { 'user-external': themeBase(state.externalThemeUrl) };
           const color2 = currentThemeColor(); if (color2) opts.themeColor = color2;
         } else {
           const preset = PRESETS[state.preset] || PRESETS.amethyst;
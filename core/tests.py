@@ -1,8 +1,53 @@
+import asyncio
+import gzip
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core import serializers
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import AsyncRequestFactory, Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Feat, Class
+from .models import (
+    Character,
+    CharacterClass,
+    CharacterSkill,
+    Class,
+    Feat,
+    FeatPrerequisite,
+    Item,
+    Language,
+    Skill,
+    Species,
+    Spell,
+    ThemeJob,
+)
+from .catalog import bump_catalog_version, catalog_versions
+from .feats import GrantCycleError, eligible_feats, granted_features, granted_feats
+from .modifiers import apply_feat_modifiers, compile_modifiers, plan_for_feat
+from .party import party_stats
+from . import theme_async_http, theme_config, theme_fetch, theme_http, theme_images, theme_index, theme_jobs
+from . import search as search_module
+from .sheet import build_character_sheet
+from .theme_cache import blob_path, cache_root, encode_base, single_flight, theme_dir
+from .typeahead import _Shard as TypeaheadShard, index as typeahead_index
+from .views import dice_theme_load_async, dice_theme_proxy_async, dice_theme_test_async
 
 
 class FeatCreateTests(TestCase):
@@ -50,3 +95,1633 @@ class FeatCreateTests(TestCase):
         self.assertEqual(feat.data.get("charges"), 2)
         self.assertEqual(feat.data.get("recharge_type"), "long rest")
         self.assertEqual(feat.data.get("grants"), [{"model": "feat", "id": existing.id}])
+
+
+class CharacterSheetTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.user = User.objects.create_user(username="player", password="pw")
+        self.character = Character.objects.create(
+            user=self.user, name="Vex", dex_score=16, wis_score=13, int_score=8
+        )
+        self.rogue = Class.objects.create(name="Rogue", saving_throws=["dex", "int"])
+        self.stealth = Skill.objects.create(name="Stealth", ability="dex")
+        self.arcana = Skill.objects.create(name="Arcana", ability="int")
+        CharacterClass.objects.create(character=self.character, clazz=self.rogue, level=5)
+        CharacterSkill.objects.create(character=self.character, skill=self.stealth, expertise=True)
+
+    def test_matches_per_instance_methods(self) -> None:
+        sheet = build_character_sheet(self.character)
+        self.assertEqual(sheet.level_total, self.character.level_total)
+        self.assertEqual(sheet.proficiency_bonus, self.character.proficiency_bonus)
+        for ab in ("str", "dex", "con", "int", "wis", "cha"):
+            self.assertEqual(sheet.ability_mods[ab], self.character.ability_mod(ab))
+            self.assertEqual(sheet.saving_throws[ab], self.character.saving_throw_modifier(ab))
+        for skill in (self.stealth, self.arcana):
+            self.assertEqual(sheet.skill_modifier(skill), self.character.skill_modifier(skill))
+        self.assertEqual(sheet.skill("Stealth").modifier, 3 + 3 * 2)
+
+    def test_snapshot_is_immutable(self) -> None:
+        sheet = build_character_sheet(self.character.pk)
+        with self.assertRaises(Exception):
+            sheet.level_total = 20  # type: ignore[misc]
+        with self.assertRaises(TypeError):
+            sheet.ability_mods["dex"] = 10  # type: ignore[index]
+
+    def test_query_count_constant(self) -> None:
+        with self.assertNumQueries(6):
+            build_character_sheet(self.character.pk)
+        for i in range(10):
+            skill = Skill.objects.create(name=f"Skill {i}", ability="wis")
+            CharacterSkill.objects.create(character=self.character, skill=skill)
+        for i in range(3):
+            clazz = Class.objects.create(name=f"Class {i}", saving_throws=["wis"])
+            CharacterClass.objects.create(character=self.character, clazz=clazz, level=2)
+        self.character.feats.add(Feat.objects.create(name="Lucky", description="desc"))
+        with self.assertNumQueries(6):
+            sheet = build_character_sheet(self.character.pk)
+        self.assertEqual(sheet.level_total, 11)
+        self.assertEqual(len(sheet.skills), 12)
+
+
+class CharacterLevelColumnTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.user = User.objects.create_user(username="player", password="pw")
+        self.character = Character.objects.create(user=self.user, name="Pike")
+        self.cleric = Class.objects.create(name="Cleric")
+        self.fighter = Class.objects.create(name="Fighter")
+
+    def stored(self, character: Character) -> tuple[int, int]:
+        return tuple(
+            Character.objects.filter(pk=character.pk).values_list("total_level", "proficiency_tier").get()
+        )  # type: ignore[return-value]
+
+    def test_create_update_delete(self) -> None:
+        cc = CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=4)
+        self.assertEqual(self.stored(self.character), (4, 2))
+        self.assertEqual(self.character.level_total, 4)
+        cc.level = 9
+        cc.save()
+        self.assertEqual(self.stored(self.character), (9, 4))
+        cc.delete()
+        self.assertEqual(self.stored(self.character), (0, 2))
+
+    def test_bulk_operations(self) -> None:
+        CharacterClass.objects.bulk_create([
+            CharacterClass(character=self.character, clazz=self.cleric, level=3),
+            CharacterClass(character=self.character, clazz=self.fighter, level=2),
+        ])
+        self.assertEqual(self.stored(self.character), (5, 3))
+        CharacterClass.objects.filter(character=self.character).update(level=7)
+        self.assertEqual(self.stored(self.character), (14, 5))
+        CharacterClass.objects.filter(clazz=self.fighter).delete()
+        self.assertEqual(self.stored(self.character), (7, 3))
+
+    def test_cascade_from_class_delete(self) -> None:
+        CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=3)
+        CharacterClass.objects.create(character=self.character, clazz=self.fighter, level=10)
+        self.fighter.delete()
+        self.assertEqual(self.stored(self.character), (3, 2))
+
+    def test_moving_membership_updates_both_characters(self) -> None:
+        other = Character.objects.create(user=self.user, name="Scanlan")
+        cc = CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=6)
+        cc.character = other
+        cc.save()
+        self.assertEqual(self.stored(self.character), (0, 2))
+        self.assertEqual(self.stored(other), (6, 3))
+
+    def test_stale_instance_save_does_not_clobber(self) -> None:
+        stale = Character.objects.get(pk=self.character.pk)
+        CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=5)
+        stale.name = "Pike Trickfoot"
+        stale.save()
+        self.assertEqual(self.stored(self.character), (5, 3))
+
+    def test_copies_and_deleted_rows_save_as_new_rows(self) -> None:
+        CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=5)
+        copy = Character.objects.get(pk=self.character.pk)
+        copy.pk = None
+        copy.name = "Pike Copy"
+        copy.save()
+        self.assertNotEqual(copy.pk, self.character.pk)
+        # The copy has no classes yet, so it does not inherit the level.
+        self.assertEqual(self.stored(copy), (0, 2))
+        self.assertEqual(self.stored(self.character), (5, 3))
+
+        gone = Character.objects.get(pk=copy.pk)
+        Character.objects.filter(pk=copy.pk).delete()
+        gone.save()
+        self.assertEqual(self.stored(gone), (0, 2))
+
+    def test_rebuild_command(self) -> None:
+        CharacterClass.objects.create(character=self.character, clazz=self.cleric, level=13)
+        Character.objects.filter(pk=self.character.pk).update(total_level=1, proficiency_tier=2)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_level_totals", "--check", stdout=StringIO())
+        out = StringIO()
+        call_command("rebuild_level_totals", stdout=out)
+        self.assertIn("fixed 1 stale", out.getvalue())
+        self.assertEqual(self.stored(self.character), (13, 5))
+        call_command("rebuild_level_totals", "--check", stdout=StringIO())
+
+
+class PartyStatsTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.user = User.objects.create_user(username="dm", password="pw")
+        self.wizard = Class.objects.create(name="Wizard", saving_throws=["int", "wis"])
+        self.perception = Skill.objects.create(name="Perception", ability="wis")
+        self.arcana = Skill.objects.create(name="Arcana", ability="int")
+        self.characters = []
+        for i in range(3):
+            c = Character.objects.create(user=self.user, name=f"PC {i}", int_score=12 + i * 2, wis_score=9 + i)
+            CharacterClass.objects.create(character=c, clazz=self.wizard, level=1 + i * 4)
+            self.characters.append(c)
+        CharacterSkill.objects.create(character=self.characters[1], skill=self.perception)
+        CharacterSkill.objects.create(character=self.characters[2], skill=self.arcana, expertise=True)
+
+    def test_matches_per_instance_methods(self) -> None:
+        stats = party_stats(Character.objects.filter(user=self.user))
+        self.assertEqual(list(stats.character_ids), sorted(c.pk for c in self.characters))
+        for c in self.characters:
+            c.refresh_from_db()
+            row = stats.for_character(c.pk)
+            self.assertEqual(row["proficiency_bonus"], c.proficiency_bonus)
+            for ab in ("str", "dex", "con", "int", "wis", "cha"):
+                self.assertEqual(row["saving_throws"][ab], c.saving_throw_modifier(ab))
+            self.assertEqual(row["skills"]["Arcana"], c.skill_modifier(self.arcana))
+            self.assertEqual(row["passive_perception"], 10 + c.skill_modifier(self.perception))
+
+    def test_query_count_independent_of_party_size(self) -> None:
+        with self.assertNumQueries(4):
+            party_stats(Character.objects.all())
+        for i in range(20):
+            c = Character.objects.create(user=self.user, name=f"Extra {i}")
+            CharacterSkill.objects.create(character=c, skill=self.arcana)
+        ids = list(Character.objects.values_list("pk", flat=True))
+        with self.assertNumQueries(4):
+            stats = party_stats(ids)
+        self.assertEqual(len(stats), 23)
+
+
+class FeatModifierTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tester", password="pw")
+        self.character = Character.objects.create(user=self.user, name="Grog", str_score=18)
+        barbarian = Class.objects.create(name="Barbarian", saving_throws=["str", "con"])
+        CharacterClass.objects.create(character=self.character, clazz=barbarian, level=4)
+        self.athletics = Skill.objects.create(name="Athletics", ability="str")
+        CharacterSkill.objects.create(character=self.character, skill=self.athletics)
+
+    def test_plan_is_ordered_by_operation(self) -> None:
+        plan = compile_modifiers([
+            {"target": "str_score", "operation": "max", "value": 20},
+            {"target": "str_score", "operation": "add", "value": 2},
+            {"target": "hp_temp", "operation": "subtract", "value": 1},
+            {"target": "str_score", "operation": "set", "value": 19},
+        ])
+        self.assertEqual([m.operation for m in plan.modifiers], ["set", "add", "add", "max"])
+        self.assertEqual(plan.modifiers[2].value, -1)
+
+    def test_rejects_unknown_target(self) -> None:
+        with self.assertRaises(ValidationError):
+            compile_modifiers([{"target": "luck", "operation": "add", "value": 1}])
+        with self.assertRaises(ValidationError):
+            compile_modifiers([{"target": "inspiration", "operation": "add", "value": 1}])
+
+    def test_form_rejects_unknown_target_at_save_time(self) -> None:
+        self.client.login(username="tester", password="pw")
+        response = self.client.post(
+            reverse("core:feat_create"),
+            {
+                "name": "Broken",
+                "description": "desc",
+                "modifiers": '[{"target": "luck", "operation": "add", "value": 1}]',
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Feat.objects.filter(name="Broken").exists())
+
+    def test_stacked_feats_apply_in_one_pass(self) -> None:
+        self.character.feats.add(
+            Feat.objects.create(
+                name="Gauntlets",
+                description="desc",
+                data={"modifiers": [{"target": "str_score", "operation": "set", "value": 19}]},
+            ),
+            Feat.objects.create(
+                name="Belt",
+                description="desc",
+                data={"modifiers": [
+                    {"target": "str_score", "operation": "add", "value": 4},
+                    {"target": "str_score", "operation": "max", "value": 22},
+                    {"target": "con_save", "operation": "add", "value": 1},
+                    {"target": "inspiration", "operation": "set", "value": True},
+                ]},
+            ),
+        )
+        sheet = apply_feat_modifiers(build_character_sheet(self.character))
+        self.assertEqual(sheet.ability_scores["str"], 22)
+        self.assertEqual(sheet.ability_mods["str"], 6)
+        self.assertEqual(sheet.saving_throws["str"], 8)
+        self.assertEqual(sheet.saving_throws["con"], 3)
+        self.assertEqual(sheet.skill_modifier(self.athletics), 8)
+        self.assertTrue(sheet.inspiration)
+
+    def test_plan_cache_keyed_by_updated(self) -> None:
+        feat = Feat.objects.create(
+            name="Tough",
+            description="desc",
+            data={"modifiers": [{"target": "hp_temp", "operation": "add", "value": 2}]},
+        )
+        first = plan_for_feat(feat)
+        self.assertIs(plan_for_feat(feat), first)
+        feat.data = {"modifiers": [{"target": "hp_temp", "operation": "add", "value": 5}]}
+        feat.save()
+        self.assertEqual(plan_for_feat(feat).modifiers[0].value, 5)
+
+
+class FeatEligibilityTests(TestCase):
+    def setUp(self) -> None:
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tester", password="pw")
+        self.elf = Species.objects.create(name="Elf")
+        self.dwarf = Species.objects.create(name="Dwarf")
+        self.wizard = Class.objects.create(name="Wizard")
+        self.fighter = Class.objects.create(name="Fighter")
+        self.character = Character.objects.create(user=self.user, name="Keyleth", species=self.elf)
+        CharacterClass.objects.create(character=self.character, clazz=self.wizard, level=5)
+        self.owned = Feat.objects.create(name="Owned", description="desc")
+        self.character.feats.add(self.owned)
+
+    def feat(self, name: str, **prereq) -> Feat:
+        return Feat.objects.create(name=name, description="desc", data={"prerequisites": prereq} if prereq else {})
+
+    def test_prerequisites_follow_feat_data(self) -> None:
+        feat = self.feat("Elven Accuracy", species=self.elf.pk, total_level=4)
+        prereq = FeatPrerequisite.objects.get(feat=feat)
+        self.assertEqual((prereq.species_id, prereq.total_level), (self.elf.pk, 4))
+        feat.data = {}
+        feat.save()
+        self.assertFalse(FeatPrerequisite.objects.filter(feat=feat).exists())
+
+    def test_form_save_syncs_prerequisites(self) -> None:
+        self.client.login(username="tester", password="pw")
+        self.client.post(
+            reverse("core:feat_create"),
+            {"name": "War Caster", "description": "desc", "prerequisite_class": self.wizard.pk,
+             "prerequisite_class_level": 4},
+        )
+        prereq = FeatPrerequisite.objects.get(feat__name="War Caster")
+        self.assertEqual((prereq.clazz_id, prereq.class_level), (self.wizard.pk, 4))
+
+    def test_eligible_feats(self) -> None:
+        expected = {
+            self.feat("Open"),
+            self.feat("Elf Only", species=self.elf.pk),
+            self.feat("Wizard 5", **{"class": self.wizard.pk, "class_level": 5}),
+            self.feat("Level 5", total_level=5),
+            self.feat("Needs Owned", feature=self.owned.pk),
+        }
+        self.feat("Dwarf Only", species=self.dwarf.pk)
+        self.feat("Wizard 6", **{"class": self.wizard.pk, "class_level": 6})
+        self.feat("Fighter 1", **{"class": self.fighter.pk, "class_level": 1})
+        self.feat("Level 6", total_level=6)
+        self.feat("Needs Other", feature=Feat.objects.get(name="Open").pk)
+        self.feat("Elf Level 9", species=self.elf.pk, total_level=9)
+        with self.assertNumQueries(1):
+            eligible = set(eligible_feats(self.character))
+        self.assertEqual(eligible, expected)
+
+    def test_deleted_or_missing_requirements_make_feats_ineligible(self) -> None:
+        gone_class = Class.objects.create(name="Artificer")
+        gone_species = Species.objects.create(name="Warforged")
+        gone_feat = Feat.objects.create(name="Retired", description="desc")
+        self.feat("Artificer 1", **{"class": gone_class.pk, "class_level": 1})
+        self.feat("Warforged Only", species=gone_species.pk)
+        self.feat("Needs Retired", feature=gone_feat.pk)
+        self.feat("Needs Nothing Real", species=999_999)
+        gone_class.delete()
+        gone_species.delete()
+        gone_feat.delete()
+        prereq = FeatPrerequisite.objects.get(feat__name="Artificer 1")
+        self.assertEqual((prereq.clazz_id, prereq.unsatisfiable), (None, True))
+        names = set(eligible_feats(self.character).values_list("name", flat=True))
+        self.assertFalse(names & {"Artificer 1", "Warforged Only", "Needs Retired", "Needs Nothing Real"})
+
+
+class FeatGrantClosureTests(TestCase):
+    def feat(self, name: str, *grants: Feat, extra: list | None = None) -> Feat:
+        data = {"grants": [{"model": "feat", "id": g.pk} for g in grants] + (extra or [])}
+        return Feat.objects.create(name=name, description="desc", data=data)
+
+    def set_grants(self, feat: Feat, *grants: Feat) -> None:
+        feat.data = {"grants": [{"model": "feat", "id": g.pk} for g in grants]}
+        feat.save()
+
+    def test_deep_chain(self) -> None:
+        chain = [self.feat("Link 0", extra=[{"model": "spell", "id": 7}])]
+        for i in range(1, 40):
+            chain.append(self.feat(f"Link {i}", chain[-1]))
+        top = chain[-1]
+        self.assertEqual(set(granted_feats([top.pk])), set(chain))
+        with self.assertNumQueries(1):
+            rows = list(granted_features([top.pk]).values_list("model", "object_id"))
+        self.assertIn(("spell", 7), rows)
+        self.assertEqual(top.grant_descendants.get(descendant=chain[0]).depth, 39)
+
+    def test_diamond(self) -> None:
+        bottom = self.feat("Bottom")
+        left = self.feat("Left", bottom)
+        right = self.feat("Right", bottom)
+        top = self.feat("Top", left, right)
+        self.assertEqual(set(granted_feats([top.pk])), {top, left, right, bottom})
+        self.assertEqual(top.grant_descendants.get(descendant=bottom).depth, 2)
+        # Removing one side of the diamond keeps bottom reachable through the other.
+        self.set_grants(left)
+        self.assertEqual(set(granted_feats([top.pk])), {top, left, right, bottom})
+        self.set_grants(right)
+        self.assertEqual(set(granted_feats([top.pk])), {top, left, right})
+
+    def test_changes_propagate_to_ancestors(self) -> None:
+        leaf = self.feat("Leaf")
+        middle = self.feat("Middle")
+        top = self.feat("Top", middle)
+        self.set_grants(middle, leaf)
+        self.assertIn(leaf, granted_feats([top.pk]))
+        middle.delete()
+        self.assertEqual(set(granted_feats([top.pk])), {top})
+
+    def test_forward_reference_resolved_when_target_created(self) -> None:
+        top = Feat.objects.create(name="Top", description="desc", data={"grants": [{"model": "feat", "id": 999}]})
+        Feat.objects.create(pk=999, name="Late", description="desc")
+        self.assertEqual({f.pk for f in granted_feats([top.pk])}, {top.pk, 999})
+
+    def test_rejects_cycles(self) -> None:
+        a = self.feat("A")
+        b = self.feat("B", a)
+        c = self.feat("C", b)
+        with self.assertRaises(GrantCycleError):
+            self.set_grants(a, c)
+        a.refresh_from_db()
+        self.assertEqual(a.data, {"grants": []})
+        with self.assertRaises(GrantCycleError):
+            self.set_grants(a, a)
+
+    def test_rejects_cycles_through_forward_references(self) -> None:
+        a = Feat.objects.create(name="A", description="desc", data={"grants": [{"model": "feat", "id": 999}]})
+        with self.assertRaises(GrantCycleError):
+            Feat.objects.create(pk=999, name="B", description="desc", data={"grants": [{"model": "feat", "id": a.pk}]})
+        self.assertFalse(Feat.objects.filter(pk=999).exists())
+        self.assertEqual({f.pk for f in granted_feats([a.pk])}, {a.pk})
+        # Same when the new feat's id is assigned by the database.
+        c = Feat.objects.create(name="C", description="desc")
+        a.data = {"grants": [{"model": "feat", "id": c.pk + 1}]}
+        a.save()
+        with self.assertRaises(GrantCycleError):
+            self.feat("D", a)
+        self.assertFalse(Feat.objects.filter(name="D").exists())
+
+
+class CreationSearchTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tester", password="pw")
+        self.client.login(username="tester", password="pw")
+
+    def search(self, q: str) -> list[dict]:
+        response = self.client.get(reverse("core:creation_search"), {"q": q})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_login_required(self) -> None:
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("core:creation_search"), {"q": "a"}).status_code, 302)
+
+    def test_prefix_and_description_matches_ranked(self) -> None:
+        fireball = Spell.objects.create(name="Fireball", description="A bright streak of flame.")
+        scroll = Item.objects.create(name="Scroll Case", description="Holds a fireball scroll.")
+        Language.objects.create(name="Elvish")
+        results = self.search("fire")
+        self.assertEqual(
+            results,
+            [
+                {"model": "spell", "id": fireball.pk, "name": "Fireball"},
+                {"model": "item", "id": scroll.pk, "name": "Scroll Case"},
+            ],
+        )
+
+    def test_per_model_quota(self) -> None:
+        for i in range(8):
+            Feat.objects.create(name=f"Shield Master {i}", description="desc")
+        Skill.objects.create(name="Shield Bash", ability="str")
+        results = self.search("shield")
+        self.assertEqual(sum(r["model"] == "feat" for r in results), 5)
+        self.assertEqual(sum(r["model"] == "skill" for r in results), 1)
+
+    def test_index_follows_updates_and_deletes(self) -> None:
+        lang = Language.objects.create(name="Draconic")
+        self.assertEqual(len(self.search("drac")), 1)
+        lang.name = "Sylvan"
+        lang.save()
+        self.assertEqual(self.search("drac"), [])
+        self.assertEqual(self.search("sylv")[0]["id"], lang.pk)
+        lang.delete()
+        self.assertEqual(self.search("sylv"), [])
+
+    def test_rebuild_command(self) -> None:
+        Item.objects.bulk_create([Item(name="Rope"), Item(name="Ropeladder")])
+        self.assertEqual(self.search("rope"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.search("rope")), 2)
+
+    def test_punctuation_only_query(self) -> None:
+        self.assertEqual(self.search('"*()'), [])
+
+    def test_fixture_loads_skip_indexing(self) -> None:
+        before = catalog_versions()
+        now = timezone.now()
+        fixture = serializers.serialize("json", [Language(pk=900, name="Abyssal", created=now, updated=now)])
+        for obj in serializers.deserialize("json", fixture):
+            obj.save()
+        self.assertEqual(catalog_versions(), before)
+        self.assertEqual(self.search("abys"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.search("abys")), 1)
+
+    def test_missing_fts_table_is_not_remembered(self) -> None:
+        with mock.patch.dict(search_module._available, clear=True):
+            with mock.patch.object(connection.introspection, "table_names", return_value=[]):
+                self.assertFalse(search_module.fts_available())
+            self.assertTrue(search_module.fts_available())
+
+
+@override_settings(SEARCH_TYPEAHEAD_INDEX=True, SEARCH_TYPEAHEAD_RECHECK_SECONDS=0)
+class TypeaheadIndexTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        typeahead_index.clear()
+        self.addCleanup(typeahead_index.clear)
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tester", password="pw")
+        self.client.login(username="tester", password="pw")
+        self.fireball = Spell.objects.create(name="Fireball", level=3)
+        Spell.objects.create(name="Fire Bolt")
+        Item.objects.create(name="Rope")
+
+    def search(self, q: str) -> list[dict]:
+        return self.client.get(reverse("core:creation_search"), {"q": q}).json()["results"]
+
+    def test_prefix_and_typo_tolerance(self) -> None:
+        self.assertEqual(self.search("fireb")[0], {"model": "spell", "id": self.fireball.pk, "name": "Fireball"})
+        self.assertEqual(self.search("firbal")[0]["name"], "Fireball")
+        self.assertEqual(self.search("zzz"), [])
+
+    def test_incremental_updates_on_commit(self) -> None:
+        self.search("rope")  # build lazily
+        with override_settings(SEARCH_TYPEAHEAD_RECHECK_SECONDS=3600):
+            with self.captureOnCommitCallbacks(execute=True):
+                Language.objects.create(name="Sylvan")
+            self.assertEqual([r["name"] for r in self.search("sylv")], ["Sylvan"])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.fireball.delete()
+            self.assertNotIn("Fireball", [r["name"] for r in self.search("fire")])
+
+    def test_detects_writes_from_other_processes(self) -> None:
+        self.assertEqual(self.search("tent"), [])
+        Item.objects.bulk_create([Item(name="Tent")])  # no signals, as if written elsewhere
+        self.assertEqual(self.search("tent"), [])
+        bump_catalog_version("item")
+        self.assertEqual([r["name"] for r in self.search("tent")], ["Tent"])
+
+    def test_reload_does_not_block_searches(self) -> None:
+        self.search("rope")
+        Item.objects.bulk_create([Item(name="Ropeladder")])
+        bump_catalog_version("item")
+        seen = []
+        load = TypeaheadShard.load
+
+        def slow_load(model_name):
+            # Search from another thread while this one is mid-reload.
+            other = threading.Thread(target=lambda: seen.append(typeahead_index.search("rope")))
+            other.start()
+            other.join(5)
+            return load(model_name)
+
+        with mock.patch.object(TypeaheadShard, "load", side_effect=slow_load):
+            after = typeahead_index.search("rope")
+        self.assertEqual([[r["name"] for r in results] for results in seen], [["Rope"]])
+        self.assertEqual([r["name"] for r in after], ["Rope", "Ropeladder"])
+
+    def test_memory_budget_falls_back_to_fts(self) -> None:
+        with override_settings(SEARCH_TYPEAHEAD_MAX_ENTRIES=2):
+            self.assertIsNone(typeahead_index.search("fire"))
+            self.assertEqual(len(self.search("fire")), 2)
+        stats = typeahead_index.stats()
+        self.assertTrue(stats["overflow"])
+        self.assertEqual(stats["entries"], 0)
+        typeahead_index.clear()
+        typeahead_index.search("fire")
+        self.assertEqual(typeahead_index.stats()["entries"], 3)
+        self.assertGreater(typeahead_index.stats()["approx_bytes"], 0)
+
+
+class SearchResponseCacheTests(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username="tester", password="pw", is_staff=True)
+        self.client.login(username="tester", password="pw")
+        Spell.objects.create(name="Fireball")
+
+    def get(self, q: str, **headers):
+        return self.client.get(reverse("core:creation_search"), {"q": q}, headers=headers)
+
+    def stats(self) -> dict:
+        return self.client.get(reverse("core:creation_search_stats")).json()
+
+    def test_hits_are_keyed_by_normalized_query(self) -> None:
+        first = self.get("fire")
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        second = self.get("  FIRE ")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(self.stats(), {"hits": 1, "misses": 1, "not_modified": 0})
+
+    def test_revalidation_returns_304(self) -> None:
+        etag = self.get("fire")["ETag"]
+        response = self.get("fire", if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.stats()["not_modified"], 1)
+
+    def test_catalog_write_invalidates(self) -> None:
+        first = self.get("fire")
+        Item.objects.create(name="Fire Opal")
+        second = self.get("fire", if_none_match=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertEqual(len(second.json()["results"]), 2)
+        self.assertEqual(self.stats()["misses"], 2)
+
+    def test_stats_are_staff_only(self) -> None:
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("core:creation_search_stats")).status_code, 403)
+
+
+class _ThemeUpstream:
+    """Local stand-in for a theme host: serves ``files``, counts requests, optional per-path latency."""
+
+    def __init__(self, files: dict[str, bytes], latency: dict[str, float] | None = None) -> None:
+        self.files = files
+        self.latency = latency or {}
+        self.fail: set[str] = set()
+        self.requests: list[str] = []
+        self.statuses: list[int] = []
+        self.conditional: list[str] = []
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                path = self.path.lstrip("/")
+                upstream.requests.append(path)
+                time.sleep(upstream.latency.get(path, 0))
+                body = upstream.files.get(path)
+                if path in upstream.fail or body is None:
+                    self.reply(500 if path in upstream.fail else 404)
+                    return
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:12]
+                if self.headers.get("If-None-Match"):
+                    upstream.conditional.append(path)
+                if self.headers.get("If-None-Match") == etag:
+                    self.reply(304, etag=etag)
+                    return
+                self.reply(200, body, etag)
+
+            def reply(self, status: int, body: bytes = b"", etag: str = "") -> None:
+                upstream.statuses.append(status)
+                self.send_response(status)
+                if etag:
+                    self.send_header("ETag", etag)
+                if status != 304:
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        # Clients hanging up mid-response is expected in some tests; keep the output quiet.
+        self.server.handle_error = lambda request, client_address: None  # type: ignore[method-assign]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self) -> "_ThemeUpstream":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        # Drop pooled keep-alive connections so a later server on a reused port starts clean.
+        theme_http.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DiceThemeTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=Path(self.media), DICE_THEME_JOB_RUNNER="external")
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        # Proxied textures queue variant generation; let it finish inside this MEDIA_ROOT.
+        self.addCleanup(self.wait_for_variants)
+
+    def wait_for_variants(self) -> None:
+        worker = theme_images._worker
+        if worker is not None:
+            worker.join(10)
+
+    def cache_file(self, base_url: str, rel: str, body: bytes) -> Path:
+        return blob_path(theme_index.store(encode_base(base_url), rel, body))
+
+    def cached_body(self, base_url: str, rel: str) -> bytes | None:
+        digest = theme_index.resolve(encode_base(base_url), rel)
+        return blob_path(digest).read_bytes() if digest else None
+
+
+class DiceThemeProxyStreamingTests(DiceThemeTestCase):
+    base = "https://example.com/themes/red"
+
+    def proxy_url(self, base: str, rel: str) -> str:
+        return reverse("core:dice_theme_proxy", args=[encode_base(base), rel])
+
+    def test_cached_asset_streams_with_validators(self) -> None:
+        body = bytes(range(256)) * 1024
+        self.cache_file(self.base, "diffuse.png", body)
+        response = self.client.get(self.proxy_url(self.base, "diffuse.png"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Content-Length"], str(len(body)))
+        self.assertEqual(b"".join(response.streaming_content), body)
+
+        repeat = self.client.get(self.proxy_url(self.base, "diffuse.png"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(repeat.status_code, 304)
+        dated = self.client.get(self.proxy_url(self.base, "diffuse.png"), HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(dated.status_code, 304)
+
+    def test_range_requests(self) -> None:
+        body = b"0123456789"
+        self.cache_file(self.base, "mesh.json", body)
+        url = self.proxy_url(self.base, "mesh.json")
+
+        partial = self.client.get(url, HTTP_RANGE="bytes=2-5")
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(b"".join(partial.streaming_content), b"2345")
+
+        suffix = self.client.get(url, HTTP_RANGE="bytes=-3")
+        self.assertEqual(b"".join(suffix.streaming_content), b"789")
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE="bytes=50-").status_code, 416)
+        stale = self.client.get(url, HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"other"')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(b"".join(stale.streaming_content), body)
+
+    def test_github_tree_url_shares_cache_with_raw_url(self) -> None:
+        tree = "https://github.com/u/r/tree/main/themes/red"
+        self.cache_file("https://raw.githubusercontent.com/u/r/main/themes/red", "theme.config.json", b"{}")
+        response = self.client.get(self.proxy_url(tree, "theme.config.json"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"{}")
+
+    def test_upstream_miss_is_written_through(self) -> None:
+        body = b"x" * 200_000
+        with _ThemeUpstream({"big.png": body}) as upstream:
+            response = self.client.get(self.proxy_url(upstream.url, "big.png"))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(b"".join(response.streaming_content), body)
+            again = self.client.get(self.proxy_url(upstream.url, "big.png"), HTTP_RANGE="bytes=0-9")
+            self.assertEqual(b"".join(again.streaming_content), body[:10])
+            self.assertEqual(upstream.requests, ["big.png"])
+            self.assertEqual(self.client.get(self.proxy_url(upstream.url, "missing.png")).status_code, 404)
+        self.assertEqual(self.cached_body(upstream.url, "big.png"), body)
+        self.assertEqual(list(theme_index.manifest(encode_base(upstream.url))), ["big.png"])
+
+    def test_parallel_misses_make_one_upstream_fetch(self) -> None:
+        body = b"t" * 50_000
+        with _ThemeUpstream({"tex.png": body}, {"tex.png": 0.3}) as upstream:
+            url = self.proxy_url(upstream.url, "tex.png")
+            bodies: list[bytes] = []
+
+            def fetch() -> None:
+                response = Client().get(url)
+                bodies.append(b"".join(response.streaming_content))
+
+            threads = [threading.Thread(target=fetch) for _ in range(12)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(upstream.requests, ["tex.png"])
+        self.assertEqual(bodies, [body] * 12)
+
+    def test_miss_waits_on_lock_file_held_by_another_process(self) -> None:
+        import fcntl
+        import hashlib
+        import os
+
+        with _ThemeUpstream({"tex.png": b"upstream"}) as upstream:
+            key = encode_base(upstream.url)
+            lock_dir = theme_dir(key).parent / ".locks"
+            lock_dir.mkdir(parents=True, exist_ok=True)
+            lock_path = lock_dir / (hashlib.sha1(f"{key}/tex.png".encode()).hexdigest() + ".lock")
+            # A separate open file description conflicts like another process would.
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            result: list[bytes] = []
+            waiter = threading.Thread(
+                target=lambda: result.append(b"".join(Client().get(self.proxy_url(upstream.url, "tex.png")).streaming_content))
+            )
+            waiter.start()
+            time.sleep(0.3)
+            self.assertEqual(result, [])
+            self.cache_file(upstream.url, "tex.png", b"from other process")
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            waiter.join()
+        self.assertEqual(result, [b"from other process"])
+        self.assertEqual(upstream.requests, [])
+
+class DiceThemeLoadTests(DiceThemeTestCase):
+    config = {
+        "diceAvailable": ["d20"],
+        "meshFile": "mesh.json",
+        "material": {"type": "standard", "diffuseTexture": {"light": "light.png", "dark": "dark.png"}, "bumpTexture": "bump.png"},
+    }
+
+    def setUp(self) -> None:
+        super().setUp()
+        User = get_user_model()
+        User.objects.create_user(username="tester", password="pw")
+        self.client.login(username="tester", password="pw")
+
+    files = {
+        "theme.config.json": json.dumps(config).encode(),
+        "mesh.json": b"{}",
+        "light.png": b"L" * 1000,
+        "dark.png": b"D" * 1000,
+    }
+
+    def load(self, url: str) -> dict:
+        response = self.client.post(reverse("core:dice_theme_load"), json.dumps({"url": url}), content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def job_status(self, job_id: int) -> dict:
+        return self.client.get(reverse("core:dice_theme_job", args=[job_id])).json()
+
+    def test_load_queues_one_job_and_reports_progress_per_asset(self) -> None:
+        delay = 0.4
+        latency = {"mesh.json": delay, "light.png": delay, "dark.png": delay, "bump.png": delay}
+        with _ThemeUpstream(self.files, latency) as upstream:
+            queued = self.load(upstream.url)
+            self.assertEqual(upstream.requests, [])
+            self.assertTrue(queued["created"])
+            duplicate = self.load(upstream.url)
+            self.assertEqual((duplicate["job_id"], duplicate["created"]), (queued["job_id"], False))
+            self.assertEqual(self.job_status(queued["job_id"])["progress"], {"done": 0, "total": 1})
+
+            start = time.perf_counter()
+            self.assertEqual(theme_jobs.run_pending(), 1)
+            # Four slow assets: sequential would take ~1.6s, concurrent close to one delay.
+            self.assertLess(time.perf_counter() - start, delay * 2.5)
+        data = self.job_status(queued["job_id"])
+        self.assertEqual(data["status"], "partial")
+        self.assertEqual(data["attempts"], 1)
+        self.assertEqual(data["progress"], {"done": 5, "total": 5})
+        self.assertEqual(data["assets"]["bump.png"]["status"], 404)
+        self.assertEqual(data["assets"]["dark.png"]["bytes"], 1000)
+        self.assertGreaterEqual(data["assets"]["light.png"]["ms"], delay * 1000)
+        self.assertEqual(self.cached_body(upstream.url, "light.png"), self.files["light.png"])
+        self.assertIsNone(self.cached_body(upstream.url, "bump.png"))
+        # The finished job no longer absorbs new loads.
+        self.assertTrue(self.load(upstream.url)["created"])
+
+    def test_transient_failures_retry_with_backoff(self) -> None:
+        self.assertEqual([theme_jobs.backoff(n) for n in (1, 2, 3)], [5, 10, 20])
+        with override_settings(DICE_THEME_JOB_MAX_RETRY_DELAY=8):
+            self.assertEqual(theme_jobs.backoff(3), 8)
+        files = dict(self.files, **{"bump.png": b"B" * 10})
+        with _ThemeUpstream(files) as upstream:
+            upstream.fail.add("light.png")
+            job_id = self.load(upstream.url)["job_id"]
+            theme_jobs.run_pending()
+            data = self.job_status(job_id)
+            self.assertEqual((data["status"], data["attempts"]), ("queued", 1))
+            self.assertIn("light.png", data["error"])
+            self.assertIn("retry_at", data)
+            self.assertEqual(theme_jobs.run_pending(), 0)  # not due yet
+
+            upstream.fail.clear()
+            ThemeJob.objects.filter(pk=job_id).update(run_after=timezone.now())
+            self.assertEqual(theme_jobs.run_pending(), 1)
+        data = self.job_status(job_id)
+        self.assertEqual((data["status"], data["attempts"], data["error"]), ("succeeded", 2, ""))
+        # Only the failed asset was fetched again.
+        self.assertEqual(sum(1 for path in upstream.requests if path.endswith("dark.png")), 1)
+        self.assertEqual(sum(1 for path in upstream.requests if path.endswith("light.png")), 2)
+
+    def test_missing_config_fails_without_retry(self) -> None:
+        with _ThemeUpstream({}) as upstream:
+            job_id = self.load(upstream.url)["job_id"]
+            theme_jobs.run_pending()
+        data = self.job_status(job_id)
+        self.assertEqual((data["status"], data["attempts"], data["ok"]), ("failed", 1, False))
+        self.assertIn("theme.config.json", data["error"])
+        self.assertEqual(self.client.get(reverse("core:dice_theme_job", args=[job_id + 1])).status_code, 404)
+
+    def test_stalled_running_job_is_taken_over(self) -> None:
+        job, _created = theme_jobs.enqueue("https://example.com/stalled")
+        ThemeJob.objects.filter(pk=job.pk).update(status=ThemeJob.RUNNING, updated=timezone.now() - timedelta(hours=1))
+        self.assertEqual(theme_jobs.claim().pk, job.pk)
+        self.assertIsNone(theme_jobs.claim())
+
+
+class DiceThemeCacheQuotaTests(DiceThemeTestCase):
+    base = "https://example.com/themes/blue"
+
+    def proxy_url(self, rel: str) -> str:
+        return reverse("core:dice_theme_proxy", args=[encode_base(self.base), rel])
+
+    def cache_tracked(self, rel: str, body: bytes) -> Path:
+        return self.cache_file(self.base, rel, body)
+
+    @override_settings(DICE_THEME_CACHE_MAX_FILES=2, DICE_THEME_CACHE_MAX_BYTES=None)
+    def test_least_recently_read_file_is_evicted(self) -> None:
+        a = self.cache_tracked("a.png", b"a")
+        b = self.cache_tracked("b.png", b"b")
+        with mock.patch.object(theme_index, "TOUCH_INTERVAL", 0):
+            self.client.get(self.proxy_url("a.png")).close()
+        c = self.cache_tracked("c.png", b"c")
+        self.assertTrue(a.exists())
+        self.assertFalse(b.exists())
+        self.assertTrue(c.exists())
+
+    @override_settings(DICE_THEME_CACHE_MAX_BYTES=100, DICE_THEME_CACHE_MAX_FILES=None)
+    def test_byte_quota_keeps_newest_file(self) -> None:
+        old = self.cache_tracked("old.json", b"x" * 60)
+        new = self.cache_tracked("new.json", b"y" * 150)
+        self.assertFalse(old.exists())
+        self.assertTrue(new.exists())
+
+    def test_eviction_does_not_break_inflight_response(self) -> None:
+        body = b"z" * 300_000
+        digest = self.cache_tracked("big.png", body).name
+        response = self.client.get(self.proxy_url("big.png"))
+        chunks = iter(response.streaming_content)
+        first = next(chunks)
+        self.assertEqual(theme_index.enforce_quota(max_files=0), [digest])
+        self.assertEqual(first + b"".join(chunks), body)
+
+    def test_command_report_verify_and_prune(self) -> None:
+        self.cache_tracked("mesh.json", b"{}")
+        stray = blob_path("0" * 64)
+        stray.parent.mkdir(parents=True, exist_ok=True)
+        stray.write_bytes(b"not what the name says")
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("dice_theme_cache", "verify", stdout=out)
+        self.assertIn("corrupt: " + "0" * 64, out.getvalue())
+        call_command("dice_theme_cache", "verify", "--fix", stdout=StringIO())
+        self.assertFalse(stray.exists())
+        call_command("dice_theme_cache", "verify", stdout=StringIO())
+
+        out = StringIO()
+        call_command("dice_theme_cache", "report", stdout=out)
+        self.assertIn(f"{self.base}: 1 file(s)", out.getvalue())
+
+        call_command("dice_theme_cache", "prune", "--max-age-days", "0", stdout=StringIO())
+        self.assertEqual(theme_index.usage(), [])
+
+    def test_prune_removes_stale_lock_files(self) -> None:
+        import os
+
+        for name in ("stale", "fresh"):
+            with single_flight(name):
+                pass
+        stale, fresh = (
+            cache_root() / ".locks" / (hashlib.sha1(name.encode()).hexdigest() + ".lock")
+            for name in ("stale", "fresh")
+        )
+        old = time.time() - 7200
+        os.utime(stale, (old, old))
+        self.assertEqual(theme_index.prune()["lock_files"], 1)
+        self.assertFalse(stale.exists())
+        self.assertTrue(fresh.exists())
+        # The next flight on the name locks a new file.
+        with single_flight("stale"):
+            self.assertTrue(stale.exists())
+
+
+class DiceThemeDedupTests(DiceThemeTestCase):
+    def test_shared_assets_are_stored_once(self) -> None:
+        mesh = b'{"dice": "shared mesh"}' * 100
+        first = self.cache_file("https://example.com/a", "default.json", mesh)
+        second = self.cache_file("https://example.com/b", "default.json", mesh)
+        self.cache_file("https://example.com/b", "tex.png", b"own texture")
+        self.assertEqual(first, second)
+        stats = theme_index.dedup_stats()
+        self.assertEqual((stats.files, stats.blobs), (3, 2))
+        self.assertEqual(stats.stored_bytes, len(mesh) + len(b"own texture"))
+        self.assertGreater(stats.ratio, 1.9)
+
+        response = self.client.get(reverse("core:dice_theme_proxy", args=[encode_base("https://example.com/b"), "default.json"]))
+        self.assertEqual(response["ETag"], '"%s"' % first.name[:32])
+        other = self.client.get(reverse("core:dice_theme_proxy", args=[encode_base("https://example.com/a"), "default.json"]))
+        self.assertEqual(other["ETag"], response["ETag"])
+        b"".join(response.streaming_content)
+        b"".join(other.streaming_content)
+
+    def test_legacy_folders_migrate_in_place(self) -> None:
+        for base in ("https://example.com/a", "https://example.com/b"):
+            folder = theme_dir(encode_base(base))
+            (folder / "textures").mkdir(parents=True)
+            (folder / "default.json").write_bytes(b"same mesh")
+            (folder / "textures" / "d.png").write_bytes(base.encode())
+        out = StringIO()
+        call_command("dice_theme_cache", "migrate", stdout=out)
+        self.assertIn("4 file(s)", out.getvalue())
+        self.assertIn("3 new blob(s), 1 duplicate(s)", out.getvalue())
+        self.assertFalse(theme_dir(encode_base("https://example.com/a")).exists())
+        self.assertEqual(self.cached_body("https://example.com/b", "textures/d.png"), b"https://example.com/b")
+        self.assertEqual(self.cached_body("https://example.com/a", "default.json"), b"same mesh")
+        call_command("dice_theme_cache", "verify", stdout=StringIO())
+
+    def test_index_connection_is_set_up_once_and_reused(self) -> None:
+        with mock.patch.object(theme_index, "_setup", wraps=theme_index._setup) as setup:
+            self.cache_file("https://example.com/a", "default.json", b"mesh")
+            self.assertEqual(theme_index.resolve(encode_base("https://example.com/a"), "tex.png"), None)
+            self.assertIs(theme_index._connect(), theme_index._connect())
+            self.assertEqual(setup.call_count, 1)
+            # A wiped cache gets a fresh index with the schema set up again.
+            shutil.rmtree(Path(self.media) / "dice_theme_cache")
+            self.assertEqual(theme_index.manifest(encode_base("https://example.com/a")), {})
+            self.assertEqual(setup.call_count, 2)
+
+
+class DiceThemeCompressionTests(DiceThemeTestCase):
+    base = "https://example.com/theme"
+
+    def get(self, rel: str, **headers):
+        response = self.client.get(reverse("core:dice_theme_proxy", args=[encode_base(self.base), rel]), headers=headers)
+        body = b"".join(response.streaming_content) if response.streaming else b""
+        return response, body
+
+    def test_precompressed_variant_matches_accept_encoding(self) -> None:
+        mesh = json.dumps({"vertices": [[i, i * 2, i * 3] for i in range(200)]}).encode()
+        path = self.cache_file(self.base, "default.json", mesh)
+        self.assertTrue(path.with_name(path.name + ".gz").is_file())
+
+        response, body = self.get("default.json", accept_encoding="br;q=0, gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(body), mesh)
+        self.assertLess(len(body), len(mesh))
+        self.assertTrue(response["ETag"].endswith('-gzip"'))
+
+        again, _ = self.get("default.json", accept_encoding="gzip", if_none_match=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertIn("Accept-Encoding", again["Vary"])
+
+        raw, body = self.get("default.json")
+        self.assertFalse(raw.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", raw["Vary"])
+        self.assertEqual(body, mesh)
+        self.assertNotEqual(raw["ETag"], response["ETag"])
+
+        out = StringIO()
+        call_command("dice_theme_cache", "report", stdout=out)
+        self.assertIn("saved by compression", out.getvalue())
+        saved = theme_index.usage()[0].compressed_savings
+        self.assertEqual(saved, len(mesh) - path.with_name(path.name + ".gz").stat().st_size)
+
+    def test_small_and_binary_assets_are_served_raw(self) -> None:
+        tiny = self.cache_file(self.base, "tiny.json", b"{}")
+        texture = self.cache_file(self.base, "tex.png", b"\x89PNG" + b"\0" * 4096)
+        self.assertEqual(list(tiny.parent.glob(tiny.name + ".*")), [])
+        self.assertEqual(list(texture.parent.glob(texture.name + ".*")), [])
+        response, body = self.get("tex.png", accept_encoding="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertNotIn("Accept-Encoding", response.get("Vary", ""))
+        self.assertEqual(len(body), 4100)
+
+    def test_eviction_removes_variants(self) -> None:
+        path = self.cache_file(self.base, "default.json", b"[" + b"1," * 1000 + b"1]")
+        variant = path.with_name(path.name + ".gz")
+        self.assertTrue(variant.is_file())
+        theme_index.enforce_quota(max_bytes=1)
+        self.assertFalse(path.exists())
+        self.assertFalse(variant.exists())
+
+
+@skipUnless(theme_images.Image, "Pillow is not installed")
+class DiceThemeTextureTests(DiceThemeTestCase):
+    base = "https://example.com/theme"
+
+    def png(self, width: int, height: int) -> bytes:
+        Image = theme_images.Image
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 24)
+        image = Image.merge("RGB", [gradient, noise, gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM)])
+        out = BytesIO()
+        image.save(out, "PNG")
+        return out.getvalue()
+
+    def get(self, rel: str, query: str = "", **headers):
+        url = reverse("core:dice_theme_proxy", args=[encode_base(self.base), rel]) + query
+        response = self.client.get(url, headers=headers)
+        body = b"".join(response.streaming_content) if response.streaming else b""
+        return response, body
+
+    def width_of(self, body: bytes) -> int:
+        with theme_images.Image.open(BytesIO(body)) as image:
+            return image.width
+
+    def test_variants_are_generated_off_the_request(self) -> None:
+        source = self.png(1200, 600)
+        self.cache_file(self.base, "d.png", source)
+        threads = []
+        generate = theme_images.generate
+
+        def record(*args):
+            threads.append(threading.current_thread().name)
+            return generate(*args)
+
+        with mock.patch.object(theme_images, "generate", side_effect=record):
+            response, body = self.get("d.png", "?w=512")
+            self.assertEqual(body, source)  # the original until the variants exist
+            self.get("d.png", "?w=512")
+            self.wait_for_variants()
+        self.assertEqual(threads, ["dice-theme-textures"])
+        response, body = self.get("d.png", "?w=512")
+        self.assertEqual(self.width_of(body), 512)
+
+    def test_variants_are_selected_by_query_and_hints(self) -> None:
+        source = self.png(1200, 600)
+        path = self.cache_file(self.base, "d.png", source)
+        self.get("d.png")
+        self.wait_for_variants()
+
+        response, body = self.get("d.png", "?w=512")
+        self.assertEqual((response["Content-Type"], self.width_of(body)), ("image/png", 512))
+        self.assertIn("Save-Data", response["Vary"])
+        small_webp, body = self.get("d.png", "?w=512&format=webp")
+        self.assertEqual((small_webp["Content-Type"], self.width_of(body)), ("image/webp", 512))
+        self.assertNotEqual(small_webp["ETag"], response["ETag"])
+
+        response, body = self.get("d.png", sec_ch_width="900")
+        self.assertEqual(self.width_of(body), 1024)
+        response, body = self.get("d.png", save_data="on", accept="image/webp,*/*")
+        self.assertEqual((response["Content-Type"], self.width_of(body)), ("image/webp", 512))
+        response, body = self.get("d.png", accept="image/webp,*/*")
+        self.assertEqual((response["Content-Type"], self.width_of(body)), ("image/webp", 1200))
+        response, body = self.get("d.png", "?w=4000")
+        self.assertEqual(body, source)
+        self.assertEqual(self.get("d.png")[1], source)
+
+        variants = sorted(p.name[len(path.name) + 1:] for p in path.parent.glob(path.name + ".*"))
+        self.assertEqual(variants, ["1024.png", "1024.webp", "512.png", "512.webp", "webp"])
+        self.assertEqual(
+            theme_index.image_size(path.name),
+            sum(p.stat().st_size for p in path.parent.glob(path.name + ".*")),
+        )
+        theme_index.enforce_quota(max_bytes=1)
+        self.assertEqual(list(path.parent.glob(path.name + "*")), [])
+
+    def test_small_textures_fall_back_to_the_original(self) -> None:
+        source = self.png(300, 300)
+        path = self.cache_file(self.base, "small.png", source)
+        self.get("small.png")
+        self.wait_for_variants()
+        response, body = self.get("small.png", "?w=512&format=png")
+        self.assertEqual(body, source)
+        self.assertEqual(response["ETag"], '"%s"' % path.name[:32])
+        self.assertFalse(path.with_name(path.name + ".512.png").exists())
+
+
+class DiceThemeRevalidationTests(DiceThemeTestCase):
+    def proxy_get(self, base: str, rel: str):
+        response = self.client.get(reverse("core:dice_theme_proxy", args=[encode_base(base), rel]))
+        body = b"".join(response.streaming_content) if response.streaming else b""
+        return response.status_code, body
+
+    def test_stale_entries_revalidate_with_stored_validators(self) -> None:
+        with _ThemeUpstream({"mesh.json": b"v1"}) as upstream:
+            self.assertEqual(self.proxy_get(upstream.url, "mesh.json"), (200, b"v1"))
+            with override_settings(DICE_THEME_CACHE_FRESH_SECONDS=0):
+                self.assertEqual(self.proxy_get(upstream.url, "mesh.json"), (200, b"v1"))
+                self.assertEqual(upstream.statuses, [200, 304])
+                self.assertEqual(upstream.conditional, ["mesh.json"])
+                upstream.files["mesh.json"] = b"v2"
+                self.assertEqual(self.proxy_get(upstream.url, "mesh.json"), (200, b"v2"))
+                self.assertEqual(upstream.statuses, [200, 304, 200])
+            # Freshly revalidated: served without asking upstream.
+            self.assertEqual(self.proxy_get(upstream.url, "mesh.json"), (200, b"v2"))
+            self.assertEqual(len(upstream.requests), 3)
+
+    def test_missing_assets_are_negative_cached(self) -> None:
+        with _ThemeUpstream({}) as upstream:
+            with override_settings(DICE_THEME_NEGATIVE_TTL=0):
+                self.assertEqual(self.proxy_get(upstream.url, "gone.png")[0], 404)
+                self.assertEqual(self.proxy_get(upstream.url, "gone.png")[0], 404)
+            self.assertEqual(len(upstream.requests), 2)
+            self.assertEqual(self.proxy_get(upstream.url, "gone.png")[0], 404)
+            self.assertEqual(self.proxy_get(upstream.url, "gone.png")[0], 404)
+            self.assertEqual(len(upstream.requests), 3)
+
+    def test_upstream_failure_serves_stale_copy(self) -> None:
+        with _ThemeUpstream({"tex.png": b"cached"}) as upstream:
+            self.assertEqual(self.proxy_get(upstream.url, "tex.png"), (200, b"cached"))
+            upstream.fail.add("tex.png")
+            with override_settings(DICE_THEME_CACHE_FRESH_SECONDS=0):
+                self.assertEqual(self.proxy_get(upstream.url, "tex.png"), (200, b"cached"))
+                self.assertEqual(self.proxy_get(upstream.url, "tex.png"), (200, b"cached"))
+            self.assertEqual(upstream.statuses, [200, 500])
+            self.assertEqual(self.proxy_get(upstream.url, "missing.png")[0], 404)
+
+
+class ThemeConnectionPoolTests(DiceThemeTestCase):
+    def test_sequential_fetches_reuse_one_connection(self) -> None:
+        pool = theme_http.ConnectionPool(size=2)
+        with _ThemeUpstream({f"t{i}.png": b"x" * 100 for i in range(5)}) as upstream:
+            for i in range(5):
+                with pool.request("GET", f"{upstream.url}/t{i}.png") as resp:
+                    self.assertEqual(resp.read(), b"x" * 100)
+            with self.assertRaises(theme_http.HTTPStatusError) as ctx:
+                pool.request("GET", f"{upstream.url}/missing.png")
+            self.assertEqual(ctx.exception.code, 404)
+            stats = pool.stats()
+            pool.close()
+        self.assertEqual(stats["requests"], 6)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["reuse_rate"], round(5 / 6, 3))
+
+    def test_unread_response_is_not_reused(self) -> None:
+        pool = theme_http.ConnectionPool()
+        with _ThemeUpstream({"big.png": b"y" * 100_000}) as upstream:
+            pool.request("GET", f"{upstream.url}/big.png").close()
+            with pool.request("GET", f"{upstream.url}/big.png") as resp:
+                self.assertEqual(len(resp.read()), 100_000)
+            stats = pool.stats()
+            pool.close()
+        self.assertEqual(stats["connections_opened"], 2)
+
+    def test_theme_load_uses_shared_pool(self) -> None:
+        User = get_user_model()
+        User.objects.create_user(username="staff", password="pw", is_staff=True)
+        self.client.login(username="staff", password="pw")
+        config = {"diceAvailable": ["d6"], "meshFile": "mesh.json", "material": {"diffuseTexture": "d.png"}}
+        files = {"theme.config.json": json.dumps(config).encode(), "mesh.json": b"{}", "d.png": b"png"}
+        theme_http.pool.close()
+        with _ThemeUpstream(files) as upstream:
+            self.client.post(reverse("core:dice_theme_load"), {"url": upstream.url})
+            theme_jobs.run_pending()
+            host = self.client.get(reverse("core:dice_theme_stats")).json()["http"]["hosts"][upstream.url]
+        self.assertEqual(host["requests"], 3)
+        self.assertLessEqual(host["connections_opened"], 2)
+
+
+class ThemeUpstreamProtectionTests(DiceThemeTestCase):
+    def test_busy_host_fails_fast_past_the_concurrency_limit(self) -> None:
+        pool = theme_http.ConnectionPool(size=2, queue_timeout=0.1)
+        outcomes: list[tuple[str, float]] = []
+        lock = threading.Lock()
+
+        def fetch(url: str) -> None:
+            start = time.perf_counter()
+            try:
+                with pool.request("GET", url) as resp:
+                    resp.read()
+                outcome = "ok"
+            except theme_http.HostBusyError:
+                outcome = "busy"
+            with lock:
+                outcomes.append((outcome, time.perf_counter() - start))
+
+        with _ThemeUpstream({"slow.png": b"s" * 100}, {"slow.png": 0.6}) as upstream:
+            threads = [threading.Thread(target=fetch, args=[f"{upstream.url}/slow.png"]) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            host = pool.stats()["hosts"][upstream.url]
+            pool.close()
+        self.assertEqual(sorted(outcome for outcome, _ in outcomes), ["busy", "busy", "ok", "ok"])
+        self.assertTrue(all(elapsed < 0.4 for outcome, elapsed in outcomes if outcome == "busy"))
+        self.assertEqual(len(upstream.requests), 2)
+        self.assertEqual((host["peak_in_flight"], host["in_flight"], host["busy_rejections"]), (2, 0, 2))
+        self.assertGreaterEqual(host["max_queue_wait_ms"], 90)
+
+    def test_breaker_opens_after_repeated_failures_and_recovers(self) -> None:
+        pool = theme_http.ConnectionPool(breaker_failures=2, breaker_reset=0.3)
+        with _ThemeUpstream({"d.png": b"d", "slow.png": b"s"}, {"slow.png": 0.5}) as upstream:
+            url = f"{upstream.url}/d.png"
+            breaker = lambda: pool.stats()["hosts"][upstream.url]["breaker"]
+            upstream.fail.add("d.png")
+            for _ in range(2):
+                with self.assertRaises(theme_http.HTTPStatusError):
+                    pool.request("GET", url)
+            with self.assertRaises(theme_http.CircuitOpenError):
+                pool.request("GET", url)
+            self.assertEqual(len(upstream.requests), 2)
+            self.assertEqual((breaker()["state"], breaker()["rejected"]), ("open", 1))
+
+            # After the reset timeout one trial goes out; failing it re-opens the breaker.
+            time.sleep(0.35)
+            self.assertEqual(breaker()["state"], "half_open")
+            with self.assertRaises(theme_http.HTTPStatusError):
+                pool.request("GET", url)
+            self.assertEqual((breaker()["state"], breaker()["times_opened"]), ("open", 2))
+            time.sleep(0.35)
+            upstream.fail.clear()
+            with pool.request("GET", url) as resp:
+                self.assertEqual(resp.read(), b"d")
+            self.assertEqual(breaker()["state"], "closed")
+
+            # Timeouts against a slow upstream count as failures too.
+            for _ in range(2):
+                with self.assertRaises(TimeoutError):
+                    pool.request("GET", f"{upstream.url}/slow.png", timeout=0.1)
+            self.assertEqual(breaker()["state"], "open")
+            pool.close()
+
+    @override_settings(DICE_THEME_BREAKER_FAILURES=1, DICE_THEME_BREAKER_RESET_SECONDS=60, DICE_THEME_CACHE_FRESH_SECONDS=0)
+    def test_proxy_serves_stale_or_fast_503_while_breaker_is_open(self) -> None:
+        User = get_user_model()
+        User.objects.create_user(username="staff", password="pw", is_staff=True)
+        self.client.login(username="staff", password="pw")
+        proxy = lambda base, rel: self.client.get(reverse("core:dice_theme_proxy", args=[encode_base(base), rel]))
+        with _ThemeUpstream({"tex.png": b"cached", "new.png": b"new"}) as upstream:
+            self.assertEqual(b"".join(proxy(upstream.url, "tex.png").streaming_content), b"cached")
+            upstream.fail.add("tex.png")
+            stale = proxy(upstream.url, "tex.png")
+            self.assertEqual(b"".join(stale.streaming_content), b"cached")
+
+            start = time.perf_counter()
+            shed = proxy(upstream.url, "new.png")
+            self.assertLess(time.perf_counter() - start, 0.5)
+            self.assertEqual(shed.status_code, 503)
+            self.assertGreaterEqual(int(shed["Retry-After"]), 1)
+            self.assertNotIn("new.png", upstream.requests)
+            # Shedding is not negative-cached, and the stale copy keeps being served.
+            self.assertIsNone(theme_fetch.recent_failure(f"{upstream.url}/new.png"))
+            self.assertEqual(b"".join(proxy(upstream.url, "tex.png").streaming_content), b"cached")
+
+            stats = self.client.get(reverse("core:dice_theme_stats")).json()["http"]
+            self.assertEqual(stats["open_circuits"], [upstream.url])
+            self.assertEqual(stats["hosts"][upstream.url]["breaker"]["state"], "open")
+            self.assertEqual(stats["in_flight"], 0)
+
+
+async def _body(response) -> bytes:
+    return b"".join([chunk async for chunk in response.streaming_content])
+
+
+class DiceThemeAsyncTests(DiceThemeTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.user = get_user_model().objects.create_user(username="async", password="pw")
+
+    def proxy(self, base: str, rel: str, **headers):
+        request = self.factory.get(reverse("core:dice_theme_proxy", args=[encode_base(base), rel]), headers=headers)
+        return dice_theme_proxy_async(request, base_b64=encode_base(base), res_path=rel)
+
+    def api(self, view, path: str, data: dict):
+        request = self.factory.post(path, data)
+        request.user = self.user
+
+        async def auser():
+            return self.user
+
+        request.auser = auser
+        return view(request)
+
+    async def test_async_pool_reuses_connections(self) -> None:
+        pool = theme_async_http.AsyncConnectionPool(size=2)
+        with _ThemeUpstream({f"t{i}.png": b"x" * 100 for i in range(3)}) as upstream:
+            for i in range(3):
+                async with await pool.request("GET", f"{upstream.url}/t{i}.png") as resp:
+                    self.assertEqual(await resp.read(), b"x" * 100)
+            with self.assertRaises(theme_http.HTTPStatusError) as ctx:
+                await pool.request("GET", f"{upstream.url}/missing.png")
+            host = pool.stats()["hosts"][upstream.url]
+            pool.close()
+        self.assertEqual(ctx.exception.code, 404)
+        self.assertEqual((host["requests"], host["connections_opened"], host["in_flight"]), (4, 1, 0))
+
+    async def test_proxy_miss_is_cached_and_streamed_without_blocking(self) -> None:
+        body = bytes(range(256)) * 512
+        with _ThemeUpstream({"d.png": body}) as upstream:
+            first = await self.proxy(upstream.url, "d.png")
+            self.assertTrue(first.is_async)
+            self.assertEqual(await _body(first), body)
+            repeat = await self.proxy(upstream.url, "d.png", range="bytes=10-19")
+            self.assertEqual(repeat.status_code, 206)
+            self.assertEqual(await _body(repeat), body[10:20])
+            missing = await self.proxy(upstream.url, "missing.png")
+            theme_async_http.pool.close()
+        self.assertEqual(upstream.requests, ["d.png", "missing.png"])
+        self.assertEqual(first["ETag"], repeat["ETag"])
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(await asyncio.to_thread(self.cached_body, upstream.url, "d.png"), body)
+
+    async def test_concurrent_misses_share_one_upstream_fetch(self) -> None:
+        with _ThemeUpstream({"slow.png": b"s" * 1000}, {"slow.png": 0.3}) as upstream:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(self.proxy(upstream.url, "slow.png") for _ in range(5)))
+            elapsed = time.perf_counter() - start
+            bodies = [await _body(response) for response in responses]
+            theme_async_http.pool.close()
+        self.assertEqual(bodies, [b"s" * 1000] * 5)
+        self.assertEqual(upstream.requests, ["slow.png"])
+        self.assertLess(elapsed, 1.0)
+
+    @override_settings(DICE_THEME_BREAKER_FAILURES=1, DICE_THEME_BREAKER_RESET_SECONDS=60)
+    async def test_upstream_failures_match_the_sync_view(self) -> None:
+        theme_http.pool.close()
+        with _ThemeUpstream({"bad.png": b"b", "new.png": b"n"}) as upstream:
+            upstream.fail.add("bad.png")
+            failed = await self.proxy(upstream.url, "bad.png")
+            # The breaker is shared with the sync pool, so the host is now shed without a request.
+            shed = await self.proxy(upstream.url, "new.png")
+            theme_async_http.pool.close()
+        theme_http.pool.close()
+        self.assertEqual(failed.status_code, 502)
+        self.assertEqual(shed.status_code, 503)
+        self.assertGreaterEqual(int(shed["Retry-After"]), 1)
+        self.assertEqual(upstream.requests, ["bad.png"])
+
+    async def test_async_test_and_load_views(self) -> None:
+        config = {"diceAvailable": ["d6"], "meshFile": "mesh.json", "themeColor": "#fff"}
+        with _ThemeUpstream({"theme.config.json": json.dumps(config).encode()}) as upstream:
+            tested = await self.api(dice_theme_test_async, reverse("core:dice_theme_test"), {"url": upstream.url})
+            broken = await self.api(dice_theme_test_async, reverse("core:dice_theme_test"), {"url": upstream.url + "/x"})
+            theme_async_http.pool.close()
+        self.assertEqual(tested.status_code, 200)
+        self.assertEqual(json.loads(tested.content)["assets"], ["theme.config.json", "mesh.json"])
+        self.assertEqual(broken.status_code, 502)
+
+        loads = [await self.api(dice_theme_load_async, reverse("core:dice_theme_load"), {"url": upstream.url}) for _ in range(2)]
+        first, second = (json.loads(response.content) for response in loads)
+        self.assertEqual([response.status_code for response in loads], [202, 202])
+        self.assertEqual((first["created"], second["created"]), (True, False))
+        self.assertEqual(first["job_id"], second["job_id"])
+
+
+class _RawUpstream:
+    """Asyncio server replying to requests with canned raw HTTP responses, in order.
+
+    Each response is ``(bytes, close)``; with ``close`` the connection is shut
+    right after it, which also truncates whatever the bytes left unfinished.
+    """
+
+    def __init__(self, *responses: tuple[bytes, bool]) -> None:
+        self.responses = list(responses)
+        self.connections = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while self.responses:
+                await reader.readuntil(b"\r\n\r\n")
+                raw, close = self.responses.pop(0)
+                writer.write(raw)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __aenter__(self) -> "_RawUpstream":
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class AsyncHTTPFramingTests(DiceThemeTestCase):
+    CHUNKED = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+
+    async def get(self, *responses: tuple[bytes, bool]) -> bytes:
+        pool = theme_async_http.AsyncConnectionPool(size=1)
+        try:
+            async with _RawUpstream(*responses) as upstream:
+                async with await pool.request("GET", f"{upstream.url}/d.png") as resp:
+                    return await resp.read()
+        finally:
+            pool.close()
+
+    async def test_chunked_body(self) -> None:
+        body = await self.get((self.CHUNKED + b"5;ext=1\r\nhello\r\nA\r\n, world!!!\r\n0\r\nX-Trailer: 1\r\n\r\n", False))
+        self.assertEqual(body, b"hello, world!!!")
+
+    async def test_malformed_chunk_sizes_fail(self) -> None:
+        for size in (b"zz", b"-5", b"0x5", b"+5", b"5_0", b""):
+            with self.subTest(size=size), self.assertRaises(ConnectionError):
+                await self.get((self.CHUNKED + size + b"\r\nhello\r\n0\r\n\r\n", False))
+        with self.assertRaises(ConnectionError):
+            await self.get((self.CHUNKED + b"5\r\nhelloXX0\r\n\r\n", False))
+
+    async def test_early_eof_fails_instead_of_truncating(self) -> None:
+        for raw in (
+            self.CHUNKED + b"5\r\nhel",  # mid-chunk
+            self.CHUNKED + b"5\r\nhello\r\n",  # before the next chunk size
+            self.CHUNKED + b"5\r\nhello\r\n0",  # inside the last chunk size line
+            b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nhello",
+        ):
+            with self.subTest(raw=raw), self.assertRaises(ConnectionError):
+                await self.get((raw, True))
+
+    async def test_connection_close_is_honoured(self) -> None:
+        pool = theme_async_http.AsyncConnectionPool(size=1)
+        keep = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+        close = b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\nConnection: close\r\n\r\nbye"
+        until_eof = b"HTTP/1.1 200 OK\r\n\r\nuntil close"
+        async with _RawUpstream((keep, False), (close, True), (until_eof, True), (keep, False)) as upstream:
+            bodies = []
+            for _ in range(4):
+                async with await pool.request("GET", f"{upstream.url}/d.png") as resp:
+                    bodies.append(await resp.read())
+                host = pool.stats()["hosts"][upstream.url]
+                bodies.append(host["idle"])
+            pool.close()
+        self.assertEqual(bodies, [b"ok", 1, b"bye", 0, b"until close", 0, b"ok", 1])
+        self.assertEqual((host["connections_opened"], host["reused"], upstream.connections), (3, 1, 3))
+
+    async def test_blob_file_work_stays_off_the_event_loop(self) -> None:
+        loop_thread = threading.current_thread()
+        threads = []
+        write_blob = theme_fetch.write_blob
+
+        @contextmanager
+        def recording():
+            threads.append(threading.current_thread())
+            with write_blob() as blob:
+                yield blob
+            threads.append(threading.current_thread())
+
+        with mock.patch.object(theme_fetch, "write_blob", recording):
+            async with _RawUpstream((b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello", False)) as upstream:
+                digest, size, _headers = await theme_fetch.afetch_blob(f"{upstream.url}/d.png", 5)
+            async with _RawUpstream((b"HTTP/1.1 200 OK\r\nContent-Length: 9\r\n\r\nhello", True)) as upstream:
+                with self.assertRaises(ConnectionError):
+                    await theme_fetch.afetch_blob(f"{upstream.url}/d.png", 5)
+            theme_async_http.pool.close()
+        self.assertEqual((size, digest), (5, hashlib.sha256(b"hello").hexdigest()))
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(loop_thread, threads)
+        # The truncated download left no temp file behind.
+        self.assertEqual([p.name for p in blob_path(digest).parent.parent.glob("*") if p.is_file()], [])
+
+
+class DiceThemeManifestTests(DiceThemeTestCase):
+    base = "https://example.com/themes/gold"
+    files = {
+        "theme.config.json": b'{"diceAvailable": ["d6"], "meshFile": "mesh.json", "themeColor": "#d4af37"}',
+        "mesh.json": b'{"meshes": []}',
+        "d.png": b"\x89PNG" + bytes(range(256)) * 8,
+    }
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="roller", password="pw")
+        self.client.login(username="roller", password="pw")
+
+    def manifest(self) -> dict:
+        response = self.client.get(reverse("core:dice_theme_manifest"))
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        return response.json()
+
+    def test_manifest_changes_only_with_settings(self) -> None:
+        first = self.manifest()
+        self.assertEqual((first["preset"], first["finish"], first["theme"]), ("amethyst", "glossy", None))
+        self.assertEqual(self.manifest()["version"], first["version"])
+        again = self.client.get(reverse("core:dice_theme_manifest"), headers={"if-none-match": f'"{first["version"]}"'})
+        self.assertEqual(again.status_code, 304)
+
+        self.user.dice_preset = "ruby"
+        self.user.save()
+        self.assertNotEqual(self.manifest()["version"], first["version"])
+
+    def test_uncached_theme_loads_through_the_proxy(self) -> None:
+        self.user.dice_external_theme_url = self.base
+        self.user.save()
+        theme = self.manifest()["theme"]
+        self.assertFalse(theme["cached"])
+        self.assertEqual(theme["base_url"], f"/dice-theme/{encode_base(self.base)}")
+
+    def test_cached_theme_assets_are_immutable_until_the_theme_changes(self) -> None:
+        for rel, data in self.files.items():
+            self.cache_file(self.base, rel, data)
+        self.user.dice_external_theme_url = self.base
+        self.user.save()
+        manifest = self.manifest()
+        theme = manifest["theme"]
+        self.assertEqual(theme["themeColor"], "#d4af37")
+        self.assertEqual(set(theme["assets"]), set(self.files))
+        self.assertEqual(theme["assets"]["mesh.json"], theme["base_url"] + "/mesh.json")
+
+        response = self.client.get(theme["assets"]["d.png"])
+        self.assertEqual(b"".join(response.streaming_content), self.files["d.png"])
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(self.manifest()["version"], manifest["version"])
+
+        # New content moves the theme to a new version; old URLs forward to it.
+        self.cache_file(self.base, "mesh.json", b'{"meshes": [1]}')
+        changed = self.manifest()
+        self.assertNotEqual(changed["version"], manifest["version"])
+        stale = self.client.get(theme["assets"]["mesh.json"])
+        self.assertEqual((stale.status_code, stale["Cache-Control"]), (302, "no-cache"))
+        self.assertEqual(stale["Location"], changed["theme"]["assets"]["mesh.json"])
+        fresh = self.client.get(stale["Location"])
+        self.assertEqual(b"".join(fresh.streaming_content), b'{"meshes": [1]}')
+
+        # Files the cached theme does not have are left to the proxy.
+        missing = self.client.get(changed["theme"]["base_url"] + "/extra.png")
+        self.assertEqual(missing["Location"], reverse("core:dice_theme_proxy", args=[encode_base(self.base), "extra.png"]))
+
+
+class DiceThemeConfigCacheTests(DiceThemeTestCase):
+    config = {"diceAvailable": ["d6"], "meshFile": "mesh.json", "material": {"diffuseTexture": "d.png"}}
+
+    def setUp(self) -> None:
+        super().setUp()
+        get_user_model().objects.create_user(username="tester", password="pw")
+        self.client.login(username="tester", password="pw")
+
+    def post(self, name: str, url: str):
+        return self.client.post(reverse(name), {"url": url})
+
+    def test_repeat_tests_reuse_the_validated_config(self) -> None:
+        with _ThemeUpstream({"theme.config.json": json.dumps(self.config).encode()}) as upstream:
+            first = self.post("core:dice_theme_test", upstream.url).json()
+            second = self.post("core:dice_theme_test", upstream.url).json()
+            with override_settings(DICE_THEME_CONFIG_TTL=0):
+                third = self.post("core:dice_theme_test", upstream.url).json()
+        self.assertEqual((first["ok"], first["cached"]), (True, False))
+        self.assertEqual((second["cached"], second["assets"]), (True, first["assets"]))
+        self.assertGreaterEqual(second["cacheAge"], 0)
+        # Past the TTL the config is revalidated with its ETag rather than downloaded again.
+        self.assertEqual((third["ok"], third["cached"]), (True, False))
+        self.assertEqual(upstream.requests, ["theme.config.json", "theme.config.json"])
+        self.assertEqual(upstream.statuses, [200, 304])
+
+    def test_invalid_config_result_is_cached_and_blocks_loading(self) -> None:
+        with _ThemeUpstream({"theme.config.json": b'{"meshFile": "mesh.json"}'}) as upstream:
+            tested = self.post("core:dice_theme_test", upstream.url)
+            loaded = self.post("core:dice_theme_load", upstream.url)
+        self.assertEqual(tested.status_code, 400)
+        self.assertEqual(loaded.status_code, 400)
+        self.assertEqual(loaded.json()["error"], "Missing diceAvailable in theme.config.json")
+        self.assertTrue(loaded.json()["cached"])
+        self.assertEqual(upstream.requests, ["theme.config.json"])
+        self.assertFalse(ThemeJob.objects.exists())
+
+    def test_load_after_test_does_not_fetch_the_config_again(self) -> None:
+        files = {"theme.config.json": json.dumps(self.config).encode(), "mesh.json": b"{}", "d.png": b"png"}
+        with _ThemeUpstream(files) as upstream:
+            self.post("core:dice_theme_test", upstream.url)
+            response = self.post("core:dice_theme_load", upstream.url)
+            theme_jobs.run_pending()
+        job = ThemeJob.objects.get(pk=response.json()["job_id"])
+        self.assertEqual(job.status, ThemeJob.SUCCEEDED)
+        self.assertEqual(sorted(upstream.requests), ["d.png", "mesh.json", "theme.config.json"])
+
+    def test_parsed_config_cannot_change_the_cached_one(self) -> None:
+        digest = self.cache_file("https://example.com/t", "theme.config.json", json.dumps(self.config).encode()).name
+        config, error = theme_config.parse(digest)
+        config["material"]["diffuseTexture"] = "other.png"
+        config["diceAvailable"].append("d20")
+        self.assertEqual((theme_config.parse(digest), error), ((self.config, ""), ""))
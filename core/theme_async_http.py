@@ -0,0 +1,390 @@
+"""Non-blocking HTTP/1.1 client for the ASGI theme views.
+
+Mirrors :mod:`core.theme_http` on asyncio streams: keep-alive connections,
+the same per-host concurrency limit with a fast-fail queue timeout, and the
+same circuit breakers, so a host tripped by sync traffic is shed here too.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ssl
+import time
+import weakref
+from email.message import Message
+from email.parser import BytesHeaderParser
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+
+from . import theme_http
+from .theme_http import MAX_REDIRECTS, REDIRECT_STATUSES, CircuitBreaker, HostBusyError, HTTPStatusError
+
+READ_SIZE = 64 * 1024
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+
+
+def _chunk_size(line: bytes) -> int:
+    """Size from a chunk-size line; ``ConnectionError`` for a truncated or malformed one."""
+    if not line.endswith(b"\n"):
+        raise ConnectionError("Upstream closed the connection before the end of the body")
+    size = line.split(b";", 1)[0].strip()
+    # int(..., 16) alone would also take signs, "0x" prefixes and underscores.
+    if not size or size.strip(_HEX_DIGITS):
+        raise ConnectionError(f"Malformed chunk size {size[:16]!r} from upstream")
+    return int(size, 16)
+
+
+class AsyncConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncHostPool:
+    """Keep-alive connections to one host for the current event loop; see :class:`theme_http.HostPool`."""
+
+    def __init__(
+        self,
+        scheme: str,
+        host: str,
+        port: int,
+        size: int,
+        keepalive: float,
+        connect_timeout: float,
+        queue_timeout: float,
+        ssl_context: ssl.SSLContext | None = None,
+    ) -> None:
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.queue_timeout = queue_timeout
+        self.ssl_context = ssl_context
+        self._idle: list[tuple[AsyncConnection, float]] = []
+        self._slots = asyncio.Semaphore(size)
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.busy_rejections = 0
+
+    async def _connect(self) -> AsyncConnection:
+        tls = None
+        if self.scheme == "https":
+            tls = self.ssl_context or ssl.create_default_context()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=tls), self.connect_timeout
+        )
+        self.opened += 1
+        return AsyncConnection(reader, writer)
+
+    async def acquire(self) -> tuple[AsyncConnection, bool]:
+        if self._slots.locked():
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except TimeoutError:
+                self.busy_rejections += 1
+                raise HostBusyError(f"No free connection to {self.host} within {self.queue_timeout}s") from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        now = time.monotonic()
+        while self._idle:
+            conn, since = self._idle.pop()
+            if now - since <= self.keepalive and conn.usable():
+                self.reused += 1
+                return conn, True
+            conn.close()
+        try:
+            return await self._connect(), False
+        except BaseException:
+            self._free_slot()
+            raise
+
+    def _free_slot(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    def release(self, conn: AsyncConnection, reusable: bool) -> None:
+        if reusable and self.keepalive > 0:
+            self._idle.append((conn, time.monotonic()))
+        else:
+            conn.close()
+        self._free_slot()
+
+    def close(self) -> None:
+        for conn, _since in self._idle:
+            conn.close()
+        self._idle.clear()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "connections_opened": self.opened,
+            "reused": self.reused,
+            "idle": len(self._idle),
+            "limit": self.size,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": self.waiting,
+            "busy_rejections": self.busy_rejections,
+        }
+
+
+class AsyncResponse:
+    """An upstream response; :meth:`aclose` hands the connection back to its pool.
+
+    Bodies framed by Content-Length, chunked encoding or connection close are
+    supported. The connection is reused only when the body was read to the end
+    and the server did not ask to close it.
+    """
+
+    def __init__(
+        self, pool: AsyncHostPool, conn: AsyncConnection, status: int, headers: Message, method: str, timeout: float
+    ) -> None:
+        self._pool = pool
+        self._conn: AsyncConnection | None = conn
+        self.status = status
+        self.headers = headers
+        self._timeout = timeout
+        self._chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+        self._chunk_left = 0
+        length = headers.get("Content-Length")
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            self._remaining: int | None = 0
+        elif self._chunked:
+            self._remaining = None
+        elif length is not None and length.strip().isdigit():
+            self._remaining = int(length)
+        else:
+            self._remaining = None  # until the server closes the connection
+        self.will_close = "close" in headers.get("Connection", "").lower() or (
+            not self._chunked and self._remaining is None
+        )
+        self._done = self._remaining == 0
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self._timeout)
+
+    async def _read_chunked(self, amt: int) -> bytes:
+        reader = self._conn.reader
+        if self._chunk_left == 0:
+            size = _chunk_size(await self._read(reader.readline()))
+            if size == 0:
+                while (await self._read(reader.readline())) not in (b"\r\n", b"\n", b""):
+                    pass  # trailers
+                self._done = True
+                return b""
+            self._chunk_left = size
+        data = await self._read(reader.read(min(amt, self._chunk_left)))
+        if not data:
+            raise ConnectionError("Upstream closed the connection mid-chunk")
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0 and (await self._read(reader.readline())) not in (b"\r\n", b"\n"):
+            raise ConnectionError("Malformed chunk terminator from upstream")
+        return data
+
+    async def read(self, amt: int | None = None) -> bytes:
+        """Up to ``amt`` bytes of the body (all of it if None); ``b""`` at the end."""
+        if amt is None:
+            parts = []
+            while data := await self.read(READ_SIZE):
+                parts.append(data)
+            return b"".join(parts)
+        if self._done or self._conn is None:
+            return b""
+        if self._chunked:
+            return await self._read_chunked(amt)
+        if self._remaining is None:
+            data = await self._read(self._conn.reader.read(amt))
+            self._done = not data
+            return data
+        data = await self._read(self._conn.reader.read(min(amt, self._remaining)))
+        if not data:
+            raise ConnectionError("Upstream closed the connection before the end of the body")
+        self._remaining -= len(data)
+        self._done = self._remaining == 0
+        return data
+
+    async def aclose(self) -> None:
+        if self._conn is None:
+            return
+        self._pool.release(self._conn, self._done and not self.will_close)
+        self._conn = None
+
+    async def __aenter__(self) -> "AsyncResponse":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+
+class AsyncConnectionPool:
+    """Keep-alive pools for async outbound theme traffic, one :class:`AsyncHostPool` per host and loop.
+
+    With ``breakers_from`` the per-host circuit breakers are those of that
+    sync pool; otherwise the pool keeps its own. Sizes and timeouts default to
+    the ``DICE_THEME_HTTP_*`` settings.
+    """
+
+    def __init__(
+        self,
+        size: int | None = None,
+        keepalive: float | None = None,
+        connect_timeout: float | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        queue_timeout: float | None = None,
+        breakers_from: theme_http.ConnectionPool | None = None,
+    ) -> None:
+        self._size = size
+        self._keepalive = keepalive
+        self._connect_timeout = connect_timeout
+        self._queue_timeout = queue_timeout
+        self.ssl_context = ssl_context
+        self._breakers_from = breakers_from
+        self._breakers: dict[tuple[str, str, int], CircuitBreaker] = {}
+        self._loops: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple[str, str, int], AsyncHostPool]] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def host_pool(self, scheme: str, host: str, port: int) -> AsyncHostPool:
+        hosts = self._loops.setdefault(asyncio.get_running_loop(), {})
+        key = (scheme, host, port)
+        pool = hosts.get(key)
+        if pool is None:
+            pool = hosts[key] = AsyncHostPool(
+                scheme,
+                host,
+                port,
+                size=self._size or getattr(settings, "DICE_THEME_HTTP_POOL_SIZE", 8),
+                keepalive=(
+                    self._keepalive if self._keepalive is not None else getattr(settings, "DICE_THEME_HTTP_KEEPALIVE", 60)
+                ),
+                connect_timeout=self._connect_timeout or getattr(settings, "DICE_THEME_HTTP_CONNECT_TIMEOUT", 5),
+                queue_timeout=(
+                    self._queue_timeout
+                    if self._queue_timeout is not None
+                    else getattr(settings, "DICE_THEME_HTTP_QUEUE_TIMEOUT", 1.0)
+                ),
+                ssl_context=self.ssl_context,
+            )
+        return pool
+
+    def breaker(self, scheme: str, host: str, port: int) -> CircuitBreaker:
+        if self._breakers_from is not None:
+            return self._breakers_from.host_pool(scheme, host, port).breaker
+        key = (scheme, host, port)
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(
+                threshold=getattr(settings, "DICE_THEME_BREAKER_FAILURES", 5),
+                reset_timeout=getattr(settings, "DICE_THEME_BREAKER_RESET_SECONDS", 30),
+            )
+        return self._breakers[key]
+
+    async def _send(
+        self, pool: AsyncHostPool, method: str, target: str, headers: dict[str, str], timeout: float
+    ) -> tuple[AsyncConnection, int, Message]:
+        default_port = 443 if pool.scheme == "https" else 80
+        host = pool.host if pool.port == default_port else f"{pool.host}:{pool.port}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", "Accept-Encoding: identity"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        for attempt in range(2):
+            conn, reused = await pool.acquire()
+            try:
+                conn.writer.write(payload)
+                await asyncio.wait_for(conn.writer.drain(), timeout)
+                head = await asyncio.wait_for(conn.reader.readuntil(b"\r\n\r\n"), timeout)
+                status_line, _, header_block = head.partition(b"\r\n")
+                version, status, *_reason = status_line.decode("latin-1").split(" ", 2)
+                if not version.startswith("HTTP/"):
+                    raise ConnectionError(f"Malformed status line from {pool.host}")
+                parsed = BytesHeaderParser().parsebytes(header_block)
+                if version == "HTTP/1.0" and "keep-alive" not in parsed.get("Connection", "").lower():
+                    parsed["Connection"] = "close"
+                return conn, int(status), parsed
+            except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                pool.release(conn, False)
+                # The server may have dropped an idle keep-alive connection; retry once on a new one.
+                if not reused or attempt or isinstance(e, TimeoutError):
+                    raise
+            except BaseException:
+                pool.release(conn, False)
+                raise
+        raise AssertionError("unreachable")
+
+    async def request(
+        self, method: str, url: str, headers: dict[str, str] | None = None, timeout: float = 10
+    ) -> AsyncResponse:
+        """Async :meth:`theme_http.ConnectionPool.request`: same redirects, errors and breaker accounting."""
+        for _hop in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError(f"Unsupported URL {url!r}")
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            pool = self.host_pool(parts.scheme, parts.hostname, port)
+            breaker = self.breaker(parts.scheme, parts.hostname, port)
+            target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            breaker.before_request(parts.hostname)
+            try:
+                conn, status, response_headers = await self._send(pool, method, target, dict(headers or {}), timeout)
+            except (asyncio.IncompleteReadError, OSError):
+                breaker.record(False)
+                raise
+            except BaseException:
+                breaker.cancel()
+                raise
+            breaker.record(status < 500)
+            resp = AsyncResponse(pool, conn, status, response_headers, method, timeout)
+            if 200 <= status < 300:
+                return resp
+            location = response_headers.get("Location")
+            async with resp:
+                await resp.read()  # drain so the connection can be reused
+            if status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            raise HTTPStatusError(status, response_headers)
+        raise ConnectionError(f"Too many redirects fetching {url}")
+
+    def stats(self) -> dict:
+        hosts: dict[str, dict] = {}
+        for loop_hosts in list(self._loops.values()):
+            for (scheme, host, port), pool in loop_hosts.items():
+                stats = hosts.setdefault(f"{scheme}://{host}:{port}", dict.fromkeys(pool.stats(), 0))
+                for name, value in pool.stats().items():
+                    stats[name] = max(stats[name], value) if name in ("limit", "peak_in_flight") else stats[name] + value
+        return {
+            "hosts": hosts,
+            "requests": sum(h["requests"] for h in hosts.values()),
+            "in_flight": sum(h["in_flight"] for h in hosts.values()),
+            "busy_rejections": sum(h["busy_rejections"] for h in hosts.values()),
+        }
+
+    def close(self) -> None:
+        """Close idle connections of the current event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for pool in self._loops.pop(loop, {}).values():
+            pool.close()
+
+
+pool = AsyncConnectionPool(breakers_from=theme_http.pool)
@@ -0,0 +1,524 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts only coalesce within a process
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are produced
+    brotli = None
+
+CACHE_DIRNAME = "dice_theme_cache"
+# Bytes read from disk or upstream per iteration; bounds per-request memory.
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "wasm": "application/wasm",
+    "js": "application/javascript",
+    "gif": "image/gif",
+    "svg": "image/svg+xml",
+}
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def transform_github_base(url: str) -> str:
+    """Convert common GitHub folder URLs into raw file URLs.
+
+    Accepts formats like:
+      https://github.com/user/repo/tree/branch/path/to/theme
+    and returns:
+      https://raw.githubusercontent.com/user/repo/branch/path/to/theme
+    Other hosts are returned unchanged.
+    """
+    try:
+        p = urlparse(url)
+        if p.netloc == "github.com":
+            parts = [seg for seg in p.path.strip("/").split("/") if seg]
+            # user/repo/tree/branch/optional/path
+            if len(parts) >= 4 and parts[2] == "tree":
+                user, repo, _tree, branch = parts[:4]
+                rest = "/".join(parts[4:])
+                base = f"https://raw.githubusercontent.com/{user}/{repo}/{branch}"
+                return base + (f"/{rest}" if rest else "")
+        return url
+    except Exception:
+        return url
+
+
+def encode_base(url: str) -> str:
+    """URL-safe base64 without padding, as used in /dice-theme/<base_b64>/ routes."""
+    return base64.urlsafe_b64encode(url.encode()).decode().rstrip("=")
+
+
+def decode_base(base_b64: str) -> str | None:
+    padded = base_b64 + "=" * ((4 - len(base_b64) % 4) % 4)
+    try:
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except Exception:
+        return None
+
+
+def theme_key(base_url: str) -> str:
+    """Cache folder name for a theme: the encoded *raw* base URL.
+
+    The browser encodes whatever URL the user typed (often a github.com tree
+    URL) while loads resolve it first; keying on the resolved URL lets both
+    share one cache folder.
+    """
+    return encode_base(transform_github_base(base_url))
+
+
+def safe_relpath(res_path: str) -> str:
+    return "/".join([p for p in res_path.split("/") if p not in ("..", ".", "")])
+
+
+CONFIG_FILE = "theme.config.json"
+
+
+def config_assets(cfg: dict) -> list[str]:
+    """Files a theme needs: its config, mesh and every material texture, in order."""
+    assets = [CONFIG_FILE, cfg.get("meshFile", "default.json")]
+    mat = cfg.get("material", {})
+    if isinstance(mat, dict):
+        for key in ("diffuseTexture", "bumpTexture", "specularTexture"):
+            value = mat.get(key)
+            if isinstance(value, str) and value:
+                assets.append(value)
+            elif isinstance(value, dict):
+                assets.extend(v for v in value.values() if isinstance(v, str) and v)
+    return list(dict.fromkeys(assets))
+
+
+def cache_root() -> Path:
+    return Path(settings.MEDIA_ROOT) / CACHE_DIRNAME
+
+
+def theme_dir(key: str) -> Path:
+    """Per-theme folder of the pre-dedup layout; only read when migrating."""
+    return cache_root() / key
+
+
+BLOB_DIRNAME = ".blobs"
+TEMP_PREFIX = ".tmp-"
+# Lock files of single_flight(), one per name, under the cache root.
+LOCK_DIRNAME = ".locks"
+
+
+def blob_dir() -> Path:
+    return cache_root() / BLOB_DIRNAME
+
+
+def blob_path(digest: str) -> Path:
+    return blob_dir() / digest[:2] / digest
+
+
+def blob_etag(digest: str) -> str:
+    return f'"{digest[:32]}"'
+
+
+class BlobWriter:
+    def __init__(self, fh) -> None:
+        self.fh = fh
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.digest = ""
+
+    def write(self, data: bytes) -> None:
+        self.fh.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+
+@contextmanager
+def write_blob():
+    """Yield a :class:`BlobWriter`; on exit the bytes are stored once under their sha256.
+
+    Content lands in a temp file and is renamed into place, so readers never
+    see a partial blob; if the blob already exists the copy is dropped.
+    ``writer.digest`` is set once the block exits.
+    """
+    tmp_dir = blob_dir()
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir, prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            writer = BlobWriter(fh)
+            yield writer
+        writer.digest = writer._hash.hexdigest()
+        adopt_blob(Path(tmp), writer.digest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def adopt_blob(path: Path, digest: str) -> bool:
+    """Move ``path`` into the store as ``digest``; returns False if it was a duplicate (and is removed)."""
+    dest = blob_path(digest)
+    if dest.is_file():
+        path.unlink(missing_ok=True)
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, dest)
+    return True
+
+
+def write_derived(dest: Path, data: bytes) -> None:
+    """Atomically write a file derived from a blob (compressed or texture variant) next to it."""
+    fd, tmp = tempfile.mkstemp(dir=blob_dir(), prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, dest)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+# Precompressed variants are stored beside their blob as <hash>.<suffix>; best first.
+ENCODING_SUFFIXES = {"br": "br", "gzip": "gz"}
+COMPRESSIBLE_TYPES = frozenset(["application/json", "application/javascript", "image/svg+xml"])
+# Variants smaller than this fraction of the original are not worth a second file.
+MIN_COMPRESSION_GAIN = 0.9
+MIN_COMPRESS_BYTES = 256
+
+
+def is_compressible(path: str) -> bool:
+    return content_type_for(path) in COMPRESSIBLE_TYPES
+
+
+def variant_path(digest: str, encoding: str) -> Path:
+    return blob_path(digest).with_name(f"{digest}.{ENCODING_SUFFIXES[encoding]}")
+
+
+def _compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output deterministic for identical blobs.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def write_variants(digest: str) -> dict[str, int]:
+    """Create the compressed variants of a blob that pay off; returns ``{encoding: size}``.
+
+    Existing variants (e.g. from another theme sharing the blob) are reused.
+    Compression happens once here so serving never compresses per request.
+    """
+    source = blob_path(digest)
+    size = source.stat().st_size
+    if size < MIN_COMPRESS_BYTES:
+        return {}
+    sizes: dict[str, int] = {}
+    data: bytes | None = None
+    for encoding in ENCODING_SUFFIXES:
+        if encoding == "br" and brotli is None:
+            continue
+        dest = variant_path(digest, encoding)
+        if dest.is_file():
+            sizes[encoding] = dest.stat().st_size
+            continue
+        if data is None:
+            data = source.read_bytes()
+        packed = _compress(encoding, data)
+        if len(packed) > size * MIN_COMPRESSION_GAIN:
+            continue
+        write_derived(dest, packed)
+        sizes[encoding] = len(packed)
+    return sizes
+
+
+def parse_qvalues(header: str) -> dict[str, float]:
+    """Parse ``Accept``/``Accept-Encoding`` into ``{value: q}``, lower-cased."""
+    accepted: dict[str, float] = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_variant(request, digest: str) -> tuple[Path, str | None]:
+    """Pick the best stored representation the client accepts: ``(path, content-encoding or None)``."""
+    accepted = parse_qvalues(request.headers.get("Accept-Encoding", ""))
+    candidates = []
+    for rank, encoding in enumerate(ENCODING_SUFFIXES):
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            candidates.append((-q, rank, encoding))
+    for _q, _rank, encoding in sorted(candidates):
+        path = variant_path(digest, encoding)
+        if path.is_file():
+            return path, encoding
+    return blob_path(digest), None
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while data := fh.read(CHUNK_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+_flights: dict[str, tuple[threading.Lock, int]] = {}
+_flights_guard = threading.Lock()
+
+
+@contextmanager
+def _file_lock(name: str):
+    if fcntl is None:
+        yield
+        return
+    lock_dir = cache_root() / LOCK_DIRNAME
+    lock_dir.mkdir(parents=True, exist_ok=True)
+    path = lock_dir / (hashlib.sha1(name.encode()).hexdigest() + ".lock")
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # prune() may have removed the file before we locked it; a lock on an
+        # unlinked file excludes nobody, so start over on the current one.
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextmanager
+def single_flight(name: str):
+    """Hold an exclusive lock on ``name`` across threads and, via a lock file, processes.
+
+    Callers re-check the cache once inside, so concurrent misses for one asset
+    make a single upstream fetch and the rest read its result.
+    """
+    with _flights_guard:
+        lock, users = _flights.get(name, (threading.Lock(), 0))
+        _flights[name] = (lock, users + 1)
+    try:
+        # Threads queue on the in-process lock so only one per process waits on the file lock.
+        with lock, _file_lock(name):
+            yield
+    finally:
+        with _flights_guard:
+            lock, users = _flights[name]
+            if users == 1:
+                del _flights[name]
+            else:
+                _flights[name] = (lock, users - 1)
+
+
+# Per event loop: name -> (lock, coroutines using it); asyncio locks belong to one loop.
+_async_flights: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, tuple[asyncio.Lock, int]]] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@asynccontextmanager
+async def async_single_flight(name: str):
+    """:func:`single_flight` for coroutines.
+
+    Coroutines queue on an asyncio lock, so only one per loop waits for the
+    cross-thread/process lock, and it does so in a worker thread rather than
+    blocking the event loop.
+    """
+    flights = _async_flights.setdefault(asyncio.get_running_loop(), {})
+    lock, users = flights.get(name, (asyncio.Lock(), 0))
+    flights[name] = (lock, users + 1)
+    try:
+        async with lock:
+            flight = single_flight(name)
+            entering = asyncio.ensure_future(asyncio.to_thread(flight.__enter__))
+            try:
+                await asyncio.shield(entering)
+            except asyncio.CancelledError:
+                # The thread still takes the lock; hand it back as soon as it does.
+                entering.add_done_callback(lambda f: f.cancelled() or f.exception() or flight.__exit__(None, None, None))
+                raise
+            try:
+                yield
+            finally:
+                flight.__exit__(None, None, None)
+    finally:
+        lock, users = flights[name]
+        if users == 1:
+            del flights[name]
+        else:
+            flights[name] = (lock, users - 1)
+
+
+def content_type_for(path: str) -> str:
+    ext = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return CONTENT_TYPES.get(ext, "application/octet-stream")
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None | bool:
+    """Parse a single-range ``Range`` header into an inclusive ``(start, end)``.
+
+    Returns ``None`` when the header should be ignored (absent, malformed or
+    multi-range, which we answer with the full body) and ``False`` when the
+    range cannot be satisfied.
+    """
+    m = _RANGE_RE.match(header.strip()) if header else None
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+        if start >= size or end < start:
+            return False
+        return start, min(end, size - 1)
+    suffix = int(m.group(2))
+    if suffix == 0:
+        return False
+    return max(size - suffix, 0), size - 1
+
+
+class FileChunks:
+    """Iterable over ``length`` bytes (default: the rest) of an open file from ``start``.
+
+    Streaming responses call :meth:`close` when finished or abandoned, so the
+    handle is released even if iteration never starts.
+    """
+
+    def __init__(self, fh, start: int = 0, length: int | None = None, chunk_size: int = CHUNK_SIZE) -> None:
+        self.fh = fh
+        self.start = start
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        self.fh.seek(self.start)
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            data = self.fh.read(self.chunk_size if remaining is None else min(self.chunk_size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+    def close(self) -> None:
+        self.fh.close()
+
+
+class AsyncFileChunks:
+    """:class:`FileChunks` for ASGI: each disk read runs in a worker thread.
+
+    Only async-iterable, so Django streams it chunk by chunk on the event loop
+    instead of consuming a synchronous iterator in one go.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.chunks = FileChunks(*args, **kwargs)
+
+    async def __aiter__(self):
+        chunks = iter(self.chunks)
+        while (data := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield data
+
+    def close(self) -> None:
+        self.chunks.close()
+
+
+def _if_range_allows(request, etag: str, last_modified: float) -> bool:
+    value = request.headers.get("If-Range")
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag
+    date = parse_http_date_safe(value)
+    return date is not None and int(last_modified) <= date
+
+
+def serve_file(
+    request,
+    path: Path,
+    content_type: str,
+    cache_control: str = "public, max-age=604800",
+    etag: str | None = None,
+    async_stream: bool = False,
+):
+    """Stream a cached asset with ETag/Last-Modified, conditional GET and single-range support.
+
+    The file is opened up front, so a concurrent eviction or replacement of
+    ``path`` cannot cut the response short. Raises ``FileNotFoundError`` if it
+    is already gone. ``async_stream`` streams with :class:`AsyncFileChunks` for ASGI.
+    """
+    chunks = AsyncFileChunks if async_stream else FileChunks
+    fh = open(path, "rb")
+    stat = os.fstat(fh.fileno())
+    etag = etag or file_etag(stat)
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        fh.close()
+        conditional["Cache-Control"] = cache_control
+        conditional["Access-Control-Allow-Origin"] = "*"
+        return conditional
+
+    size = stat.st_size
+    byte_range = parse_range(request.headers.get("Range", ""), size)
+    if byte_range is not None and not _if_range_allows(request, etag, stat.st_mtime):
+        byte_range = None
+    if byte_range is False:
+        fh.close()
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = f"bytes */{size}"
+    elif byte_range:
+        start, end = byte_range
+        resp = StreamingHttpResponse(chunks(fh, start, end - start + 1), status=206, content_type=content_type)
+        resp["Content-Range"] = f"bytes {start}-{end}/{size}"
+        resp["Content-Length"] = str(end - start + 1)
+    else:
+        resp = StreamingHttpResponse(chunks(fh), content_type=content_type)
+        resp["Content-Length"] = str(size)
+    resp["Accept-Ranges"] = "bytes"
+    resp["ETag"] = etag
+    resp["Last-Modified"] = http_date(stat.st_mtime)
+    resp["Cache-Control"] = cache_control
+    resp["Access-Control-Allow-Origin"] = "*"
+    return resp
@@ -0,0 +1,114 @@
+"""Validated ``theme.config.json`` of external dice themes, cached per normalized base URL.
+
+The raw config lives in the theme cache like any other asset, so repeat checks
+within ``DICE_THEME_CONFIG_TTL`` seconds need no upstream request and later
+ones revalidate with the stored ETag/Last-Modified. Parsing and validation
+results are memoized by content hash.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from django.conf import settings
+
+from . import theme_cache, theme_fetch
+from .theme_cache import CONFIG_FILE
+
+
+@dataclass(frozen=True)
+class Validation:
+    ok: bool
+    error: str = ""
+    # HTTP status for a failed validation: 400 for a bad config, 502 when it could not be fetched.
+    status: int = 200
+    config: dict = field(default_factory=dict)
+    digest: str = ""
+    # Seconds since upstream last confirmed the config (None if it could not be fetched).
+    age: float | None = None
+    # True when answered from the cache without contacting upstream.
+    cached: bool = False
+
+    @property
+    def assets(self) -> list[str]:
+        return theme_cache.config_assets(self.config)
+
+
+def parse(digest: str) -> tuple[dict, str]:
+    """``(config, error)`` of a cached config blob; the config is the caller's to change."""
+    config, error = _parse(digest)
+    return copy.deepcopy(config), error
+
+
+@lru_cache(maxsize=256)
+def _parse(digest: str) -> tuple[dict, str]:
+    # Blobs never change, so this is memoized by hash; only parse() hands it out.
+    try:
+        data = json.loads(theme_cache.blob_path(digest).read_bytes().decode("utf-8"))
+    except (OSError, ValueError):
+        return {}, "Invalid JSON in theme.config.json"
+    if not isinstance(data, dict) or "diceAvailable" not in data:
+        return {}, "Missing diceAvailable in theme.config.json"
+    return data, ""
+
+
+def _target(url: str) -> tuple[str, str]:
+    """``(theme key, config URL)``: themes are keyed by their normalized (raw) base URL."""
+    base_url = theme_cache.transform_github_base(url)
+    return theme_cache.theme_key(url), base_url.rstrip("/") + "/" + CONFIG_FILE
+
+
+def _ttl() -> float:
+    return getattr(settings, "DICE_THEME_CONFIG_TTL", 300)
+
+
+def _fresh(entry) -> bool:
+    return entry is not None and time.time() - entry.checked < _ttl()
+
+
+def _result(theme: str, cached: bool) -> Validation:
+    entry = theme_fetch.cached_entry(theme, CONFIG_FILE)
+    if entry is None:
+        return Validation(False, "Fetch failed: theme.config.json left the cache", 502)
+    config, error = parse(entry.digest)
+    age = max(0.0, time.time() - entry.checked)
+    if error:
+        return Validation(False, error, 400, digest=entry.digest, age=age, cached=cached)
+    return Validation(True, config=config, digest=entry.digest, age=age, cached=cached)
+
+
+def validate(url: str) -> Validation:
+    """Fetch (or reuse) and validate the config of the theme at ``url``."""
+    theme, config_url = _target(url)
+    if _fresh(theme_fetch.cached_entry(theme, CONFIG_FILE)):
+        return _result(theme, True)
+    try:
+        theme_fetch.fetch_to_cache(config_url, theme, CONFIG_FILE, refresh=True)
+    except theme_fetch.UpstreamError as e:
+        return Validation(False, f"Fetch failed: {e}", 502)
+    return _result(theme, False)
+
+
+async def avalidate(url: str) -> Validation:
+    """:func:`validate` for coroutines: the upstream fetch does not block the event loop."""
+    theme, config_url = _target(url)
+    if _fresh(await asyncio.to_thread(theme_fetch.cached_entry, theme, CONFIG_FILE)):
+        return await asyncio.to_thread(_result, theme, True)
+    try:
+        await theme_fetch.afetch_to_cache(config_url, theme, CONFIG_FILE, refresh=True)
+    except theme_fetch.UpstreamError as e:
+        return Validation(False, f"Fetch failed: {e}", 502)
+    return await asyncio.to_thread(_result, theme, False)
+
+
+def cached(url: str) -> Validation | None:
+    """The validation of ``url`` if it is within the TTL, without contacting upstream."""
+    theme, _config_url = _target(url)
+    if not _fresh(theme_fetch.cached_entry(theme, CONFIG_FILE)):
+        return None
+    return _result(theme, True)
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import time
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.message import Message
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import theme_async_http, theme_http, theme_index
+from .theme_cache import CHUNK_SIZE, async_single_flight, blob_path, safe_relpath, single_flight, write_blob
+
+USER_AGENT = "better5e-dice-proxy/1.0"
+PROXY_TIMEOUT = 10
+
+
+def open_upstream(url: str, headers: dict[str, str] | None = None, timeout: float = PROXY_TIMEOUT):
+    """GET ``url`` over the shared keep-alive pool; raises ``HTTPStatusError`` for non-2xx answers."""
+    return theme_http.pool.request("GET", url, {"User-Agent": USER_AGENT, **(headers or {})}, timeout)
+
+
+def iter_response(resp, chunk_size: int = CHUNK_SIZE):
+    """Yield an upstream body in chunks, closing the connection when done or abandoned."""
+    try:
+        while True:
+            data = resp.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        resp.close()
+
+
+@dataclass(frozen=True)
+class AssetResult:
+    path: str
+    ok: bool
+    bytes: int = 0
+    ms: float = 0.0
+    error: str = ""
+    digest: str = ""
+    # UpstreamError status of a failed fetch: 404 is permanent, anything else may be retried.
+    status: int = 0
+
+
+class UpstreamError(Exception):
+    """An asset could not be fetched.
+
+    ``status`` is 404 when upstream says it is missing, 503 when the host is
+    shed locally (circuit open or all connections busy; see ``retry_after``), else 502.
+    """
+
+    def __init__(self, status: int, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+NEGATIVE_PREFIX = "dice-theme-failure"
+
+
+def _negative_key(url: str) -> str:
+    return f"{NEGATIVE_PREFIX}:{hashlib.sha1(url.encode()).hexdigest()}"
+
+
+def remember_failure(url: str, error: UpstreamError) -> None:
+    ttl = getattr(settings, "DICE_THEME_NEGATIVE_TTL", 60)
+    if ttl:
+        cache.set(_negative_key(url), (error.status, str(error)), ttl)
+
+
+def recent_failure(url: str) -> UpstreamError | None:
+    hit = cache.get(_negative_key(url))
+    return UpstreamError(*hit) if hit else None
+
+
+def fetch_blob(url: str, timeout: float, headers: dict[str, str] | None = None) -> tuple[str, int, Message]:
+    """Stream ``url`` into the content-addressed store; returns ``(digest, size, response headers)``."""
+    with open_upstream(url, {"Accept": "*/*", **(headers or {})}, timeout) as upstream, write_blob() as blob:
+        for chunk in iter_response(upstream):
+            blob.write(chunk)
+    return blob.digest, blob.size, upstream.headers
+
+
+def cached_entry(theme: str, path: str) -> theme_index.Entry | None:
+    entry = theme_index.lookup(theme, path)
+    return entry if entry and blob_path(entry.digest).is_file() else None
+
+
+def cached_digest(theme: str, path: str) -> str | None:
+    entry = cached_entry(theme, path)
+    return entry.digest if entry else None
+
+
+def is_fresh(entry: theme_index.Entry) -> bool:
+    return time.time() - entry.checked < getattr(settings, "DICE_THEME_CACHE_FRESH_SECONDS", 3600)
+
+
+def _validators(entry: theme_index.Entry | None) -> dict[str, str]:
+    headers = {}
+    if entry and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+def _cached_answer(url: str, entry: theme_index.Entry | None, refresh: bool) -> str | None:
+    """Digest to answer with before any fetch: a fresh entry, or a stale one while upstream recently failed.
+
+    Raises the remembered failure when there is nothing to serve.
+    """
+    if entry and not refresh and is_fresh(entry):
+        return entry.digest
+    if not refresh and (failure := recent_failure(url)):
+        if entry and failure.status != 404:
+            return entry.digest
+        raise failure
+    return None
+
+
+def _upstream_failure(e: Exception) -> UpstreamError:
+    if isinstance(e, theme_http.HTTPStatusError):
+        return UpstreamError(404 if e.code == 404 else 502, f"Upstream error {e.code}")
+    if isinstance(e, (theme_http.CircuitOpenError, theme_http.HostBusyError)):
+        return UpstreamError(503, f"Upstream unavailable: {e}", getattr(e, "retry_after", 1.0))
+    return UpstreamError(502, f"Upstream fetch failed: {e}")
+
+
+def _fall_back(url: str, theme: str, path: str, entry: theme_index.Entry | None, failure: UpstreamError) -> str:
+    """Stale digest to serve after a failed fetch; raises ``failure`` when there is none."""
+    if failure.status != 503:
+        # Shed requests never reached upstream: already fast, so not negative-cached.
+        remember_failure(url, failure)
+        if entry and failure.status == 404:
+            theme_index.forget(theme, path)
+            entry = None
+    if entry:
+        return entry.digest
+    raise failure
+
+
+def _record(theme: str, path: str, digest: str, size: int, headers: Message) -> None:
+    theme_index.record(
+        theme, path, digest, size, etag=headers.get("ETag", ""), last_modified=headers.get("Last-Modified", "")
+    )
+
+
+def fetch_to_cache(
+    url: str, theme: str, path: str, timeout: float = PROXY_TIMEOUT, refresh: bool = False
+) -> tuple[str, int]:
+    """Write-through fetch of ``url`` as ``theme``/``path`` in the cache.
+
+    Entries confirmed upstream within ``DICE_THEME_CACHE_FRESH_SECONDS`` are
+    used as is; older ones (or any, with ``refresh``) are revalidated with the
+    stored ETag/Last-Modified, so an unchanged asset costs a 304. Concurrent
+    calls for one asset (threads or processes) share a single upstream request.
+
+    Failures are negative-cached for ``DICE_THEME_NEGATIVE_TTL`` seconds; while
+    upstream is failing, or shed by the pool's circuit breaker or concurrency
+    limit, a cached copy is served stale. Returns ``(digest, bytes
+    downloaded)`` and raises :class:`UpstreamError` when there is nothing to serve.
+    """
+    entry = cached_entry(theme, path)
+    if digest := _cached_answer(url, entry, refresh):
+        return digest, 0
+    started = time.time()
+    with single_flight(f"{theme}/{path}"):
+        # The flight we waited on may have fetched or revalidated it already.
+        entry = cached_entry(theme, path)
+        if entry and (entry.checked >= started or (not refresh and is_fresh(entry))):
+            return entry.digest, 0
+        try:
+            digest, size, headers = fetch_blob(url, timeout, _validators(entry))
+        except Exception as e:
+            if isinstance(e, theme_http.HTTPStatusError) and e.code == 304 and entry:
+                theme_index.mark_checked(theme, path)
+                return entry.digest, 0
+            failure = _upstream_failure(e)
+        else:
+            _record(theme, path, digest, size, headers)
+            return digest, size
+    return _fall_back(url, theme, path, entry, failure), 0
+
+
+async def aopen_upstream(url: str, headers: dict[str, str] | None = None, timeout: float = PROXY_TIMEOUT):
+    """:func:`open_upstream` on the asyncio pool, for ASGI views."""
+    return await theme_async_http.pool.request("GET", url, {"User-Agent": USER_AGENT, **(headers or {})}, timeout)
+
+
+@asynccontextmanager
+async def _awrite_blob() -> AsyncIterator:
+    """:func:`write_blob` with the temp file setup and the final flush and rename in worker threads."""
+    writing = write_blob()
+    blob = await asyncio.to_thread(writing.__enter__)
+    try:
+        yield blob
+    except BaseException as e:
+        if not await asyncio.to_thread(writing.__exit__, type(e), e, e.__traceback__):
+            raise
+    else:
+        await asyncio.to_thread(writing.__exit__, None, None, None)
+
+
+async def afetch_blob(url: str, timeout: float, headers: dict[str, str] | None = None) -> tuple[str, int, Message]:
+    """:func:`fetch_blob` without blocking the event loop; all disk work runs in worker threads."""
+    async with await aopen_upstream(url, {"Accept": "*/*", **(headers or {})}, timeout) as upstream:
+        async with _awrite_blob() as blob:
+            while chunk := await upstream.read(CHUNK_SIZE):
+                await asyncio.to_thread(blob.write, chunk)
+    return blob.digest, blob.size, upstream.headers
+
+
+async def afetch_to_cache(
+    url: str, theme: str, path: str, timeout: float = PROXY_TIMEOUT, refresh: bool = False
+) -> tuple[str, int]:
+    """:func:`fetch_to_cache` for coroutines, with the same freshness, sharing and fallback rules.
+
+    Waiting on upstream or on another request's fetch of the same asset does
+    not hold a thread; index and cache lookups run in worker threads.
+    """
+    entry = await asyncio.to_thread(cached_entry, theme, path)
+    if digest := await asyncio.to_thread(_cached_answer, url, entry, refresh):
+        return digest, 0
+    started = time.time()
+    async with async_single_flight(f"{theme}/{path}"):
+        entry = await asyncio.to_thread(cached_entry, theme, path)
+        if entry and (entry.checked >= started or (not refresh and is_fresh(entry))):
+            return entry.digest, 0
+        try:
+            digest, size, headers = await afetch_blob(url, timeout, _validators(entry))
+        except Exception as e:
+            if isinstance(e, theme_http.HTTPStatusError) and e.code == 304 and entry:
+                await asyncio.to_thread(theme_index.mark_checked, theme, path)
+                return entry.digest, 0
+            failure = _upstream_failure(e)
+        else:
+            await asyncio.to_thread(_record, theme, path, digest, size, headers)
+            return digest, size
+    return await asyncio.to_thread(_fall_back, url, theme, path, entry, failure), 0
+
+
+def iter_assets(base_url: str, paths: list[str], theme: str) -> Iterator[AssetResult]:
+    """Fetch ``paths`` under ``base_url`` into ``theme``'s cache manifest concurrently.
+
+    Runs on a pool of ``DICE_THEME_FETCH_WORKERS`` threads, so wall time tracks
+    the slowest asset rather than the sum. Results are yielded as each download
+    finishes; a failed asset is reported in its result and does not affect the others.
+    """
+    timeout = getattr(settings, "DICE_THEME_FETCH_TIMEOUT", 15)
+
+    def fetch_one(rel: str) -> AssetResult:
+        rel_safe = safe_relpath(rel)
+        start = time.perf_counter()
+        try:
+            digest, size = fetch_to_cache(base_url.rstrip("/") + "/" + rel_safe, theme, rel_safe, timeout, refresh=True)
+        except Exception as e:
+            return AssetResult(rel_safe, False, ms=_ms(start), error=str(e), status=getattr(e, "status", 502))
+        return AssetResult(rel_safe, True, size, _ms(start), digest=digest)
+
+    if not paths:
+        return
+    workers = max(1, min(getattr(settings, "DICE_THEME_FETCH_WORKERS", 6), len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dice-theme") as pool:
+        for future in as_completed([pool.submit(fetch_one, rel) for rel in paths]):
+            yield future.result()
+
+
+def fetch_assets(base_url: str, paths: list[str], theme: str) -> list[AssetResult]:
+    """:func:`iter_assets` collected in the order of ``paths``."""
+    results = {r.path: r for r in iter_assets(base_url, paths, theme)}
+    return [results[safe_relpath(rel)] for rel in paths]
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
@@ -0,0 +1,410 @@
+from __future__ import annotations
+
+import http.client
+import ssl
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+MAX_REDIRECTS = 5
+
+
+class HTTPStatusError(Exception):
+    """Upstream answered with a non-2xx status (304 included); the body has been drained."""
+
+    def __init__(self, code: int, headers) -> None:
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.headers = headers
+
+
+class HostBusyError(Exception):
+    """Every connection to the host stayed busy for the whole queue timeout."""
+
+
+class CircuitOpenError(Exception):
+    """The host failed repeatedly; requests are refused until the breaker's reset timeout passes."""
+
+    def __init__(self, host: str, retry_after: float) -> None:
+        super().__init__(f"{host} is failing; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one upstream host.
+
+    ``closed``: requests flow. After ``threshold`` failures in a row it turns
+    ``open`` and refuses requests for ``reset_timeout`` seconds; then it is
+    ``half_open`` and lets a single trial request through, which closes the
+    breaker on success or re-opens it on failure.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_timeout or self.trial else "half_open"
+
+    def before_request(self, host: str) -> None:
+        """Raise :class:`CircuitOpenError` unless a request may go out now."""
+        with self._lock:
+            state = self.state()
+            if state == "closed":
+                return
+            if state == "half_open":
+                self.trial = True
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)) if not self.trial else 1.0
+            raise CircuitOpenError(host, retry_after)
+
+    def cancel(self) -> None:
+        """The request never reached the host; give up a half-open trial without a verdict."""
+        with self._lock:
+            self.trial = False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            was_trial, self.trial = self.trial, False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if was_trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state(),
+                "consecutive_failures": self.failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class HostPool:
+    """Keep-alive connections to one ``scheme://host:port``.
+
+    At most ``size`` fetches are in flight at once; callers beyond that queue
+    for up to ``queue_timeout`` seconds and then fail fast with
+    :class:`HostBusyError`. Idle connections older than ``keepalive`` seconds
+    are closed instead of reused.
+    """
+
+    def __init__(
+        self,
+        scheme: str,
+        host: str,
+        port: int,
+        size: int,
+        keepalive: float,
+        connect_timeout: float,
+        ssl_context: ssl.SSLContext | None = None,
+        queue_timeout: float = 1.0,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.ssl_context = ssl_context
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker(threshold=5, reset_timeout=30)
+        self._idle: list[tuple[http.client.HTTPConnection, float]] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.size = size
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.handshake_seconds = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.queued = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.busy_rejections = 0
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            conn: http.client.HTTPConnection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout, context=self.ssl_context or ssl.create_default_context()
+            )
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        start = time.perf_counter()
+        conn.connect()  # TCP and, for https, the TLS handshake
+        with self._lock:
+            self.opened += 1
+            self.handshake_seconds += time.perf_counter() - start
+        return conn
+
+    def _take_slot(self) -> None:
+        if self._slots.acquire(blocking=False):
+            return
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            got = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            waited = time.perf_counter() - start
+            with self._lock:
+                self.waiting -= 1
+                self.queued += 1
+                self.queue_seconds += waited
+                self.max_queue_seconds = max(self.max_queue_seconds, waited)
+                if not got:
+                    self.busy_rejections += 1
+        if not got:
+            raise HostBusyError(f"No free connection to {self.host} within {self.queue_timeout}s")
+
+    def acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        """Return ``(connection, reused)``; waits up to ``queue_timeout`` for a free slot."""
+        self._take_slot()
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            while self._idle:
+                conn, since = self._idle.pop()
+                if now - since <= self.keepalive:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+        try:
+            return self._connect(), False
+        except BaseException:
+            self._free_slot()
+            raise
+
+    def _free_slot(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable and self.keepalive > 0:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        else:
+            conn.close()
+        self._free_slot()
+
+    def close(self) -> None:
+        with self._lock:
+            for conn, _since in self._idle:
+                conn.close()
+            self._idle.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "connections_opened": self.opened,
+                "reused": self.reused,
+                "idle": len(self._idle),
+                "reuse_rate": round(self.reused / self.requests, 3) if self.requests else 0.0,
+                "avg_handshake_ms": round(self.handshake_seconds / self.opened * 1000, 2) if self.opened else 0.0,
+                "limit": self.size,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waiting": self.waiting,
+                "queued": self.queued,
+                "avg_queue_wait_ms": round(self.queue_seconds / self.queued * 1000, 2) if self.queued else 0.0,
+                "max_queue_wait_ms": round(self.max_queue_seconds * 1000, 2),
+                "busy_rejections": self.busy_rejections,
+            }
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+
+class PooledResponse:
+    """An upstream response; closing it hands the connection back to its pool.
+
+    The connection is only reused when the body was read to the end and the
+    server did not ask to close it.
+    """
+
+    def __init__(self, pool: HostPool, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse) -> None:
+        self._pool = pool
+        self._conn: http.client.HTTPConnection | None = conn
+        self._resp = resp
+        self.status = resp.status
+        self.headers = resp.msg
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._resp.read(amt)
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        reusable = self._resp.isclosed() and not self._resp.will_close
+        if not reusable:
+            self._resp.close()
+        self._pool.release(self._conn, reusable)
+        self._conn = None
+
+    def __enter__(self) -> "PooledResponse":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe keep-alive pools for outbound theme traffic, one :class:`HostPool` per host.
+
+    Each host gets its own concurrency limit and :class:`CircuitBreaker`.
+    Sizes and timeouts default to the ``DICE_THEME_HTTP_*`` settings.
+    """
+
+    def __init__(
+        self,
+        size: int | None = None,
+        keepalive: float | None = None,
+        connect_timeout: float | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        queue_timeout: float | None = None,
+        breaker_failures: int | None = None,
+        breaker_reset: float | None = None,
+    ) -> None:
+        self._size = size
+        self._keepalive = keepalive
+        self._connect_timeout = connect_timeout
+        self._queue_timeout = queue_timeout
+        self._breaker_failures = breaker_failures
+        self._breaker_reset = breaker_reset
+        self.ssl_context = ssl_context
+        self._hosts: dict[tuple[str, str, int], HostPool] = {}
+        self._lock = threading.Lock()
+
+    def host_pool(self, scheme: str, host: str, port: int) -> HostPool:
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._hosts.get(key)
+            if pool is None:
+                pool = self._hosts[key] = HostPool(
+                    scheme,
+                    host,
+                    port,
+                    size=self._size or getattr(settings, "DICE_THEME_HTTP_POOL_SIZE", 8),
+                    keepalive=(
+                        self._keepalive
+                        if self._keepalive is not None
+                        else getattr(settings, "DICE_THEME_HTTP_KEEPALIVE", 60)
+                    ),
+                    connect_timeout=self._connect_timeout or getattr(settings, "DICE_THEME_HTTP_CONNECT_TIMEOUT", 5),
+                    ssl_context=self.ssl_context,
+                    queue_timeout=(
+                        self._queue_timeout
+                        if self._queue_timeout is not None
+                        else getattr(settings, "DICE_THEME_HTTP_QUEUE_TIMEOUT", 1.0)
+                    ),
+                    breaker=CircuitBreaker(
+                        threshold=self._breaker_failures or getattr(settings, "DICE_THEME_BREAKER_FAILURES", 5),
+                        reset_timeout=(
+                            self._breaker_reset
+                            if self._breaker_reset is not None
+                            else getattr(settings, "DICE_THEME_BREAKER_RESET_SECONDS", 30)
+                        ),
+                    ),
+                )
+            return pool
+
+    def _send(self, pool: HostPool, method: str, target: str, headers: dict[str, str], timeout: float):
+        for attempt in range(2):
+            conn, reused = pool.acquire()
+            try:
+                assert conn.sock is not None
+                conn.sock.settimeout(timeout)
+                conn.request(method, target, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.HTTPException, OSError) as e:
+                pool.release(conn, False)
+                # The server may have dropped an idle keep-alive connection; retry once on a new one.
+                if not reused or attempt or isinstance(e, TimeoutError):
+                    raise
+            except BaseException:
+                pool.release(conn, False)
+                raise
+        raise AssertionError("unreachable")
+
+    def request(self, method: str, url: str, headers: dict[str, str] | None = None, timeout: float = 10) -> PooledResponse:
+        """Send a request, following redirects; raises :class:`HTTPStatusError` for non-2xx answers.
+
+        Fails fast with :class:`CircuitOpenError` while the host's breaker is
+        open and :class:`HostBusyError` when its connections stay busy.
+        Connection errors, timeouts and 5xx answers count against the breaker.
+        """
+        for _hop in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise ValueError(f"Unsupported URL {url!r}")
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            pool = self.host_pool(parts.scheme, parts.hostname, port)
+            target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+            pool.breaker.before_request(parts.hostname)
+            try:
+                conn, resp = self._send(pool, method, target, dict(headers or {}), timeout)
+            except (http.client.HTTPException, OSError):
+                pool.breaker.record(False)
+                raise
+            except BaseException:
+                pool.breaker.cancel()
+                raise
+            pool.breaker.record(resp.status < 500)
+            pooled = PooledResponse(pool, conn, resp)
+            if 200 <= resp.status < 300:
+                return pooled
+            location = resp.getheader("Location")
+            with pooled:
+                pooled.read()  # drain so the connection can be reused
+            if resp.status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+            raise HTTPStatusError(resp.status, resp.msg)
+        raise http.client.HTTPException(f"Too many redirects fetching {url}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hosts = {f"{s}://{h}:{p}": pool.stats() for (s, h, p), pool in self._hosts.items()}
+        requests = sum(h["requests"] for h in hosts.values())
+        reused = sum(h["reused"] for h in hosts.values())
+        return {
+            "hosts": hosts,
+            "requests": requests,
+            "connections_opened": sum(h["connections_opened"] for h in hosts.values()),
+            "reuse_rate": round(reused / requests, 3) if requests else 0.0,
+            "in_flight": sum(h["in_flight"] for h in hosts.values()),
+            "waiting": sum(h["waiting"] for h in hosts.values()),
+            "busy_rejections": sum(h["busy_rejections"] for h in hosts.values()),
+            "open_circuits": sorted(name for name, h in hosts.items() if h["breaker"]["state"] != "closed"),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for pool in self._hosts.values():
+                pool.close()
+            self._hosts.clear()
+
+
+pool = ConnectionPool()
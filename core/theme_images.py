@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import io
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from . import theme_index
+from .theme_cache import blob_path, parse_qvalues, single_flight, write_derived
+
+try:
+    from PIL import Image
+except ImportError:  # optional: without Pillow textures are served as uploaded
+    Image = None
+
+# Source content type -> (Pillow format, file suffix) of the resized copies.
+TEXTURE_FORMATS = {"image/png": ("PNG", "png"), "image/jpeg": ("JPEG", "jpg")}
+WEBP_TYPE = "image/webp"
+# Request headers that can change which texture variant is served.
+TEXTURE_VARY = ["Accept", "Save-Data", "Sec-CH-Width", "Width"]
+
+# Textures waiting for (or in) background variant generation: digest -> content type.
+_pending: dict[str, str] = {}
+_pending_lock = threading.Lock()
+_worker: threading.Thread | None = None
+
+
+def is_texture(content_type: str) -> bool:
+    return content_type in TEXTURE_FORMATS
+
+
+def texture_widths() -> list[int]:
+    return sorted(getattr(settings, "DICE_THEME_TEXTURE_WIDTHS", (512, 1024)))
+
+
+def texture_path(digest: str, width: int | None, suffix: str) -> Path:
+    """``<hash>.<width>.<suffix>`` for resized copies, ``<hash>.webp`` for the full-size WebP."""
+    name = f"{digest}.{width}.{suffix}" if width else f"{digest}.{suffix}"
+    return blob_path(digest).with_name(name)
+
+
+def _encode(image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        image.save(out, fmt, quality=getattr(settings, "DICE_THEME_WEBP_QUALITY", 90))
+    elif fmt == "JPEG":
+        image.save(out, fmt, quality=90, optimize=True)
+    else:
+        image.save(out, fmt, optimize=True)
+    return out.getvalue()
+
+
+def generate(digest: str, content_type: str) -> int:
+    """Write the downscaled and WebP variants of a texture blob; returns the bytes written.
+
+    Each configured width smaller than the texture gets a copy in the source
+    format; every size (the original included) gets a WebP copy when that is
+    smaller than its source-format counterpart.
+    """
+    fmt, suffix = TEXTURE_FORMATS[content_type]
+    source = blob_path(digest)
+    try:
+        with Image.open(source) as image:
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        return 0
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+    total = 0
+    for width in [None] + [w for w in texture_widths() if w < image.width]:
+        if width is None:
+            frame, size = image, source.stat().st_size
+        else:
+            frame = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            data = _encode(frame, fmt)
+            write_derived(texture_path(digest, width, suffix), data)
+            size = len(data)
+            total += size
+        webp = _encode(frame, "WEBP")
+        if len(webp) < size:
+            write_derived(texture_path(digest, width, "webp"), webp)
+            total += len(webp)
+    return total
+
+
+def ensure_variants(digest: str, content_type: str) -> None:
+    """Generate a texture's variants once; a no-op without Pillow."""
+    if Image is None or theme_index.image_size(digest) is not None:
+        return
+    with single_flight(f"images:{digest}"):
+        if theme_index.image_size(digest) is None:
+            theme_index.set_image_size(digest, generate(digest, content_type))
+
+
+def _work() -> None:
+    global _worker
+    while True:
+        with _pending_lock:
+            if not _pending:
+                _worker = None
+                return
+            digest, content_type = next(iter(_pending.items()))
+        try:
+            ensure_variants(digest, content_type)
+        except Exception:
+            pass  # e.g. evicted meanwhile; a later request queues it again
+        finally:
+            with _pending_lock:
+                _pending.pop(digest, None)
+
+
+def schedule_variants(digest: str, content_type: str) -> None:
+    """Generate a texture's variants on a background thread of this process.
+
+    For textures cached by the proxy rather than a theme load job; requests
+    get the original until the variants exist.
+    """
+    global _worker
+    if Image is None:
+        return
+    with _pending_lock:
+        if digest in _pending:
+            return
+        _pending[digest] = content_type
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="dice-theme-textures", daemon=True)
+            _worker.start()
+
+
+def requested_width(request) -> int | None:
+    """Display width asked for by ``?w=``, a width client hint, or ``Save-Data`` (smallest)."""
+    for value in (request.GET.get("w"), request.headers.get("Sec-CH-Width"), request.headers.get("Width")):
+        if value and value.isdigit():
+            return int(value)
+    if request.headers.get("Save-Data", "").lower() == "on":
+        return texture_widths()[0]
+    return None
+
+
+def wants_webp(request) -> bool:
+    fmt = request.GET.get("format")
+    if fmt:
+        return fmt.lower() == "webp"
+    return parse_qvalues(request.headers.get("Accept", "")).get(WEBP_TYPE, 0.0) > 0
+
+
+def choose_texture(request, digest: str, content_type: str) -> tuple[Path, str, str]:
+    """Pick the stored texture variant for a request: ``(path, content type, ETag tag)``.
+
+    The smallest configured width covering the requested one is used, WebP when
+    accepted; anything not generated falls back to the next candidate and
+    finally to the original blob (empty tag). Variants are never generated
+    here: until they are, the original is served and generation is queued.
+    """
+    if theme_index.image_size(digest) is None:
+        schedule_variants(digest, content_type)
+        return blob_path(digest), content_type, ""
+    suffix = TEXTURE_FORMATS[content_type][1]
+    wanted = requested_width(request)
+    widths = [w for w in texture_widths() if wanted is not None and w >= wanted][:1]
+    webp = wants_webp(request)
+    for width in widths + [None]:
+        for fmt_suffix, fmt_type in ([("webp", WEBP_TYPE)] if webp else []) + [(suffix, content_type)]:
+            if width is None and fmt_suffix == suffix:
+                break
+            path = texture_path(digest, width, fmt_suffix)
+            if path.is_file():
+                return path, fmt_type, path.name[len(digest) + 1:]
+    return blob_path(digest), content_type, ""
@@ -0,0 +1,451 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .theme_cache import (
+    LOCK_DIRNAME,
+    TEMP_PREFIX,
+    adopt_blob,
+    blob_dir,
+    blob_path,
+    cache_root,
+    file_digest,
+    is_compressible,
+    write_blob,
+    write_variants,
+)
+
+# The index lives next to the files it describes (not in the app database), so
+# wiping MEDIA_ROOT wipes both and every process sharing the cache sees one index.
+INDEX_NAME = ".index.sqlite3"
+# Access times are only written when older than this, so hot assets do not
+# turn every proxy hit into a write.
+TOUCH_INTERVAL = 60.0
+
+_touched: dict[str, float] = {}
+_touched_lock = threading.Lock()
+
+# Columns added after the first release of the index: (user_version, table, column definitions).
+_UPGRADES = [
+    (1, "manifest", ["etag TEXT NOT NULL DEFAULT ''", "last_modified TEXT NOT NULL DEFAULT ''", "checked REAL NOT NULL DEFAULT 0"]),
+    (2, "blobs", ["gzip_size INTEGER NOT NULL DEFAULT 0", "br_size INTEGER NOT NULL DEFAULT 0"]),
+    (3, "blobs", ["image_size INTEGER NOT NULL DEFAULT -1"]),
+]
+# Bytes a blob occupies on disk, including every file derived from it.
+STORED_SIZE = "(size + gzip_size + br_size + max(image_size, 0))"
+
+
+_local = threading.local()
+# Index files (path, device, inode) whose schema this process already set up.
+_ready: set[tuple[str, int, int]] = set()
+_ready_lock = threading.Lock()
+
+
+def _file_id(path: Path) -> tuple[str, int, int] | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return str(path), stat.st_dev, stat.st_ino
+
+
+def _setup(conn: sqlite3.Connection) -> None:
+    """Create the tables and apply pending column upgrades."""
+    conn.execute("PRAGMA journal_mode=WAL")
+    # blobs: one row per stored file (content hash) with the sizes of its compressed
+    # variants and texture variants (-1: not generated yet, 0: none);
+    # manifest: per-theme path -> hash plus the upstream validators it was fetched with.
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL,"
+        " gzip_size INTEGER NOT NULL DEFAULT 0, br_size INTEGER NOT NULL DEFAULT 0,"
+        " image_size INTEGER NOT NULL DEFAULT -1)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS manifest ("
+        " theme TEXT NOT NULL, path TEXT NOT NULL, hash TEXT NOT NULL, etag TEXT NOT NULL DEFAULT '',"
+        " last_modified TEXT NOT NULL DEFAULT '', checked REAL NOT NULL DEFAULT 0, PRIMARY KEY (theme, path))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS manifest_hash ON manifest (hash)")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, table, definitions in _UPGRADES:
+        if version >= target:
+            continue
+        with conn:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for definition in definitions:
+                if definition.split()[0] not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+            conn.execute(f"PRAGMA user_version = {target}")
+
+
+def _connect() -> sqlite3.Connection:
+    """This thread's connection to the index.
+
+    Connections are kept per thread and reopened only when the index file is
+    replaced (a new MEDIA_ROOT, the cache wiped) or after a fork; the schema is
+    set up once per process and index file. Used as ``with _connect() as conn``,
+    which rolls back a failed transaction but leaves the connection open.
+    """
+    path = cache_root() / INDEX_NAME
+    file_id = _file_id(path)
+    cached = getattr(_local, "conn", None)
+    if cached is not None and file_id is not None and cached[0] == (file_id, os.getpid()):
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+        _local.conn = None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    file_id = _file_id(path)
+    with _ready_lock:
+        if file_id not in _ready:
+            _setup(conn)
+            _ready.add(file_id)
+    _local.conn = ((file_id, os.getpid()), conn)
+    return conn
+
+
+class Entry(NamedTuple):
+    digest: str
+    etag: str
+    last_modified: str
+    checked: float
+
+
+def lookup(theme: str, path: str) -> Entry | None:
+    """Manifest entry for ``path`` in ``theme``: content hash plus upstream validators."""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT hash, etag, last_modified, checked FROM manifest WHERE theme = ? AND path = ?", [theme, path]
+        ).fetchone()
+    return Entry(*row) if row else None
+
+
+def resolve(theme: str, path: str) -> str | None:
+    """Content hash stored for ``path`` in ``theme``'s manifest, if any."""
+    entry = lookup(theme, path)
+    return entry.digest if entry else None
+
+
+def manifest(theme: str) -> dict[str, str]:
+    with _connect() as conn:
+        return dict(conn.execute("SELECT path, hash FROM manifest WHERE theme = ? ORDER BY path", [theme]).fetchall())
+
+
+def record(
+    theme: str,
+    path: str,
+    digest: str,
+    size: int,
+    accessed: float | None = None,
+    etag: str = "",
+    last_modified: str = "",
+) -> list[str]:
+    """Point ``theme``/``path`` at a stored blob and evict down to quota. Returns evicted hashes.
+
+    ``etag``/``last_modified`` are the upstream validators used to revalidate the
+    entry later. Compressible assets get their precompressed variants here.
+    """
+    now = time.time() if accessed is None else accessed
+    variants = write_variants(digest) if is_compressible(path) else {}
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO blobs (hash, size, accessed, gzip_size, br_size) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(hash) DO UPDATE SET accessed = max(accessed, excluded.accessed), "
+            "gzip_size = max(gzip_size, excluded.gzip_size), br_size = max(br_size, excluded.br_size)",
+            [digest, size, now, variants.get("gzip", 0), variants.get("br", 0)],
+        )
+        conn.execute(
+            "INSERT INTO manifest (theme, path, hash, etag, last_modified, checked) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(theme, path) DO UPDATE SET hash = excluded.hash, etag = excluded.etag, "
+            "last_modified = excluded.last_modified, checked = excluded.checked",
+            [theme, path, digest, etag, last_modified, now],
+        )
+        with _touched_lock:
+            _touched[digest] = now
+        return _enforce(conn, keep=digest)
+
+
+def store(theme: str, path: str, data: bytes) -> str:
+    """Store ``data`` as ``theme``/``path``; returns its content hash."""
+    with write_blob() as blob:
+        blob.write(data)
+    record(theme, path, blob.digest, blob.size)
+    return blob.digest
+
+
+def mark_checked(theme: str, path: str) -> None:
+    """Upstream confirmed the entry is unchanged (304); restart its freshness lifetime."""
+    with _connect() as conn:
+        conn.execute("UPDATE manifest SET checked = ? WHERE theme = ? AND path = ?", [time.time(), theme, path])
+
+
+def forget(theme: str, path: str) -> None:
+    with _connect() as conn:
+        conn.execute("DELETE FROM manifest WHERE theme = ? AND path = ?", [theme, path])
+
+
+def _derived_size(digest: str, column: str) -> int | None:
+    with _connect() as conn:
+        row = conn.execute(f"SELECT {column} FROM blobs WHERE hash = ?", [digest]).fetchone()
+    return row[0] if row and row[0] >= 0 else None
+
+
+def _set_derived_size(digest: str, column: str, size: int) -> list[str]:
+    with _connect() as conn:
+        conn.execute(f"UPDATE blobs SET {column} = ? WHERE hash = ?", [size, digest])
+        return _enforce(conn, keep=digest)
+
+
+def image_size(digest: str) -> int | None:
+    """Total size of the blob's texture variants; ``None`` if not generated yet."""
+    return _derived_size(digest, "image_size")
+
+
+def set_image_size(digest: str, size: int) -> list[str]:
+    """Record the texture variants written for ``digest`` and evict down to quota."""
+    return _set_derived_size(digest, "image_size", size)
+
+
+def touch(digest: str) -> None:
+    """Note a read of a blob for LRU ordering (rate limited per blob and process)."""
+    now = time.time()
+    with _touched_lock:
+        if now - _touched.get(digest, 0.0) < TOUCH_INTERVAL:
+            return
+        _touched[digest] = now
+    with _connect() as conn:
+        conn.execute("UPDATE blobs SET accessed = ? WHERE hash = ?", [now, digest])
+
+
+def _limits() -> tuple[int | None, int | None]:
+    return (
+        getattr(settings, "DICE_THEME_CACHE_MAX_BYTES", None),
+        getattr(settings, "DICE_THEME_CACHE_MAX_FILES", None),
+    )
+
+
+def _over(total_bytes: int, total_files: int, max_bytes: int | None, max_files: int | None) -> bool:
+    return (max_bytes is not None and total_bytes > max_bytes) or (max_files is not None and total_files > max_files)
+
+
+def _evict(conn: sqlite3.Connection, digest: str) -> None:
+    # Unlinking is safe for in-flight responses: they stream from an already
+    # open file handle, which stays readable until closed.
+    path = blob_path(digest)
+    path.unlink(missing_ok=True)
+    # Derived files: <hash>.gz, <hash>.br, <hash>.512.webp, ...
+    for derived in path.parent.glob(f"{digest}.*"):
+        derived.unlink(missing_ok=True)
+    conn.execute("DELETE FROM manifest WHERE hash = ?", [digest])
+    conn.execute("DELETE FROM blobs WHERE hash = ?", [digest])
+    with _touched_lock:
+        _touched.pop(digest, None)
+
+
+def _enforce(
+    conn: sqlite3.Connection, max_bytes: int | None = None, max_files: int | None = None, keep: str | None = None
+) -> list[str]:
+    if max_bytes is None and max_files is None:
+        max_bytes, max_files = _limits()
+    total_bytes, total_files = conn.execute(f"SELECT COALESCE(SUM({STORED_SIZE}), 0), COUNT(*) FROM blobs").fetchone()
+    if not _over(total_bytes, total_files, max_bytes, max_files):
+        return []
+    evicted = []
+    for digest, size in conn.execute(f"SELECT hash, {STORED_SIZE} FROM blobs ORDER BY accessed, hash").fetchall():
+        if not _over(total_bytes, total_files, max_bytes, max_files):
+            break
+        if digest == keep:
+            continue
+        _evict(conn, digest)
+        evicted.append(digest)
+        total_bytes -= size
+        total_files -= 1
+    return evicted
+
+
+def enforce_quota(max_bytes: int | None = None, max_files: int | None = None) -> list[str]:
+    """Evict least recently used blobs until within quota (defaults to the settings)."""
+    with _connect() as conn:
+        return _enforce(conn, max_bytes, max_files)
+
+
+@dataclass
+class ThemeUsage:
+    theme: str
+    files: int
+    bytes: int
+    last_access: float
+    # Bytes a compression-capable client saves downloading the whole theme.
+    compressed_savings: int = 0
+
+
+def usage() -> list[ThemeUsage]:
+    """Per-theme file count and logical size (shared blobs count for every theme using them)."""
+    best = (
+        "min(b.size, CASE WHEN b.gzip_size > 0 THEN b.gzip_size ELSE b.size END,"
+        " CASE WHEN b.br_size > 0 THEN b.br_size ELSE b.size END)"
+    )
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT m.theme, COUNT(*), SUM(b.size), MAX(b.accessed), SUM(b.size - {best}) "
+            "FROM manifest m JOIN blobs b ON b.hash = m.hash GROUP BY m.theme ORDER BY SUM(b.size) DESC"
+        ).fetchall()
+    return [ThemeUsage(*row) for row in rows]
+
+
+@dataclass
+class DedupStats:
+    files: int
+    blobs: int
+    logical_bytes: int
+    stored_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        """Logical bytes per stored byte; 2.0 means dedup halves the disk use."""
+        return self.logical_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+
+def dedup_stats() -> DedupStats:
+    with _connect() as conn:
+        files, logical = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(b.size), 0) FROM manifest m JOIN blobs b ON b.hash = m.hash"
+        ).fetchone()
+        blobs, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+    return DedupStats(files, blobs, logical, stored)
+
+
+def _disk_blobs() -> dict[str, int]:
+    root = blob_dir()
+    if not root.is_dir():
+        return {}
+    return {
+        path.name: path.stat().st_size
+        for path in root.glob("*/*")
+        # Variants (<hash>.gz) and temp files are not blobs of their own.
+        if path.is_file() and "." not in path.name
+    }
+
+
+@dataclass
+class VerifyReport:
+    untracked: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    corrupt: list[str] = field(default_factory=list)
+    dangling: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.untracked or self.missing or self.corrupt or self.dangling)
+
+
+def verify(fix: bool = False) -> VerifyReport:
+    """Check the index against the blob store and every blob against its hash.
+
+    With ``fix``: untracked blobs are adopted (mtime as last access), corrupt
+    ones deleted, and rows for missing blobs and dangling manifest entries dropped.
+    """
+    report = VerifyReport()
+    disk = _disk_blobs()
+    with _connect() as conn:
+        indexed = dict(conn.execute("SELECT hash, size FROM blobs").fetchall())
+        for digest in sorted(disk):
+            path = blob_path(digest)
+            if file_digest(path) != digest:
+                report.corrupt.append(digest)
+                if fix:
+                    _evict(conn, digest)
+            elif digest not in indexed:
+                report.untracked.append(digest)
+                if fix:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO blobs (hash, size, accessed) VALUES (?, ?, ?)",
+                        [digest, disk[digest], path.stat().st_mtime],
+                    )
+        for digest in sorted(indexed.keys() - disk.keys()):
+            report.missing.append(digest)
+            if fix:
+                _evict(conn, digest)
+        for theme, path in conn.execute(
+            "SELECT theme, path FROM manifest WHERE hash NOT IN (SELECT hash FROM blobs) ORDER BY theme, path"
+        ).fetchall():
+            report.dangling.append(f"{theme}/{path}")
+            if fix:
+                conn.execute("DELETE FROM manifest WHERE theme = ? AND path = ?", [theme, path])
+    return report
+
+
+def prune(max_age: float | None = None, temp_age: float = 3600.0) -> dict[str, int]:
+    """Reconcile the index, drop blobs idle for ``max_age`` seconds or no longer in any manifest,
+    apply the quota and remove temp and lock files older than ``temp_age``.
+    """
+    verify(fix=True)
+    now = time.time()
+    stats = {"expired": 0, "unreferenced": 0, "evicted": 0, "temp_files": 0, "lock_files": 0}
+    with _connect() as conn:
+        if max_age is not None:
+            for (digest,) in conn.execute("SELECT hash FROM blobs WHERE accessed < ?", [now - max_age]).fetchall():
+                _evict(conn, digest)
+                stats["expired"] += 1
+        for (digest,) in conn.execute(
+            "SELECT hash FROM blobs WHERE hash NOT IN (SELECT hash FROM manifest)"
+        ).fetchall():
+            _evict(conn, digest)
+            stats["unreferenced"] += 1
+        stats["evicted"] = len(_enforce(conn))
+    # Lock files are never removed after use; dropping one nobody holds is
+    # safe, as single_flight() re-checks the file it locked is still in place.
+    for kind, stale in (
+        ("temp_files", blob_dir().glob(TEMP_PREFIX + "*")),
+        ("lock_files", (cache_root() / LOCK_DIRNAME).glob("*.lock")),
+    ):
+        for path in stale:
+            try:
+                if now - path.stat().st_mtime > temp_age:
+                    path.unlink()
+                    stats[kind] += 1
+            except FileNotFoundError:
+                pass
+    return stats
+
+
+def migrate_legacy() -> dict[str, int]:
+    """Convert pre-dedup ``dice_theme_cache/<theme>/<path>`` folders into blobs and manifests, in place.
+
+    Files are moved (not copied) into the store, duplicates are deleted, and
+    the emptied theme folders removed. Safe to run repeatedly.
+    """
+    root = cache_root()
+    stats = {"files": 0, "blobs": 0, "duplicates": 0}
+    if not root.is_dir():
+        return stats
+    with _connect() as conn:
+        conn.execute("DROP TABLE IF EXISTS entries")
+    for theme in sorted(root.iterdir()):
+        if theme.name.startswith(".") or not theme.is_dir():
+            continue
+        for path in sorted(p for p in theme.rglob("*") if p.is_file()):
+            if path.name.startswith(TEMP_PREFIX):
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            digest = file_digest(path)
+            rel = path.relative_to(theme).as_posix()
+            stats["files"] += 1
+            stats["blobs" if adopt_blob(path, digest) else "duplicates"] += 1
+            record(theme.name, rel, digest, stat.st_size, accessed=stat.st_mtime)
+        for folder in sorted((p for p in theme.rglob("*") if p.is_dir()), reverse=True) + [theme]:
+            try:
+                folder.rmdir()
+            except OSError:
+                pass
+    return stats
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import json
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import theme_cache, theme_fetch, theme_images
+from .models import ThemeJob
+from .theme_cache import CONFIG_FILE
+
+_wakeup = threading.Event()
+_worker: threading.Thread | None = None
+_worker_lock = threading.Lock()
+
+
+def enqueue(base_url: str, config_cached: bool = False) -> tuple[ThemeJob, bool]:
+    """Queue a download of the theme at ``base_url``; returns ``(job, created)``.
+
+    A load of the same theme that is still queued or running is returned
+    instead of starting another one. With ``config_cached`` the config was
+    just validated into the cache, so the job starts from it instead of
+    fetching it again.
+    """
+    theme = theme_cache.encode_base(base_url)
+    for _attempt in range(2):
+        job = ThemeJob.objects.filter(theme=theme, status__in=ThemeJob.ACTIVE).first()
+        if job is not None:
+            return job, False
+        try:
+            with transaction.atomic():
+                config = {"state": "ok", "bytes": 0, "ms": 0.0} if config_cached else {"state": "pending"}
+                job = ThemeJob.objects.create(theme=theme, base_url=base_url, assets={CONFIG_FILE: config})
+        except IntegrityError:
+            continue  # a concurrent request queued it first
+        transaction.on_commit(wake)
+        return job, True
+    return ThemeJob.objects.filter(theme=theme).latest("pk"), False
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before retry number ``attempt`` (1-based): doubling, capped."""
+    delay = getattr(settings, "DICE_THEME_JOB_RETRY_DELAY", 5) * 2 ** (attempt - 1)
+    return min(delay, getattr(settings, "DICE_THEME_JOB_MAX_RETRY_DELAY", 300))
+
+
+def claim() -> ThemeJob | None:
+    """Take the next runnable job, or one whose runner stopped reporting progress.
+
+    The compare-and-set update makes this safe across threads and processes.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, "DICE_THEME_JOB_STALE_SECONDS", 300))
+    ready = Q(status=ThemeJob.QUEUED, run_after__lte=now) | Q(status=ThemeJob.RUNNING, updated__lt=stale)
+    for job in ThemeJob.objects.filter(ready).order_by("run_after", "pk")[:5]:
+        claimed = ThemeJob.objects.filter(pk=job.pk, status=job.status, updated=job.updated).update(
+            status=ThemeJob.RUNNING, attempts=F("attempts") + 1, updated=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _save(job: ThemeJob, **fields) -> None:
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=[*fields, "updated"])
+
+
+def _record(job: ThemeJob, result: theme_fetch.AssetResult) -> None:
+    state = {"state": "ok" if result.ok else "failed", "bytes": result.bytes, "ms": result.ms}
+    if not result.ok:
+        state.update(error=result.error, status=result.status)
+    job.assets[result.path] = state
+    _save(job, assets=job.assets)
+
+
+def _finish(job: ThemeJob, error: str, retryable: bool) -> None:
+    """Re-queue with backoff while a failure may be transient and attempts remain, else close the job."""
+    if error and retryable and job.attempts < getattr(settings, "DICE_THEME_JOB_MAX_ATTEMPTS", 4):
+        _save(
+            job,
+            status=ThemeJob.QUEUED,
+            error=error,
+            run_after=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+        )
+        return
+    failed = [path for path, asset in job.assets.items() if asset.get("state") != "ok"]
+    if job.assets.get(CONFIG_FILE, {}).get("state") != "ok":
+        status = ThemeJob.FAILED
+    else:
+        status = ThemeJob.PARTIAL if failed else ThemeJob.SUCCEEDED
+    _save(job, status=status, error=error, finished=timezone.now())
+
+
+def run(job: ThemeJob) -> None:
+    """Download a claimed job's theme, saving per-asset progress as each file lands.
+
+    Assets cached by an earlier attempt are not fetched again. Failures other
+    than upstream 404s re-queue the job with exponential backoff.
+    """
+    try:
+        if job.assets.get(CONFIG_FILE, {}).get("state") != "ok":
+            _record(job, theme_fetch.fetch_assets(job.base_url, [CONFIG_FILE], job.theme)[0])
+        config = job.assets[CONFIG_FILE]
+        if config["state"] != "ok":
+            _finish(job, f"Failed to load theme.config.json: {config['error']}", config.get("status") != 404)
+            return
+        digest = theme_fetch.cached_digest(job.theme, CONFIG_FILE)
+        if digest is None:
+            job.assets[CONFIG_FILE] = {"state": "pending"}  # fetch it again on the retry
+            _save(job, assets=job.assets)
+            raise ValueError("theme.config.json left the cache")
+        cfg = json.loads(theme_cache.blob_path(digest).read_text("utf-8"))
+        assets = [theme_cache.safe_relpath(rel) for rel in theme_cache.config_assets(cfg)[1:]]
+        for rel in assets:
+            job.assets.setdefault(rel, {"state": "pending"})
+        _save(job, assets=job.assets)
+        todo = [rel for rel in assets if job.assets[rel]["state"] != "ok" and job.assets[rel].get("status") != 404]
+        for result in theme_fetch.iter_assets(job.base_url, todo, job.theme):
+            _record(job, result)
+            if not result.ok:
+                continue
+            # Derive texture variants now so the first request does not pay for them.
+            content_type = theme_cache.content_type_for(result.path)
+            if theme_images.is_texture(content_type):
+                theme_images.ensure_variants(result.digest, content_type)
+    except Exception as e:
+        _finish(job, f"Theme job failed: {e}", True)
+        return
+    failed = {rel: asset for rel, asset in job.assets.items() if asset["state"] != "ok"}
+    error = f"{len(failed)} asset(s) failed: {', '.join(failed)}" if failed else ""
+    _finish(job, error, any(asset.get("status") != 404 for asset in failed.values()))
+
+
+def run_pending(limit: int | None = None) -> int:
+    """Run runnable jobs until none is left (or ``limit`` ran); returns how many ran."""
+    done = 0
+    while limit is None or done < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+def work(stop: threading.Event | None = None, poll: float = 1.0) -> None:
+    """Run jobs until ``stop`` is set, waking on :func:`wake` or every ``poll`` seconds for retries."""
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        try:
+            run_pending()
+        except Exception:
+            pass  # e.g. the database is briefly unavailable; try again on the next wake-up
+        _wakeup.wait(poll)
+        _wakeup.clear()
+
+
+def wake() -> None:
+    """Nudge the runner; with ``DICE_THEME_JOB_RUNNER = "thread"`` start it in this process if needed."""
+    global _worker
+    if getattr(settings, "DICE_THEME_JOB_RUNNER", "thread") == "thread":
+        with _worker_lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=work, name="dice-theme-jobs", daemon=True)
+                _worker.start()
+    _wakeup.set()
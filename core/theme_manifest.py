@@ -0,0 +1,83 @@
+"""Per-user resolved dice theme: the user's dice settings mapped to versioned asset URLs.
+
+A cached external theme is addressed under ``/dice-theme-v/<base_b64>/<version>/``
+where the version is a hash over every cached file of the theme.
+Those URLs never change content, so they are served as immutable; the
+manifest itself changes only when the settings or the theme's content do.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+
+from django.urls import reverse
+
+from . import theme_cache, theme_config, theme_index
+
+# Versioned URLs embed the theme version, so a response never changes.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _config_color(digest: str) -> str | None:
+    """``themeColor`` of a cached theme.config.json blob, if it is a valid config."""
+    color = theme_config.parse(digest)[0].get("themeColor")
+    return color if isinstance(color, str) else None
+
+
+def theme_files(theme: str) -> dict[str, str] | None:
+    """Cached ``{path: hash}`` of a theme, config first, or None if its config is not cached."""
+    entries = theme_index.manifest(theme)
+    if theme_cache.CONFIG_FILE not in entries:
+        return None
+    return {theme_cache.CONFIG_FILE: entries.pop(theme_cache.CONFIG_FILE), **entries}
+
+
+def theme_version(files: dict[str, str]) -> str:
+    """Content hash of a theme's files: changes whenever any file or path does."""
+    digest = hashlib.sha256()
+    for path, blob in sorted(files.items()):
+        digest.update(f"{path}\0{blob}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def _base_url(name: str, *args: str) -> str:
+    """Folder URL DiceBox loads a theme from: the route's config URL without the file name."""
+    return reverse(name, args=[*args, theme_cache.CONFIG_FILE]).rsplit("/", 1)[0]
+
+
+def resolve_theme(url: str) -> dict:
+    """Addresses of the external theme at ``url``.
+
+    Cached themes get a versioned ``base_url`` and per-asset URLs; otherwise
+    ``base_url`` is the mutable proxy, which caches the theme as DiceBox loads it.
+    """
+    theme = theme_cache.theme_key(url)
+    files = theme_files(theme)
+    if files is None:
+        return {
+            "cached": False,
+            "base_b64": theme,
+            "base_url": _base_url("core:dice_theme_proxy", theme),
+        }
+    version = theme_version(files)
+    return {
+        "cached": True,
+        "base_b64": theme,
+        "version": version,
+        "base_url": _base_url("core:dice_theme_versioned", theme, version),
+        "assets": {path: reverse("core:dice_theme_versioned", args=[theme, version, path]) for path in files},
+        "themeColor": _config_color(files[theme_cache.CONFIG_FILE]),
+    }
+
+
+def user_manifest(user) -> dict:
+    """The user's dice settings with their theme resolved; ``version`` hashes all of it."""
+    data = {
+        "preset": user.dice_preset,
+        "finish": user.dice_finish,
+        "externalThemeUrl": user.dice_external_theme_url,
+        "theme": resolve_theme(user.dice_external_theme_url) if user.dice_external_theme_url else None,
+    }
+    data["version"] = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:32]
+    return data
@@ -1,13 +1,33 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = "core"
 
+# Under ASGI the upstream-bound dice theme views run as coroutines (see config/asgi.py).
+if getattr(settings, "DICE_THEME_ASYNC_VIEWS", False):
+    dice_theme_proxy, dice_theme_test, dice_theme_load = (
+        views.dice_theme_proxy_async,
+        views.dice_theme_test_async,
+        views.dice_theme_load_async,
+    )
+else:
+    dice_theme_proxy, dice_theme_test, dice_theme_load = (
+        views.dice_theme_proxy,
+        views.dice_theme_test,
+        views.dice_theme_load,
+    )
+
 urlpatterns =[
     path("", views.home, name="home"),
     path("features/create/", views.feat_create, name="feat_create"),
-    path("dice-theme/<str:base_b64>/<path:res_path>", views.dice_theme_proxy, name="dice_theme_proxy"),
-    path("api/dice-theme/test", views.dice_theme_test, name="dice_theme_test"),
-    path("api/dice-theme/load", views.dice_theme_load, name="dice_theme_load"),
+    path("dice-theme/<str:base_b64>/<path:res_path>", dice_theme_proxy, name="dice_theme_proxy"),
+    path("dice-theme-v/<str:base_b64>/<str:version>/<path:res_path>", views.dice_theme_versioned, name="dice_theme_versioned"),
+    path("api/dice-theme/test", dice_theme_test, name="dice_theme_test"),
+    path("api/dice-theme/load", dice_theme_load, name="dice_theme_load"),
+    path("api/dice-theme/manifest", views.dice_theme_manifest, name="dice_theme_manifest"),
+    path("api/dice-theme/jobs/<int:job_id>", views.dice_theme_job, name="dice_theme_job"),
+    path("api/dice-theme/stats", views.dice_theme_stats, name="dice_theme_stats"),
     path("api/search", views.creation_search, name="creation_search"),
+    path("api/search/stats", views.creation_search_stats, name="creation_search_stats"),
 ]
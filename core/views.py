@@ -1,14 +1,20 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.http import condition
 from django.contrib import messages
-import base64
+import asyncio
+import json
 from urllib.parse import urlparse
-import urllib.request
-import urllib.error
 
+from . import search, theme_cache, theme_config, theme_fetch, theme_async_http, theme_http, theme_images, theme_index, theme_jobs, theme_manifest, typeahead
+from .catalog import catalog_versions
 from .forms import FeatForm
-from .models import Feat, Spell, Item, Language, Skill
+from .models import ThemeJob
 
 
 @login_required
@@ -29,176 +35,234 @@ def feat_create(request):
     return render(request, "feat_form.html", {"form": form, "title": "Create Feature"})
 
 
+def _search_etag(request):
+    q = search.normalize_query(request.GET.get("q", ""))
+    if not q:
+        return None
+    backend = "trigram" if typeahead.enabled() else "fts"
+    request.search_etag = search.search_etag(q, catalog_versions(), backend)
+    if request.search_etag in request.headers.get("If-None-Match", ""):
+        search.count("not_modified")
+    return request.search_etag
+
+
 @login_required
+@condition(etag_func=_search_etag)
 def creation_search(request):
-    q = request.GET.get("q", "")
-    results = []
-    if q:
-        lookups = [
-            ("feat", Feat.objects.filter(name__icontains=q)[:5]),
-            ("spell", Spell.objects.filter(name__icontains=q)[:5]),
-            ("item", Item.objects.filter(name__icontains=q)[:5]),
-            ("language", Language.objects.filter(name__icontains=q)[:5]),
-            ("skill", Skill.objects.filter(name__icontains=q)[:5]),
-        ]
-        for model_name, qs in lookups:
-            for obj in qs:
-                results.append({"model": model_name, "id": obj.id, "name": obj.name})
-    return JsonResponse({"results": results})
-
-
-def _transform_github_base(url: str) -> str:
-    """Convert common GitHub folder URLs into raw file URLs.
-
-    Accepts formats like:
-      https://github.com/user/repo/tree/branch/path/to/theme
-    and returns:
-      https://raw.githubusercontent.com/user/repo/branch/path/to/theme
-    Other hosts are returned unchanged.
-    """
-    try:
-        p = urlparse(url)
-        if p.netloc == "github.com":
-            parts = [seg for seg in p.path.strip("/").split("/") if seg]
-            # user/repo/tree/branch/optional/path
-            if len(parts) >= 4 and parts[2] == "tree":
-                user, repo, _tree, branch = parts[:4]
-                rest = "/".join(parts[4:])
-                base = f"https://raw.githubusercontent.com/{user}/{repo}/{branch}"
-                return base + (f"/{rest}" if rest else "")
-        return url
-    except Exception:
-        return url
+    q = search.normalize_query(request.GET.get("q", ""))
+    if not q:
+        return JsonResponse({"results": []})
+    etag = request.search_etag
+    results = search.cache_get(etag)
+    if results is not None:
+        search.count("hits")
+    else:
+        search.count("misses")
+        if typeahead.enabled():
+            results = typeahead.index.search(q)
+        if results is None:
+            results = search.search_catalog(q)
+        search.cache_set(etag, results)
+    resp = JsonResponse({"results": results})
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
 
 
-def dice_theme_proxy(request, base_b64: str, res_path: str):
-    """Proxy DiceBox theme assets, rewriting GitHub URLs to raw content and
-    serving with correct content-type for DiceBox.
+@login_required
+def creation_search_stats(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Staff only")
+    return JsonResponse(search.cache_stats())
 
-    Route: /dice-theme/<base_b64>/<res_path>
-    Where base_b64 is a URL-safe base64 of the theme base URL (folder containing theme.config.json).
-    """
-    # Decode base64 urlsafe without padding
-    padded = base_b64 + "=" * ((4 - len(base_b64) % 4) % 4)
-    try:
-        base_url = base64.urlsafe_b64decode(padded.encode()).decode()
-    except Exception:
+
+@login_required
+def dice_theme_stats(request):
+    if not request.user.is_staff:
+        return HttpResponseForbidden("Staff only")
+    return JsonResponse({"http": theme_http.pool.stats(), "http_async": theme_async_http.pool.stats()})
+
+
+def _proxy_target(base_b64: str, res_path: str):
+    """``(theme, safe path, remote URL)`` of a proxied asset, or an error response."""
+    base_url = theme_cache.decode_base(base_b64)
+    if base_url is None:
         return HttpResponseBadRequest("Invalid base URL")
 
-    base_url = _transform_github_base(base_url)
+    base_url = theme_cache.transform_github_base(base_url)
     # Allow only http(s)
     parsed = urlparse(base_url)
     if parsed.scheme not in ("http", "https"):
         return HttpResponseBadRequest("Unsupported scheme")
 
     # Construct remote URL, but serve from local cache if present
-    safe_res = "/".join([p for p in res_path.split('/') if p not in ("..", "")])
-    from django.conf import settings
-    cache_root = settings.MEDIA_ROOT / "dice_theme_cache" / base_b64
-    local_path = cache_root / safe_res
-    if local_path.exists() and local_path.is_file():
-        ext = safe_res.rsplit(".", 1)[-1].lower() if "." in safe_res else ""
-        ct_map = {
-            "json": "application/json",
-            "png": "image/png",
-            "jpg": "image/jpeg",
-            "jpeg": "image/jpeg",
-            "webp": "image/webp",
-            "wasm": "application/wasm",
-            "js": "application/javascript",
-            "gif": "image/gif",
-            "svg": "image/svg+xml",
-        }
-        content_type = ct_map.get(ext, "application/octet-stream")
-        with open(local_path, "rb") as fh:
-            data = fh.read()
-        resp = HttpResponse(data, content_type=content_type)
-        resp["Cache-Control"] = "public, max-age=604800"
-        resp["Access-Control-Allow-Origin"] = "*"
-        return resp
-
-    remote = base_url.rstrip("/") + "/" + safe_res.lstrip("/")
-
-    req = urllib.request.Request(
-        remote,
-        headers={
-            "User-Agent": "better5e-dice-proxy/1.0",
-            "Accept": "application/json, image/*, */*",
-            "Cache-Control": "no-cache",
-        },
+    safe_res = theme_cache.safe_relpath(res_path)
+    return theme_cache.encode_base(base_url), safe_res, base_url.rstrip("/") + "/" + safe_res
+
+
+def _upstream_error(e: theme_fetch.UpstreamError) -> HttpResponse:
+    if e.status == 404:
+        return HttpResponseNotFound("Not found")
+    resp = HttpResponse(str(e), status=e.status)
+    if e.retry_after is not None:
+        resp["Retry-After"] = str(max(1, round(e.retry_after)))
+    return resp
+
+
+def _serve_cached_asset(request, digest: str, safe_res: str, async_stream: bool = False, cache_control: str = ""):
+    """Serve the representation of a cached asset the request asks for.
+
+    Precompressed variants are chosen by Accept-Encoding, texture sizes/WebP
+    by query or client hints; each representation has its own ETag. Raises ``FileNotFoundError`` if the file was evicted.
+    """
+    content_type = theme_cache.content_type_for(safe_res)
+    is_texture = theme_images.is_texture(content_type)
+    etag = theme_cache.blob_etag(digest)
+    if is_texture:
+        path, served_type, tag = theme_images.choose_texture(request, digest, content_type)
+        encoding = None
+        if tag:
+            etag = f'{etag[:-1]}-{tag}"'
+    else:
+        path, encoding = theme_cache.choose_variant(request, digest)
+        served_type = content_type
+        if encoding:
+            etag = f'{etag[:-1]}-{encoding}"'
+    resp = theme_cache.serve_file(
+        request,
+        path,
+        served_type,
+        cache_control=cache_control or f"public, max-age={getattr(settings, 'DICE_THEME_CACHE_FRESH_SECONDS', 3600)}",
+        etag=etag,
+        async_stream=async_stream,
     )
-    try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            content = resp.read()
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
-            return HttpResponseNotFound("Not found")
-        return HttpResponse(f"Upstream error {e.code}", status=502)
-    except Exception:
-        return HttpResponse("Upstream fetch failed", status=502)
-
-    # Map content-type by extension
-    ext = res_path.rsplit(".", 1)[-1].lower() if "." in res_path else ""
-    ct_map = {
-        "json": "application/json",
-        "png": "image/png",
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "webp": "image/webp",
-        "wasm": "application/wasm",
-        "js": "application/javascript",
-        "gif": "image/gif",
-        "svg": "image/svg+xml",
-    }
-    content_type = ct_map.get(ext, "application/octet-stream")
+    if encoding and resp.status_code != 304:
+        resp["Content-Encoding"] = encoding
+    if theme_cache.is_compressible(safe_res):
+        patch_vary_headers(resp, ["Accept-Encoding"])
+    elif is_texture:
+        patch_vary_headers(resp, theme_images.TEXTURE_VARY)
+    theme_index.touch(digest)
+    return resp
+
+
+def dice_theme_proxy(request, base_b64: str, res_path: str):
+    """Proxy DiceBox theme assets, rewriting GitHub URLs to raw content and
+    serving with correct content-type for DiceBox.
+
+    Route: /dice-theme/<base_b64>/<res_path>
+    Where base_b64 is a URL-safe base64 of the theme base URL (folder containing theme.config.json).
+    Misses are written through to the local content-addressed cache first;
+    responses stream from disk in chunks, carry the content hash as ETag and
+    answer Range and conditional requests. JSON and similar text assets are
+    served from their precompressed gzip/brotli variant when the client accepts one.
+    PNG/JPEG textures come downscaled with
+    ``?w=<px>`` (or a ``Sec-CH-Width``/``Save-Data`` hint) and as WebP with
+    ``?format=webp`` or ``Accept: image/webp``.
+    """
+    target = _proxy_target(base_b64, res_path)
+    if isinstance(target, HttpResponse):
+        return target
+    theme, safe_res, remote = target
+    for _attempt in range(2):
+        # Write-through and revalidation: concurrent misses share one upstream fetch.
+        try:
+            digest, _size = theme_fetch.fetch_to_cache(remote, theme, safe_res)
+        except theme_fetch.UpstreamError as e:
+            return _upstream_error(e)
+        try:
+            return _serve_cached_asset(request, digest, safe_res)
+        except FileNotFoundError:
+            continue  # evicted between the lookup and the open; fetch again
+    return HttpResponse("Upstream fetch failed", status=502)
+
+
+async def dice_theme_proxy_async(request, base_b64: str, res_path: str):
+    """:func:`dice_theme_proxy` for ASGI.
+
+    Upstream fetches use the asyncio connection pool and the file streams in
+    worker-thread reads, so slow upstreams and large assets do not tie up a
+    thread per request.
+    """
+    target = _proxy_target(base_b64, res_path)
+    if isinstance(target, HttpResponse):
+        return target
+    theme, safe_res, remote = target
+    for _attempt in range(2):
+        try:
+            digest, _size = await theme_fetch.afetch_to_cache(remote, theme, safe_res)
+        except theme_fetch.UpstreamError as e:
+            return _upstream_error(e)
+        try:
+            # Variant selection reads the index and stats files: keep it off the event loop.
+            return await asyncio.to_thread(_serve_cached_asset, request, digest, safe_res, async_stream=True)
+        except FileNotFoundError:
+            continue
+    return HttpResponse("Upstream fetch failed", status=502)
+
 
-    resp = HttpResponse(content, content_type=content_type)
-    resp["Cache-Control"] = "public, max-age=3600"
-    resp["Access-Control-Allow-Origin"] = "*"
+def dice_theme_versioned(request, base_b64: str, version: str, res_path: str):
+    """Serve a cached theme asset under its versioned URL, cacheable for a year as immutable.
+
+    Route: /dice-theme-v/<base_b64>/<version>/<res_path>
+    ``version`` hashes the theme's cached files, so the content behind a URL
+    never changes. Once the cached theme does, old URLs redirect to the current
+    version; assets that are not cached redirect to the proxy.
+    """
+    base_url = theme_cache.decode_base(base_b64)
+    if base_url is None:
+        return HttpResponseBadRequest("Invalid base URL")
+    safe_res = theme_cache.safe_relpath(res_path)
+    files = theme_manifest.theme_files(theme_cache.theme_key(base_url))
+    target = reverse("core:dice_theme_proxy", args=[base_b64, safe_res])
+    if files is not None and safe_res in files:
+        current = theme_manifest.theme_version(files)
+        if current != version:
+            target = reverse("core:dice_theme_versioned", args=[base_b64, current, safe_res])
+        else:
+            try:
+                return _serve_cached_asset(request, files[safe_res], safe_res, cache_control=theme_manifest.IMMUTABLE)
+            except FileNotFoundError:
+                pass  # evicted meanwhile; the proxy fetches it again
+    resp = redirect(target)
+    resp["Cache-Control"] = "no-cache"
     return resp
 
 
 @login_required
-def dice_theme_test(request):
+def dice_theme_manifest(request):
+    """The user's dice settings resolved to theme URLs; see :mod:`core.theme_manifest`.
+
+    Cached external themes are addressed by versioned, immutable URLs, so once
+    loaded a theme costs no revalidation requests until it or the settings
+    change. The manifest itself revalidates by ETag.
+    """
+    manifest = theme_manifest.user_manifest(request.user)
+    etag = f'"{manifest["version"]}"'
+    resp = get_conditional_response(request, etag=etag) or JsonResponse(manifest)
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def _theme_url(request) -> str | None:
     url = request.POST.get("url") or request.GET.get("url")
     if not url and request.body:
         try:
-            import json
             payload = json.loads(request.body.decode("utf-8"))
             url = payload.get("url")
         except Exception:
             url = None
-    if not url:
-        return JsonResponse({"ok": False, "error": "Missing url"}, status=400)
-    base_url = _transform_github_base(url)
-    config_url = base_url.rstrip("/") + "/theme.config.json"
-    req = urllib.request.Request(config_url, headers={"User-Agent": "better5e-dice-proxy/1.0", "Accept": "application/json"})
-    try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            raw = resp.read()
-    except Exception as e:
-        return JsonResponse({"ok": False, "error": f"Fetch failed: {e}"}, status=502)
-    import json
-    try:
-        data = json.loads(raw.decode("utf-8"))
-    except Exception:
-        return JsonResponse({"ok": False, "error": "Invalid JSON in theme.config.json"}, status=400)
-    if "diceAvailable" not in data:
-        return JsonResponse({"ok": False, "error": "Missing diceAvailable in theme.config.json"}, status=400)
+    return url
+
+
+def _theme_test_response(result: theme_config.Validation) -> JsonResponse:
+    cache_info = {"cached": result.cached, "cacheAge": round(result.age, 1)} if result.age is not None else {}
+    if not result.ok:
+        return JsonResponse({"ok": False, "error": result.error, **cache_info}, status=result.status)
+    data = result.config
     mesh = data.get("meshFile", "default.json")
     # Return a small list of expected assets
-    assets = ["theme.config.json", mesh]
-    mat = data.get("material", {})
-    def add_tex(v):
-        if isinstance(v, str) and v:
-            assets.append(v)
-        elif isinstance(v, dict):
-            for val in v.values():
-                if isinstance(val, str) and val:
-                    assets.append(val)
-    add_tex(mat.get("diffuseTexture"))
-    add_tex(mat.get("bumpTexture"))
-    add_tex(mat.get("specularTexture"))
+    assets = result.assets
     mat = data.get("material", {})
     material_type = mat.get("type") if isinstance(mat, dict) else None
     theme_color = data.get("themeColor")
@@ -210,62 +274,100 @@ def dice_theme_test(request):
         "materialType": material_type,
         "themeColor": theme_color,
         "config": data,
+        **cache_info,
     })
 
 
 @login_required
-def dice_theme_load(request):
-    url = request.POST.get("url") or request.GET.get("url")
-    if not url and request.body:
-        try:
-            import json
-            payload = json.loads(request.body.decode("utf-8"))
-            url = payload.get("url")
-        except Exception:
-            url = None
+def dice_theme_test(request):
+    """Validate a theme's config. Results are cached per theme; ``cacheAge`` says how old they are."""
+    url = _theme_url(request)
     if not url:
         return JsonResponse({"ok": False, "error": "Missing url"}, status=400)
-    base_url = _transform_github_base(url)
-    import json
-    def fetch(path):
-        req = urllib.request.Request(path, headers={"User-Agent": "better5e-dice-proxy/1.0", "Accept": "*/*"})
-        with urllib.request.urlopen(req, timeout=15) as r:
-            return r.read()
-    try:
-        cfg_bytes = fetch(base_url.rstrip("/") + "/theme.config.json")
-        cfg = json.loads(cfg_bytes.decode("utf-8"))
-    except Exception as e:
-        return JsonResponse({"ok": False, "error": f"Failed to load theme.config.json: {e}"}, status=502)
-    files = ["theme.config.json"]
-    mesh_file = cfg.get("meshFile", "default.json")
-    files.append(mesh_file)
-    mat = cfg.get("material", {})
-    def add_tex(v):
-        if isinstance(v, str) and v:
-            files.append(v)
-        elif isinstance(v, dict):
-            for val in v.values():
-                if isinstance(val, str) and val:
-                    files.append(val)
-    add_tex(mat.get("diffuseTexture"))
-    add_tex(mat.get("bumpTexture"))
-    add_tex(mat.get("specularTexture"))
-    # Save to local cache folder keyed by base_b64
-    from django.conf import settings
-    base_b64 = base64.urlsafe_b64encode(base_url.encode()).decode().rstrip("=").replace("+", "-").replace("/", "_")
-    cache_root = settings.MEDIA_ROOT / "dice_theme_cache" / base_b64
-    cache_root.mkdir(parents=True, exist_ok=True)
-    saved = []
-    for rel in files:
-        rel_safe = "/".join([p for p in rel.split('/') if p not in ("..", "")])
-        remote = base_url.rstrip("/") + "/" + rel_safe
-        try:
-            data = fetch(remote)
-        except Exception as e:
-            return JsonResponse({"ok": False, "error": f"Failed to fetch {rel}: {e}"}, status=502)
-        dest = cache_root / rel_safe
-        dest.parent.mkdir(parents=True, exist_ok=True)
-        with open(dest, "wb") as f:
-            f.write(data)
-        saved.append(rel_safe)
-    return JsonResponse({"ok": True, "message": "Theme cached locally.", "base_b64": base_b64, "saved": saved})
+    return _theme_test_response(theme_config.validate(url))
+
+
+@login_required
+async def dice_theme_test_async(request):
+    """:func:`dice_theme_test` for ASGI: the config is fetched without blocking the event loop."""
+    url = _theme_url(request)
+    if not url:
+        return JsonResponse({"ok": False, "error": "Missing url"}, status=400)
+    return _theme_test_response(await theme_config.avalidate(url))
+
+
+def _load_base_url(request):
+    """Normalized theme base URL of a load request, or an error response."""
+    url = _theme_url(request)
+    if not url:
+        return JsonResponse({"ok": False, "error": "Missing url"}, status=400)
+    base_url = theme_cache.transform_github_base(url)
+    if urlparse(base_url).scheme not in ("http", "https"):
+        return JsonResponse({"ok": False, "error": "Unsupported scheme"}, status=400)
+    return base_url
+
+
+def _start_load(base_url: str) -> JsonResponse:
+    # A config validated moments ago (e.g. by the Test button) is reused rather than fetched again.
+    validation = theme_config.cached(base_url)
+    if validation is not None and not validation.ok:
+        return JsonResponse(
+            {"ok": False, "error": validation.error, "cached": True, "cacheAge": round(validation.age, 1)},
+            status=validation.status,
+        )
+    job, created = theme_jobs.enqueue(base_url, config_cached=validation is not None)
+    return JsonResponse(
+        {
+            "ok": True,
+            "job_id": job.pk,
+            "created": created,
+            "status": job.status,
+            "status_url": reverse("core:dice_theme_job", args=[job.pk]),
+            "base_b64": job.theme,
+        },
+        status=202,
+    )
+
+
+@login_required
+def dice_theme_load(request):
+    """Queue a background download of a theme into the local cache.
+
+    Returns immediately with a job id; loads of a theme already queued or
+    running share that job. Poll ``status_url`` for per-asset progress.
+    """
+    base_url = _load_base_url(request)
+    if isinstance(base_url, HttpResponse):
+        return base_url
+    return _start_load(base_url)
+
+
+@login_required
+async def dice_theme_load_async(request):
+    """:func:`dice_theme_load` for ASGI; the job is queued through the ORM in a worker thread."""
+    base_url = _load_base_url(request)
+    if isinstance(base_url, HttpResponse):
+        return base_url
+    return await sync_to_async(_start_load)(base_url)
+
+
+@login_required
+def dice_theme_job(request, job_id: int):
+    """Progress of a theme load job, per asset."""
+    job = ThemeJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({"ok": False, "error": "Unknown job"}, status=404)
+    done = sum(1 for asset in job.assets.values() if asset["state"] != "pending")
+    data = {
+        "ok": job.status != ThemeJob.FAILED,
+        "job_id": job.pk,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "base_b64": job.theme,
+        "progress": {"done": done, "total": len(job.assets)},
+        "assets": job.assets,
+    }
+    if job.status == ThemeJob.QUEUED and job.attempts:
+        data["retry_at"] = job.run_after.isoformat()
+    return JsonResponse(data)